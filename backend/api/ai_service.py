@@ -6,10 +6,37 @@ Models:
 - gemini-2.5-flash: For document parsing and other tasks (faster)
 """
 
+import asyncio
+import base64
+import hashlib
+import itertools
 import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import ChainMap, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterator
+
+import aiohttp
 import requests
+from asgiref.sync import sync_to_async
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from django.conf import settings
+from django.core.cache import caches
+from pydantic import TypeAdapter, ValidationError
+from requests.adapters import HTTPAdapter
+from typing_extensions import Required, TypedDict
+from urllib3.util.retry import Retry
+
+from .response_cache import response_cache
+
+logger = logging.getLogger(__name__)
 
 # Model configuration
 CHATBOT_MODEL = 'gemini-2.5-pro'
@@ -26,135 +53,394 @@ IMPORTANT GUIDELINES:
 6. Keep responses concise but informative
 7. If asked about medications, remind them to consult their doctor before making changes"""
 
+CHATBOT_GENERATION_CONFIG = {
+    'temperature': 0.7,
+    'top_p': 0.95,
+    'top_k': 40,
+    'max_output_tokens': 10000,
+}
+
+CHATBOT_SAFETY_SETTINGS = [
+    {'category': 'HARM_CATEGORY_HARASSMENT', 'threshold': 'BLOCK_NONE'},
+    {'category': 'HARM_CATEGORY_HATE_SPEECH', 'threshold': 'BLOCK_NONE'},
+    {'category': 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'threshold': 'BLOCK_NONE'},
+    {'category': 'HARM_CATEGORY_DANGEROUS_CONTENT', 'threshold': 'BLOCK_NONE'},
+]
+
+DECODO_URL = 'https://scraper-api.decodo.com/v2/scrape'
+DECODO_TIMEOUT = (3, 25)  # (connect, read) seconds
+
+# Answer after the last "ChatGPT said:" marker, up to the first page-chrome marker
+_DECODO_RE = re.compile(
+    r'.*ChatGPT said:(.*?)(?:Sources|By messaging ChatGPT|Citations|- More|Try Go, Free|\Z)',
+    re.DOTALL,
+)
+
+# Pooled keep-alive session so fallback calls reuse warm TLS connections
+_decodo_session = requests.Session()
+_decodo_session.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.3,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset(['POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    ),
+))
+
+# Per-process memo of constructed GenerativeModel instances
+MODEL_CACHE_SIZE = 64
+_MODELS: OrderedDict = OrderedDict()
+_models_lock = threading.Lock()
+
+# Hedged fallback: start Decodo if Gemini has not answered within this window
+HEDGE_DELAY_SECONDS = 4.0
+GEMINI_REQUEST_TIMEOUT = 20
+# Shared by every request; each hedge needs at most two workers
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ai-hedge')
+
+# Transient Gemini errors are retried with jittered exponential backoff before falling back
+GEMINI_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+GEMINI_MAX_ATTEMPTS = 3
+GEMINI_BACKOFF_INITIAL = 0.5
+GEMINI_BACKOFF_MAX = 4.0
+
+
+@lru_cache(maxsize=1)
+def _configure_for_key(api_key: str) -> None:
+    genai.configure(api_key=api_key)
+    with _models_lock:
+        _MODELS.clear()  # models built under a previous key hold a stale client
+
 
 def configure_genai():
-    """Configure the Google Generative AI with API key."""
+    """Configure the Google Generative AI with API key (once per key per process)."""
     api_key = settings.GEMINI_API_KEY
     if not api_key or api_key == 'your_gemini_api_key_here':
         raise Exception('Gemini API key not configured')
-    genai.configure(api_key=api_key)
+    _configure_for_key(api_key)
 
 
-def build_patient_context(onboarding_data: dict, health_summary: str = '', medical_records: list = None) -> str:
-    if not onboarding_data:
-        onboarding_data = {}
+def clear_model_cache() -> None:
+    """Forget the configured key and every memoized model."""
+    _configure_for_key.cache_clear()
+    with _models_lock:
+        _MODELS.clear()
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def get_model(model_name: str, generation_config: dict, safety_settings: list = None,
+              system_instruction: str = None):
+    """Return a memoized GenerativeModel for this exact configuration."""
+    configure_genai()
+
+    key = (
+        model_name,
+        _freeze(generation_config),
+        _freeze(safety_settings),
+        hashlib.blake2b(system_instruction.encode('utf-8')).digest() if system_instruction else None,
+    )
+
+    with _models_lock:
+        model = _MODELS.get(key)
+        if model is not None:
+            _MODELS.move_to_end(key)
+            return model
+
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        safety_settings=safety_settings,
+        system_instruction=system_instruction,
+    )
+
+    with _models_lock:
+        _MODELS[key] = model
+        while len(_MODELS) > MODEL_CACHE_SIZE:
+            _MODELS.popitem(last=False)
+    return model
+
+
+class _ProfileDefaults(dict):
+    """Fallback values for profile fields missing from onboarding data."""
+
+    def __missing__(self, key):
+        return 'Not provided'
 
-    data = onboarding_data
-    context = f"""
+
+_CONTEXT_DEFAULTS = _ProfileDefaults(symptoms_current='None reported', symptoms_past='None reported')
+
+# Fields rendered with a unit suffix only when a value is present
+_CONTEXT_UNIT_FIELDS = (
+    ('height', '{} cm'),
+    ('weight', '{} kg'),
+    ('heart_rate', '{} bpm'),
+    ('temperature_c', '{}°C'),
+    ('spo2', '{}%'),
+    ('sleep_hours', '{} hours'),
+)
+
+_CONTEXT_TEMPLATE = """
 PATIENT PROFILE:
-- Name: {data.get('full_name', 'Not provided')}
-- Age: {data.get('age', 'Not provided')}
-- Gender: {data.get('sex', 'Not provided')}
-- Location: {data.get('location', 'Not provided')}
+- Name: {full_name}
+- Age: {age}
+- Gender: {sex}
+- Location: {location}
 
 VITALS:
-- Height: {f"{data.get('height')} cm" if data.get('height') else 'Not provided'}
-- Weight: {f"{data.get('weight')} kg" if data.get('weight') else 'Not provided'}
-- Blood Pressure: {data.get('blood_pressure', 'Not provided')}
-- Heart Rate: {f"{data.get('heart_rate')} bpm" if data.get('heart_rate') else 'Not provided'}
-- Temperature: {f"{data.get('temperature_c')}°C" if data.get('temperature_c') else 'Not provided'}
-- SpO2: {f"{data.get('spo2')}%" if data.get('spo2') else 'Not provided'}
+- Height: {height}
+- Weight: {weight}
+- Blood Pressure: {blood_pressure}
+- Heart Rate: {heart_rate}
+- Temperature: {temperature_c}
+- SpO2: {spo2}
 
 MEDICAL HISTORY:
-- Past Conditions: {data.get('medical_history', 'Not provided')}
-- Past Reports: {data.get('past_reports', 'Not provided')}
-- Current Prescriptions: {data.get('prescriptions', 'Not provided')}
-- Allergies: {data.get('allergies', 'Not provided')}
-- Blood Type: {data.get('blood_type', 'Not provided')}
+- Past Conditions: {medical_history}
+- Past Reports: {past_reports}
+- Current Prescriptions: {prescriptions}
+- Allergies: {allergies}
+- Blood Type: {blood_type}
 
 CURRENT SYMPTOMS:
-- Current: {data.get('symptoms_current', 'None reported')}
-- Past Symptoms: {data.get('symptoms_past', 'None reported')}
+- Current: {symptoms_current}
+- Past Symptoms: {symptoms_past}
 
 LIFESTYLE:
-- Exercise: {data.get('exercise_frequency', 'Not provided')}
-- Diet: {data.get('diet_type', 'Not provided')}
-- Sleep: {f"{data.get('sleep_hours')} hours" if data.get('sleep_hours') else 'Not provided'}
-- Stress Level: {data.get('stress_level', 'Not provided')}
+- Exercise: {exercise_frequency}
+- Diet: {diet_type}
+- Sleep: {sleep_hours}
+- Stress Level: {stress_level}
 """
 
-    # Add health summary from parsed documents
-    if health_summary:
-        context += f"""
+_HEALTH_SUMMARY_TEMPLATE = """
 AI-GENERATED HEALTH SUMMARY (from uploaded medical documents):
-{health_summary}
+{}
 """
 
-    # Add medical records
-    if medical_records:
-        context += """
+_RECORDS_HEADER = """
 MEDICAL RECORDS (from uploaded documents):
 """
-        for record in medical_records[:20]:  # Limit to 20 most recent records
-            context += f"""
-- [{record.get('category', 'other').upper()}] {record.get('title', 'Unknown')}
-  Summary: {record.get('summary', 'No summary')}
-  Status: {record.get('status', 'unknown')}
-  Date: {record.get('record_date', 'Unknown')}
-  Details: {json.dumps(record.get('details', {})) if record.get('details') else 'None'}
+
+_RECORD_TEMPLATE = """
+- [{category}] {title}
+  Summary: {summary}
+  Status: {status}
+  Date: {record_date}
+  Details: {details}
 """
 
-    return context.strip()
 
+RECORDS_TOKEN_BUDGET = 2000
+CONTEXT_RECORD_CANDIDATES = 50  # rows fetched for ranking before the budget is applied
+RECORD_FIELD_CHAR_LIMIT = 400
+_STATUS_RANK = {'critical': 0, 'attention': 1}
 
-def call_gemini_api(messages: list, patient_context: str) -> str:
-    """Call Gemini API for chatbot using gemini-2.5-pro."""
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def _clip(value, limit: int = RECORD_FIELD_CHAR_LIMIT) -> str:
+    text = str(value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _record_day(record: dict) -> date | None:
+    value = record.get('record_date')
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _rank_records(records: list, now: date) -> list:
+    """Order records by clinical urgency first, then most recent first (undated last)."""
+    def key(record):
+        day = _record_day(record)
+        days_since = (now - day).days if day else float('inf')
+        return _STATUS_RANK.get(record.get('status'), 2), days_since
+
+    return sorted(records, key=key)
+
+
+def _format_record(record: dict) -> str:
+    details = record.get('details')
+    return _RECORD_TEMPLATE.format(
+        category=record.get('category', 'other').upper(),
+        title=_clip(record.get('title', 'Unknown')),
+        summary=_clip(record.get('summary', 'No summary')),
+        status=record.get('status', 'unknown'),
+        record_date=record.get('record_date', 'Unknown'),
+        details=_clip(json.dumps(details, separators=(',', ':'))) if details else 'None',
+    )
+
+
+def build_patient_context(onboarding_data: dict, health_summary: str = '', medical_records: list = None) -> str:
+    data = onboarding_data or {}
+    units = {
+        key: template.format(data[key]) if data.get(key) else 'Not provided'
+        for key, template in _CONTEXT_UNIT_FIELDS
+    }
+    parts = [_CONTEXT_TEMPLATE.format_map(ChainMap(units, data, _CONTEXT_DEFAULTS))]
+
+    # Add health summary from parsed documents
+    if health_summary:
+        parts.append(_HEALTH_SUMMARY_TEMPLATE.format(health_summary))
+
+    # Add medical records
+    if medical_records:
+        parts.append(_RECORDS_HEADER)
+        # Most urgent and recent records first, until the token budget is spent
+        budget = RECORDS_TOKEN_BUDGET
+        for record in _rank_records(medical_records, date.today()):
+            formatted = _format_record(record)
+            budget -= _estimate_tokens(formatted)
+            if budget < 0:
+                break
+            parts.append(formatted)
+
+    return ''.join(parts).strip()
+
+
+@lru_cache(maxsize=256)
+def _build_ctx_cached(onboarding_json: str, summary: str, records_json: str) -> str:
+    return build_patient_context(json.loads(onboarding_json), summary, json.loads(records_json))
+
+
+def get_patient_context(onboarding_data: dict, health_summary: str = '', medical_records: list = None) -> str:
+    """Render the patient context, reusing the string across turns while its inputs are unchanged."""
+    onboarding_json = json.dumps(onboarding_data or {}, sort_keys=True, default=str)
+    records_json = json.dumps(medical_records or [], sort_keys=True, default=str)
+    return _build_ctx_cached(onboarding_json, health_summary or '', records_json)
+
+
+# Gemini only knows 'user' and 'model'; every non-user role maps to 'model'
+_GEMINI_ROLES = {'user': 'user'}
+
+
+def start_gemini_chat(messages: list, patient_context: str):
+    """Build the chatbot model and chat session; returns (chat, last_message)."""
     configure_genai()
     
-    model = genai.GenerativeModel(
-        model_name=CHATBOT_MODEL,
-        generation_config={
-            'temperature': 0.7,
-            'top_p': 0.95,
-            'top_k': 40,
-            'max_output_tokens': 10000,
-        },
-        safety_settings=[
-            {'category': 'HARM_CATEGORY_HARASSMENT', 'threshold': 'BLOCK_NONE'},
-            {'category': 'HARM_CATEGORY_HATE_SPEECH', 'threshold': 'BLOCK_NONE'},
-            {'category': 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'threshold': 'BLOCK_NONE'},
-            {'category': 'HARM_CATEGORY_DANGEROUS_CONTENT', 'threshold': 'BLOCK_NONE'},
-        ],
-        system_instruction=f"{SYSTEM_PROMPT}\n\n{patient_context}"
+    model = get_model(
+        CHATBOT_MODEL,
+        CHATBOT_GENERATION_CONFIG,
+        CHATBOT_SAFETY_SETTINGS,
+        system_instruction=f"{SYSTEM_PROMPT}\n\n{patient_context}",
     )
     
-    # Build chat history
-    history = []
-    for msg in messages[:-1]:  # All except the last message
-        history.append({
-            'role': 'user' if msg['role'] == 'user' else 'model',
-            'parts': [msg['content']]
-        })
+    # Build chat history from all but the last message
+    history = [
+        {'role': _GEMINI_ROLES.get(msg['role'], 'model'), 'parts': (msg['content'],)}
+        for msg in messages[:-1]
+    ]
     
     chat = model.start_chat(history=history)
-    
-    # Send the last message
     last_message = messages[-1]['content'] if messages else "Hello"
-    response = chat.send_message(last_message)
-    
-    return response.text
+    return chat, last_message
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff for the given zero-based attempt, plus up to one initial step of jitter."""
+    delay = GEMINI_BACKOFF_INITIAL * (2 ** attempt) + random.uniform(0, GEMINI_BACKOFF_INITIAL)
+    return min(delay, GEMINI_BACKOFF_MAX)
+
+
+def call_gemini_api(messages: list, patient_context: str) -> str:
+    """Call Gemini API for chatbot using gemini-2.5-pro."""
+    chat, last_message = start_gemini_chat(messages, patient_context)
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        try:
+            response = chat.send_message(last_message, request_options={'timeout': GEMINI_REQUEST_TIMEOUT})
+            return response.text
+        except GEMINI_RETRYABLE_ERRORS:
+            if attempt == GEMINI_MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(_backoff_delay(attempt))
+
+
+async def call_gemini_api_async(messages: list, patient_context: str) -> str:
+    """Async chatbot call; the event loop stays free while Gemini generates."""
+    # Chat setup may configure the SDK and create a context cache over the network
+    chat, last_message = await sync_to_async(start_gemini_chat, thread_sensitive=False)(messages, patient_context)
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        try:
+            response = await chat.send_message_async(
+                last_message,
+                request_options={'timeout': GEMINI_REQUEST_TIMEOUT}
+            )
+            return response.text
+        except GEMINI_RETRYABLE_ERRORS:
+            if attempt == GEMINI_MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(_backoff_delay(attempt))
+
+
+def call_gemini_api_stream(messages: list, patient_context: str) -> Iterator[str]:
+    """Stream the chatbot reply from gemini-2.5-pro chunk by chunk."""
+    chat, last_message = start_gemini_chat(messages, patient_context)
+    response = chat.send_message(
+        last_message,
+        stream=True,
+        request_options={'timeout': GEMINI_REQUEST_TIMEOUT}
+    )
+    for chunk in response:
+        if chunk.parts:
+            yield chunk.text
+
+
+def build_utility_model(max_tokens: int = 2048, temperature: float = 0.3):
+    """Build the Gemini utility model (gemini-2.5-flash)."""
+    return get_model(UTILITY_MODEL, {
+        'temperature': temperature,
+        'max_output_tokens': max_tokens,
+    })
 
 
 def call_utility_model(prompt: str, max_tokens: int = 2048, temperature: float = 0.3) -> str:
     """Call Gemini utility model (gemini-2.5-flash) for parsing and other tasks."""
-    configure_genai()
-    
-    model = genai.GenerativeModel(
-        model_name=UTILITY_MODEL,
-        generation_config={
-            'temperature': temperature,
-            'max_output_tokens': max_tokens,
-        }
-    )
-    
+    model = build_utility_model(max_tokens, temperature)
     response = model.generate_content(prompt)
     return response.text
 
 
-def call_decodo_fallback(messages: list, patient_context: str) -> str:
-    """Fallback to Decodo if Gemini fails."""
-    import requests
-    
+async def call_utility_model_async(prompt: str, max_tokens: int = 2048, temperature: float = 0.3) -> str:
+    """Async variant of call_utility_model."""
+    model = await sync_to_async(build_utility_model, thread_sensitive=False)(max_tokens, temperature)
+    response = await model.generate_content_async(prompt)
+    return response.text
+
+
+def call_utility_model_stream(prompt: str, max_tokens: int = 2048, temperature: float = 0.3) -> Iterator[str]:
+    """Stream the utility model output for callers that can consume partial text."""
+    model = build_utility_model(max_tokens, temperature)
+    for chunk in model.generate_content(prompt, stream=True):
+        if chunk.parts:
+            yield chunk.text
+
+
+def build_decodo_request(messages: list, patient_context: str) -> tuple[dict, dict]:
+    """Build the (headers, payload) pair for a Decodo ChatGPT scrape."""
     auth_token = settings.DECODO_AUTH_TOKEN
     if not auth_token:
         raise Exception('Decodo auth token not configured')
@@ -180,52 +466,210 @@ Patient's question: {last_user_message}
 
 Please provide helpful health advice based on this information."""
 
-    response = requests.post(
-        'https://scraper-api.decodo.com/v2/scrape',
-        headers={
-            'accept': 'application/json',
-            'content-type': 'application/json',
-            'authorization': auth_token
-        },
-        json={
-            'target': 'chatgpt',
-            'prompt': prompt,
-            'search': True,
-            'geo': 'India',
-            'markdown': True
-        },
-        timeout=30
+    headers = {
+        'accept': 'application/json',
+        'content-type': 'application/json',
+        'authorization': auth_token
+    }
+    payload = {
+        'target': 'chatgpt',
+        'prompt': prompt,
+        'search': True,
+        'geo': 'India',
+        'markdown': True
+    }
+    return headers, payload
+
+
+def extract_decodo_content(data: dict) -> str:
+    """Pull the assistant's answer out of a Decodo scrape result."""
+    content = data.get('results', [{}])[0].get('content') or data.get('content') or ''
+
+    match = _DECODO_RE.match(content)
+    if match:
+        content = match.group(1).strip()
+
+    return content if content else 'Sorry, I could not generate a response.'
+
+
+def call_decodo_fallback(messages: list, patient_context: str) -> str:
+    """Fallback to Decodo if Gemini fails."""
+    headers, payload = build_decodo_request(messages, patient_context)
+
+    response = _decodo_session.post(
+        DECODO_URL,
+        headers=headers,
+        json=payload,
+        timeout=DECODO_TIMEOUT
     )
 
     if not response.ok:
         raise Exception(f'Decodo API error: {response.status_code}')
 
-    data = response.json()
-    content = data.get('results', [{}])[0].get('content') or data.get('content') or ''
+    return extract_decodo_content(response.json())
+
+
+async def call_decodo_fallback_async(messages: list, patient_context: str) -> str:
+    """Async Decodo fallback over aiohttp."""
+    headers, payload = build_decodo_request(messages, patient_context)
+    timeout = aiohttp.ClientTimeout(connect=DECODO_TIMEOUT[0], sock_read=DECODO_TIMEOUT[1])
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.post(DECODO_URL, headers=headers, json=payload) as response:
+            if not response.ok:
+                raise Exception(f'Decodo API error: {response.status}')
+            data = await response.json()
+
+    return extract_decodo_content(data)
+
+
+def normalize_documents(documents: list) -> list:
+    """Decode base64 image payloads to raw bytes once so every parser can reuse them."""
+    normalized = []
+    for doc in documents:
+        if doc['type'] == 'image' and isinstance(doc['data'], str):
+            doc = {**doc, 'data': base64.b64decode(doc['data'])}
+        normalized.append(doc)
+    return normalized
+
+
+DOCUMENT_CHAR_LIMIT = 10000
+
+# Part of every parse cache key; bump whenever a parse prompt changes so cached
+# results produced by the old wording are not served for another week
+PARSE_PROMPT_VERSION = 1
+
+
+def build_document_parts(instruction: str, documents: list) -> list:
+    """Build Gemini content parts, merging consecutive text documents into one part."""
+    parts = [instruction]
     
-    if 'ChatGPT said:' in content:
-        parts = content.split('ChatGPT said:')
-        if len(parts) > 1:
-            ai_response = parts[-1]
-            for stop_marker in ['Sources', 'By messaging ChatGPT', 'Citations', '- More', 'Try Go, Free']:
-                if stop_marker in ai_response:
-                    ai_response = ai_response.split(stop_marker)[0]
-            content = ai_response.strip()
+    for is_image, group in itertools.groupby(normalize_documents(documents), key=lambda d: d['type'] == 'image'):
+        if is_image:
+            for doc in group:
+                parts.append({'mime_type': doc['mime_type'], 'data': doc['data']})
+                parts.append(f"[Image: {doc['name']}]")
+        else:
+            parts.append('\n---\n'.join(
+                f"Document: {doc['name']}\n{doc['content'][:DOCUMENT_CHAR_LIMIT]}" for doc in group
+            ))
     
-    return content if content else 'Sorry, I could not generate a response.'
+    return parts
+
+
+def _parse_cache_key(kind: str, documents: list, current_summary: str) -> str:
+    """Content address for a parse: parser kind, prompt and schema version, model, prior summary and document payloads."""
+    digest = hashlib.blake2b(digest_size=16)
+    for piece in (kind, str(PARSE_PROMPT_VERSION), _PARSE_SCHEMA_FINGERPRINTS[kind], UTILITY_MODEL, current_summary or ''):
+        digest.update(piece.encode('utf-8') + b'\0')
+    for doc in documents:
+        if doc['type'] == 'image':
+            digest.update(doc['mime_type'].encode('utf-8') + b'\0')
+            digest.update(doc['data'])
+        else:
+            digest.update(doc['content'][:DOCUMENT_CHAR_LIMIT].encode('utf-8'))
+        digest.update(b'\0')
+    return f'{kind}:{digest.hexdigest()}'
+
+
+# Response schemas for Gemini JSON mode. Gemini cannot express free-form maps,
+# so record details travel as name/value pairs and are folded back into a dict.
+class DocumentParseResult(TypedDict, total=False):
+    medical_history: str
+    past_reports: str
+    prescriptions: str
+    symptoms_current: str
+    blood_pressure: str
+    heart_rate: str
+    temperature_c: str
+    spo2: str
+    blood_type: str
+    allergies: str
+    conditions: str
+    doctor_notes: str
+    diagnosis: str
+    treatment_plan: str
+    health_summary: str
+
+
+class RecordDetail(TypedDict):
+    name: str
+    value: str
+
+
+class ParsedRecord(TypedDict, total=False):
+    category: Required[str]
+    title: Required[str]
+    summary: str
+    details: list[RecordDetail]
+    doctor: str
+    facility: str
+    record_date: str
+    status: str
+
+
+class ProfileUpdates(TypedDict, total=False):
+    blood_pressure: str
+    heart_rate: str
+    allergies: str
+    blood_type: str
+    medications: str
+
+
+class RecordsParseResult(TypedDict, total=False):
+    records: Required[list[ParsedRecord]]
+    health_summary: Required[str]
+    profile_updates: ProfileUpdates
+
+
+_document_parse_adapter = TypeAdapter(DocumentParseResult)
+_records_parse_adapter = TypeAdapter(RecordsParseResult)
+
+# Schema changes invalidate cached parses on their own, without a version bump
+_PARSE_SCHEMA_FINGERPRINTS = {
+    kind: hashlib.blake2b(json.dumps(adapter.json_schema(), sort_keys=True).encode('utf-8'), digest_size=8).hexdigest()
+    for kind, adapter in (('document', _document_parse_adapter), ('records', _records_parse_adapter))
+}
+
+
+def _validate_or_repair(adapter: TypeAdapter, schema, text: str, label: str):
+    """Validate a parser response, giving malformed output one cheap repair pass before giving up."""
+    try:
+        return adapter.validate_json(text)
+    except ValidationError as e:
+        logger.warning('%s parse returned invalid JSON, attempting repair: %s', label, e)
+
+    model = get_model(UTILITY_MODEL, {
+        'temperature': 0.0,
+        'max_output_tokens': max(1024, len(text) // 2),
+        'response_mime_type': 'application/json',
+        'response_schema': schema,
+    })
+    try:
+        fixed = model.generate_content(
+            f'Fix this malformed JSON so it is valid and matches the response schema. '
+            f'Keep all of its data and return only the JSON.\n\nInput:\n{text}'
+        )
+        return adapter.validate_json(fixed.text)
+    except Exception as e:
+        logger.warning('%s parse repair failed: %s', label, e)
+        return None
 
 
 def parse_document_with_gemini(documents: list, current_data: dict, current_summary: str = '') -> dict:
     """Parse medical documents and extract health information using Gemini."""
-    configure_genai()
-    
-    model = genai.GenerativeModel(
-        model_name=UTILITY_MODEL,
-        generation_config={
-            'temperature': 0.2,
-            'max_output_tokens': 2048,
-        }
-    )
+    documents = normalize_documents(documents)
+    cache_key = _parse_cache_key('document', documents, current_summary)
+    cached = caches['parse'].get(cache_key)
+    if cached is not None:
+        return cached
+
+    model = get_model(UTILITY_MODEL, {
+        'temperature': 0.2,
+        'max_output_tokens': 2048,
+        'response_mime_type': 'application/json',
+        'response_schema': DocumentParseResult,
+    })
     
     instruction = f"""You are a medical document parser. Analyze the provided medical documents (prescriptions, lab reports, medical records, appointment notes) and extract relevant health information.
 
@@ -252,53 +696,34 @@ Extract and return a JSON object with these fields:
 }}
 
 IMPORTANT: 
-- Only return valid JSON, no markdown or explanation
 - Only include fields where you found actual data
 - Be concise but accurate
 - The health_summary MUST be included and should be comprehensive"""
 
-    # Build content parts
-    parts = [instruction]
+    response = model.generate_content(build_document_parts(instruction, documents))
     
-    for doc in documents:
-        if doc['type'] == 'image':
-            import base64
-            parts.append({
-                'mime_type': doc['mime_type'],
-                'data': doc['data']
-            })
-            parts.append(f"[Image: {doc['name']}]")
-        else:
-            parts.append(f"Document: {doc['name']}\n{doc['content'][:10000]}")
-
-    response = model.generate_content(parts)
-    text = response.text.strip()
-    
-    # Clean up markdown if present
-    if text.startswith('```'):
-        text = text.split('\n', 1)[1] if '\n' in text else text[3:]
-    if text.endswith('```'):
-        text = text[:-3]
-    text = text.strip()
-    
-    try:
-        parsed = json.loads(text)
-        return parsed if isinstance(parsed, dict) else {}
-    except:
+    parsed = _validate_or_repair(_document_parse_adapter, DocumentParseResult, response.text, 'Document')
+    if parsed is None:
         return {}
+    
+    caches['parse'].set(cache_key, parsed)
+    return parsed
 
 
 def parse_document_to_records(documents: list, current_summary: str = '') -> dict:
     """Parse medical documents and extract individual medical records with categorization."""
-    configure_genai()
-    
-    model = genai.GenerativeModel(
-        model_name=UTILITY_MODEL,
-        generation_config={
-            'temperature': 0.2,
-            'max_output_tokens': 4096,
-        }
-    )
+    documents = normalize_documents(documents)
+    cache_key = _parse_cache_key('records', documents, current_summary)
+    cached = caches['parse'].get(cache_key)
+    if cached is not None:
+        return cached
+
+    model = get_model(UTILITY_MODEL, {
+        'temperature': 0.2,
+        'max_output_tokens': 4096,
+        'response_mime_type': 'application/json',
+        'response_schema': RecordsParseResult,
+    })
     
     instruction = f"""You are a medical document parser. Analyze the provided medical documents and extract INDIVIDUAL medical records.
 
@@ -314,7 +739,7 @@ Return a JSON object with this structure:
             "category": "lab_reports|prescriptions|diagnoses|vitals|imaging|other",
             "title": "Name/title of the record (e.g., 'Complete Blood Count', 'Metformin 500mg', 'Chest X-Ray')",
             "summary": "Brief description of findings or purpose",
-            "details": {{"key": "value"}} - specific measurements, dosages, or findings,
+            "details": [{{"name": "key", "value": "value"}}] - specific measurements, dosages, or findings,
             "doctor": "Doctor's name if mentioned",
             "facility": "Hospital/clinic name if mentioned",
             "record_date": "YYYY-MM-DD format if date is found, null otherwise",
@@ -357,57 +782,156 @@ STATUS GUIDE:
 - critical: Significantly abnormal, requires immediate attention
 
 IMPORTANT:
-- Only return valid JSON, no markdown
 - Extract EACH distinct record as a separate item
 - Be specific with titles"""
 
-    # Build content parts
-    parts = [instruction]
-    
-    for doc in documents:
-        if doc['type'] == 'image':
-            parts.append({
-                'mime_type': doc['mime_type'],
-                'data': doc['data']
-            })
-            parts.append(f"[Image: {doc['name']}]")
-        else:
-            parts.append(f"Document: {doc['name']}\n{doc['content'][:10000]}")
-
-    response = model.generate_content(parts)
-    text = response.text.strip()
-    
-    # Clean up markdown if present
-    if text.startswith('```'):
-        text = text.split('\n', 1)[1] if '\n' in text else text[3:]
-    if text.endswith('```'):
-        text = text[:-3]
-    text = text.strip()
+    response = model.generate_content(build_document_parts(instruction, documents))
     
-    try:
-        parsed = json.loads(text)
-        return parsed if isinstance(parsed, dict) else {'records': [], 'health_summary': '', 'profile_updates': {}}
-    except:
+    parsed = _validate_or_repair(_records_parse_adapter, RecordsParseResult, response.text, 'Record')
+    if parsed is None:
         return {'records': [], 'health_summary': '', 'profile_updates': {}}
+    
+    for record in parsed['records']:
+        record['details'] = {d['name']: d['value'] for d in record.get('details', [])}
+    parsed.setdefault('profile_updates', {})
+    caches['parse'].set(cache_key, parsed)
+    return parsed
 
 
 def get_ai_response(messages: list, onboarding_data: dict, health_summary: str = '', medical_records: list = None) -> str:
     """Main function to get AI response for chat."""
-    patient_context = build_patient_context(onboarding_data, health_summary, medical_records)
+    patient_context = get_patient_context(onboarding_data, health_summary, medical_records)
+
+    # Repeat questions in the same conversation state skip the LLM entirely
+    cached = response_cache.get(messages, patient_context)
+    if cached is not None:
+        return cached
+
+    gemini_key = settings.GEMINI_API_KEY
+    gemini_enabled = bool(gemini_key) and gemini_key != 'your_gemini_api_key_here'
+    decodo_enabled = bool(settings.DECODO_AUTH_TOKEN)
+
+    # Hedged request: Gemini goes first, Decodo starts once Gemini errors or
+    # misses the hedge window, and whichever succeeds first wins.
+    gemini_future = None
+    if gemini_enabled:
+        gemini_future = _hedge_executor.submit(call_gemini_api, messages, patient_context)
+        wait([gemini_future], timeout=HEDGE_DELAY_SECONDS)
+
+    decodo_future = None
+    gemini_struggling = (
+        gemini_future is None
+        or not gemini_future.done()
+        or gemini_future.exception() is not None
+    )
+    if decodo_enabled and gemini_struggling:
+        decodo_future = _hedge_executor.submit(call_decodo_fallback, messages, patient_context)
+
+    pending = {f for f in (gemini_future, decodo_future) if f is not None}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response_text = future.result()
+            except Exception as e:
+                if future is gemini_future:
+                    logger.warning('Gemini failed, trying Decodo fallback: %s', e)
+                else:
+                    logger.warning('Decodo fallback also failed: %s', e)
+                continue
+
+            # A losing call that is already running cannot be cancelled: it keeps
+            # its worker until it returns or hits its own timeout, and its result
+            # is discarded. cancel() only drops one that has not started yet.
+            for loser in pending:
+                loser.cancel()
+            if future is gemini_future:
+                response_cache.put(messages, patient_context, response_text)
+            return response_text
+
+    raise Exception('AI services are unavailable. Please try again later.')
+
+
+async def aget_ai_response(messages: list, onboarding_data: dict, health_summary: str = '', medical_records: list = None) -> str:
+    """Async get_ai_response: the same cache and Gemini/Decodo hedge on one event loop."""
+    patient_context = get_patient_context(onboarding_data, health_summary, medical_records)
+
+    cached = response_cache.get(messages, patient_context)
+    if cached is not None:
+        return cached
+
+    gemini_key = settings.GEMINI_API_KEY
+    gemini_enabled = bool(gemini_key) and gemini_key != 'your_gemini_api_key_here'
+    decodo_enabled = bool(settings.DECODO_AUTH_TOKEN)
+
+    gemini_task = None
+    if gemini_enabled:
+        gemini_task = asyncio.create_task(call_gemini_api_async(messages, patient_context))
+        await asyncio.wait({gemini_task}, timeout=HEDGE_DELAY_SECONDS)
+
+    decodo_task = None
+    gemini_struggling = (
+        gemini_task is None
+        or not gemini_task.done()
+        or gemini_task.exception() is not None
+    )
+    if decodo_enabled and gemini_struggling:
+        decodo_task = asyncio.create_task(call_decodo_fallback_async(messages, patient_context))
+
+    pending = {t for t in (gemini_task, decodo_task) if t is not None}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    response_text = task.result()
+                except Exception as e:
+                    if task is gemini_task:
+                        logger.warning('Gemini failed, trying Decodo fallback: %s', e)
+                    else:
+                        logger.warning('Decodo fallback also failed: %s', e)
+                    continue
+
+                if task is gemini_task:
+                    response_cache.put(messages, patient_context, response_text)
+                return response_text
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise Exception('AI services are unavailable. Please try again later.')
+
+
+def stream_ai_response(messages: list, onboarding_data: dict, health_summary: str = '', medical_records: list = None) -> Iterator[str]:
+    """Streaming variant of get_ai_response for clients that render tokens as they arrive."""
+    patient_context = get_patient_context(onboarding_data, health_summary, medical_records)
+
+    cached = response_cache.get(messages, patient_context)
+    if cached is not None:
+        yield cached
+        return
 
-    # Step 1: Try Gemini first (primary)
     gemini_key = settings.GEMINI_API_KEY
     if gemini_key and gemini_key != 'your_gemini_api_key_here':
+        chunks = []
         try:
-            return call_gemini_api(messages, patient_context)
+            for chunk in call_gemini_api_stream(messages, patient_context):
+                chunks.append(chunk)
+                yield chunk
         except Exception as e:
-            print(f'Gemini failed, trying Decodo fallback: {e}')
+            # Once text has reached the client we cannot switch providers mid-answer
+            if chunks:
+                raise
+            logger.warning('Gemini stream failed, trying Decodo fallback: %s', e)
+        else:
+            response_cache.put(messages, patient_context, ''.join(chunks))
+            return
 
-    # Step 2: Fallback to Decodo if Gemini failed
     if settings.DECODO_AUTH_TOKEN:
         try:
-            return call_decodo_fallback(messages, patient_context)
+            yield call_decodo_fallback(messages, patient_context)
+            return
         except Exception as e:
-            print(f'Decodo fallback also failed: {e}')
+            logger.warning('Decodo fallback also failed: %s', e)
 
     raise Exception('AI services are unavailable. Please try again later.')
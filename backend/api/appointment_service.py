@@ -8,39 +8,119 @@ This service handles:
 4. Updating appointment records with confirmed details
 """
 
-import json
+import logging
+import math
+import random
 import re
-import google.generativeai as genai
-from datetime import datetime, date, time
-from typing import Optional
+import threading
+import time as time_module
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from datetime import datetime, date, time, timedelta
+from functools import lru_cache
+from typing import Iterator, Optional
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from twilio.twiml.voice_response import VoiceResponse, Gather
+
+from .ai_service import get_model
+from .response_cache import normalize_question
+
+logger = logging.getLogger(__name__)
 
 # Model for appointment calls (use flash for speed)
 APPOINTMENT_MODEL = 'gemini-2.0-flash'
 
+# Request deadlines (seconds) per latency tier. Live-call turns must answer
+# well inside Twilio's speech gather window; post-call work can wait.
+REQUEST_TIMEOUTS = {
+    'priority': 8,
+    'standard': 30,
+    'flex': 120,
+}
+
+# Transcript scanning patterns, compiled once at import
+_DOCTOR_RE = re.compile(r'(?:dr\.?|doctor)\s+([a-zA-Z]+)', re.IGNORECASE)
+_TIME_RE = re.compile(r'(\d{1,2})[:\s]?(\d{2})?\s*(a\.?m\.?|p\.?m\.?)', re.IGNORECASE)
+_CONFIRM_RE = re.compile(r'\b(?:confirmed|booked|scheduled|appointment is set)\b', re.IGNORECASE)
+_REL_DATE_RE = re.compile(r'\b(day after tomorrow|tomorrow|today)\b', re.IGNORECASE)
+_REL_DATE_OFFSETS = {'day after tomorrow': 2, 'tomorrow': 1, 'today': 0}  # most specific first
+
+# Live-call cues (plain substring semantics, as one alternation each)
+_SPEECH_CONFIRM_RE = re.compile(
+    r'confirmed|booked|scheduled|appointment is|see you|tomorrow at|today at|available at',
+    re.IGNORECASE,
+)
+_SPEECH_END_RE = re.compile(r'goodbye|thank you|have a nice day|bye', re.IGNORECASE)
+_AI_END_RE = re.compile(r'goodbye|thank you|bye', re.IGNORECASE)
+_SENTENCE_END_RE = re.compile(r'(?<!\bDr)(?<!\bMr)(?<!\bMs)(?<!\bMrs)[.!?](?=\s)')
+
+# In-call replies are generated off the webhook thread. A reply that misses
+# INTERIM_REPLY_WAIT is published to the default cache when it finishes, and
+# the call-next webhook (on whichever worker Twilio reaches) claims it there.
+# Until it lands, call-next answers with a short <Pause> and redirects to
+# itself, so Twilio holds the line rather than a worker sleeping on it.
+# Running more than one worker process therefore needs a shared CACHE_URL.
+INTERIM_REPLY_WAIT = 2.5  # seconds
+PENDING_REPLY_PAUSE = 1  # seconds Twilio pauses between call-next checks
+PENDING_REPLY_TIMEOUT = 120  # seconds a published reply waits to be collected
+# Turns older than the verbatim window are folded into a short running summary
+# (off the webhook thread) once they grow past HISTORY_SUMMARY_TOKENS, so prompts
+# stay bounded on long calls
+CALL_HISTORY_WINDOW = 6  # most recent turns always sent verbatim
+HISTORY_SUMMARY_TOKENS = 1500
+
+# Columns a call turn writes, and those written when the call ends
+# (the transcript is derived from call_history, and only stored once the call ends)
+_TURN_FIELDS = ['call_history', 'updated_at']
+_OUTCOME_FIELDS = ['call_transcript', 'status', 'appointment_date', 'appointment_time', 'doctor_name', 'department', 'notes']
+_reply_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='call-reply')
+
+# Models come from ai_service's shared cache, one per system instruction (None
+# for the plain utility prompts); a call's preamble stays the same on every turn,
+# so turns share a model
+APPOINTMENT_GENERATION_CONFIG = {'temperature': 0.7}
+
+
+def _get_model(system_instruction: str = None):
+    """
+    Return the shared appointment model for this system instruction. Per-call
+    settings such as max_output_tokens go to generate_content instead of
+    rebuilding the model.
+    """
+    return get_model(APPOINTMENT_MODEL, APPOINTMENT_GENERATION_CONFIG,
+                     system_instruction=system_instruction)
 
-def configure_genai():
-    """Configure the Google Generative AI with API key."""
-    api_key = settings.GEMINI_API_KEY
-    if not api_key or api_key == 'your_gemini_api_key_here':
-        raise Exception('Gemini API key not configured')
-    genai.configure(api_key=api_key)
 
+@lru_cache(maxsize=16)
+def _unquote(value: str) -> str:
+    """Strip the quotes .env files sometimes leave around values; memoized per raw value."""
+    return value.strip("'\"")
 
-def get_twilio_client():
-    """Get configured Twilio client."""
+
+@lru_cache(maxsize=1)
+def _twilio_client_for(account_sid: str, auth_token: str):
     from twilio.rest import Client
     
+    return Client(_unquote(account_sid), _unquote(auth_token))
+
+
+def get_twilio_client():
+    """
+    Get configured Twilio client. One client is shared per process (rebuilt
+    only if the credentials change) so its HTTP session keeps connections
+    to api.twilio.com alive between calls.
+    """
     account_sid = settings.TWILIO_ACCOUNT_SID
     auth_token = settings.TWILIO_AUTH_TOKEN
     
     if not account_sid or not auth_token:
         raise ValueError("Twilio credentials not configured")
     
-    account_sid = account_sid.strip("'\"")
-    auth_token = auth_token.strip("'\"")
-    
-    return Client(account_sid, auth_token)
+    return _twilio_client_for(account_sid, auth_token)
 
 
 def get_phone_number_to_call(hospital_phone: str) -> str:
@@ -50,117 +130,333 @@ def get_phone_number_to_call(hospital_phone: str) -> str:
     """
     test_number = settings.TEST_PHONE_NUMBER
     if test_number:
-        return test_number.strip("'\"")
+        return _unquote(test_number)
     return hospital_phone
 
 
-def call_gemini_for_appointment(prompt: str, max_tokens: int = 2048) -> str:
-    """Call Gemini API for appointment-related tasks using gemini-2.5-flash."""
-    configure_genai()
+def call_gemini_for_appointment(prompt: str, max_tokens: int = 2048,
+                                system_instruction: str = None,
+                                tier: str = 'standard',
+                                response_schema: dict = None) -> str:
+    """
+    Call Gemini API for appointment-related tasks using gemini-2.5-flash.
+    `tier` picks the request deadline: 'priority' for live-call turns,
+    'flex' for post-call work that is not latency critical. With a
+    `response_schema` the reply is JSON conforming to it.
+    """
+    generation_config = {'max_output_tokens': max_tokens}
+    if response_schema:
+        generation_config.update(response_mime_type='application/json', response_schema=response_schema)
     
-    model = genai.GenerativeModel(
-        model_name=APPOINTMENT_MODEL,
-        generation_config={
-            'temperature': 0.7,
-            'max_output_tokens': max_tokens,
-        }
+    model = _get_model(system_instruction)
+    response = model.generate_content(
+        prompt,
+        generation_config=generation_config,
+        request_options={'timeout': REQUEST_TIMEOUTS[tier]}
     )
-    
-    response = model.generate_content(prompt)
     return response.text
 
 
-def generate_ai_response(hospital_name: str, patient_info: dict, 
-                         purpose: str, conversation_history: list,
-                         hospital_response: str = None,
-                         is_initial: bool = False) -> str:
+def call_gemini_for_appointment_stream(prompt: str, max_tokens: int = 2048,
+                                       system_instruction: str = None,
+                                       tier: str = 'standard') -> Iterator[str]:
+    """Streaming variant of call_gemini_for_appointment; yields text chunks as they arrive."""
+    model = _get_model(system_instruction)
+    response = model.generate_content(
+        prompt,
+        stream=True,
+        generation_config={'max_output_tokens': max_tokens},
+        request_options={'timeout': REQUEST_TIMEOUTS[tier]}
+    )
+    for chunk in response:
+        if chunk.parts:
+            yield chunk.text
+
+
+def build_call_preamble(hospital_name: str, patient_name: str,
+                        patient_age, symptoms: str) -> str:
     """
-    Generate AI response for the phone conversation using Gemini.
+    Stable system instruction for a call: identical on every turn, so Gemini can
+    reuse its prefix cache and each turn only sends the conversation delta.
     """
-    patient_name = patient_info.get('full_name', 'Patient')
-    patient_age = patient_info.get('age', 'Not specified')
-    symptoms = patient_info.get('symptoms_current', purpose) or purpose or 'General consultation'
-    
-    if is_initial:
-        prompt = f"""You are an AI assistant making a phone call to {hospital_name} to book a medical appointment.
+    return f"""You are an AI assistant on a phone call with {hospital_name}, booking a medical appointment on behalf of a patient.
 
 Patient Details:
 - Name: {patient_name}
 - Age: {patient_age}
-- Symptoms: {symptoms}
+- Reason for visit: {symptoms}
+
+Be polite, concise and professional.
+If they offer an appointment slot, accept it and confirm the details.
+If they ask for information, provide it from the patient details.
+If the appointment is confirmed, thank them and say goodbye.
+Reply with just the spoken text, nothing else."""
+
+
+def _format_turns(turns: list) -> str:
+    return "\n".join(
+        f"{'Hospital' if turn['role'] == 'hospital' else 'You'}: {turn['text']}"
+        for turn in turns
+    )
+
+
+def _estimate_tokens(turns: list) -> int:
+    return sum(len(turn['text']) for turn in turns) // 4
+
+
+def summarize_call_history(previous_summary: str, turns: list) -> str:
+    """Fold older call turns into the running summary, keeping the facts that matter for booking."""
+    prompt = f"""Summarize the following hospital appointment conversation in 2 sentences, preserving proposed dates, times and doctor names.
+
+Earlier summary: {previous_summary or 'None'}
+
+Conversation:
+{_format_turns(turns)}
+
+Summary:"""
+    try:
+        return call_gemini_for_appointment(prompt, max_tokens=200, tier='priority').strip()
+    except Exception as e:
+        logger.warning("Gemini API error summarizing call: %s", e)
+        return previous_summary
+
+
+def _unsummarized_turns(appointment) -> list:
+    """Turns not yet folded into appointment.history_summary; sent verbatim with the next prompt."""
+    return appointment.call_history[appointment.history_summarized_turns:]
+
+
+def _schedule_history_fold(appointment) -> None:
+    """
+    Once unsummarized turns beyond the verbatim window exceed
+    HISTORY_SUMMARY_TOKENS, fold them into the running summary on a worker
+    thread. The webhook never waits on it; the next turn picks up the result.
+    """
+    history = appointment.call_history
+    start = appointment.history_summarized_turns
+    window_start = max(start, len(history) - CALL_HISTORY_WINDOW)
+    
+    older = history[start:window_start]
+    if older and _estimate_tokens(older) > HISTORY_SUMMARY_TOKENS:
+        _reply_executor.submit(_fold_in_background, appointment.id, appointment.history_summary,
+                               start, window_start, older)
+
+
+def _store_history_fold(appointment_id: int, previous_summary: str, start: int,
+                        window_start: int, older: list) -> None:
+    """Summarize older turns and store the result, unless another fold already covered them."""
+    from .models import Appointment
+    
+    summary = summarize_call_history(previous_summary, older)
+    Appointment.objects.filter(id=appointment_id, history_summarized_turns=start).update(
+        history_summary=summary, history_summarized_turns=window_start
+    )
+
+
+def _fold_in_background(*args) -> None:
+    try:
+        _store_history_fold(*args)
+    except Exception as e:
+        logger.warning("Error folding call history: %s", e)
+    finally:
+        connection.close()  # pool threads outlive any request, so release the connection here
 
-Generate ONLY the opening statement. Be polite and professional.
-Keep it to 2-3 sentences. Include:
+
+def _dedupe_turns(turns: list) -> list:
+    """
+    Drop turns repeated word for word later in the call by the same speaker,
+    keeping the later one. Only case and punctuation are ignored: a changed
+    time or a "not" makes it a different turn.
+    """
+    seen = set()
+    kept = []
+    for turn in reversed(turns):
+        key = (turn['role'], normalize_question(turn['text']))
+        if key not in seen:
+            seen.add(key)
+            kept.append(turn)
+    kept.reverse()
+    return kept
+
+
+def _turn_request(hospital_name: str, patient_info: dict, purpose: str,
+                  conversation_history: list, hospital_response: str,
+                  is_initial: bool, history_summary: str = '') -> tuple:
+    """Build (system instruction, prompt, canned fallback reply) for one call turn."""
+    patient_name = patient_info.get('full_name', 'Patient')
+    patient_age = patient_info.get('age', 'Not specified')
+    symptoms = patient_info.get('symptoms_current', purpose) or purpose or 'General consultation'
+    
+    preamble = build_call_preamble(hospital_name, patient_name, patient_age, symptoms)
+    
+    if is_initial:
+        prompt = """Generate ONLY the opening statement, 2-3 sentences. Include:
 1. Greeting and that you're calling on behalf of the patient
 2. Mention the symptoms/reason for visit
-3. Request to book an appointment
-
-Response (just the spoken text, nothing else):"""
+3. Request to book an appointment"""
+        fallback = f"Hello, I am calling on behalf of {patient_name} to book an appointment. Could you please help me with that?"
     else:
-        history_text = "\n".join([
-            f"{'Hospital' if i % 2 == 0 else 'You'}: {msg}" 
-            for i, msg in enumerate(conversation_history)
-        ])
+        earlier = f"Earlier in the call: {history_summary}\n\n" if history_summary else ''
         
-        prompt = f"""You are an AI assistant on a phone call with {hospital_name} booking an appointment.
-
-Patient Details:
-- Name: {patient_name}
-- Age: {patient_age}
-- Reason for visit: {symptoms}
-
-Conversation so far:
-{history_text}
+        prompt = f"""{earlier}Conversation so far:
+{_format_turns(conversation_history)}
 
 Hospital just said: "{hospital_response}"
 
-Generate your next response. Be concise and professional.
-If they offer an appointment slot, accept it and confirm the details.
-If they ask for information, provide it from the patient details.
-If the appointment is confirmed, thank them and say goodbye.
-
-Your response (just the spoken text, nothing else):"""
+Your next response:"""
+        fallback = "Yes, please proceed. What time slots do you have available?"
     
+    return preamble, prompt, fallback
+
+
+def generate_ai_response(hospital_name: str, patient_info: dict, 
+                         purpose: str, conversation_history: list,
+                         hospital_response: str = None,
+                         is_initial: bool = False,
+                         history_summary: str = '') -> str:
+    """
+    Generate AI response for the phone conversation using Gemini.
+    """
+    preamble, prompt, fallback = _turn_request(hospital_name, patient_info, purpose,
+                                               conversation_history, hospital_response, is_initial,
+                                               history_summary)
+    try:
+        return call_gemini_for_appointment(prompt, system_instruction=preamble, tier='priority')
+    except Exception as e:
+        logger.warning("Gemini API error in call: %s", e)
+        return fallback
+
+
+def generate_ai_response_stream(hospital_name: str, patient_info: dict,
+                                purpose: str, conversation_history: list,
+                                hospital_response: str = None,
+                                is_initial: bool = False,
+                                history_summary: str = '') -> Iterator[str]:
+    """Streaming variant of generate_ai_response; falls back only if nothing was produced."""
+    preamble, prompt, fallback = _turn_request(hospital_name, patient_info, purpose,
+                                               conversation_history, hospital_response, is_initial,
+                                               history_summary)
+    produced = False
     try:
-        return call_gemini_for_appointment(prompt)
+        for chunk in call_gemini_for_appointment_stream(prompt, system_instruction=preamble, tier='priority'):
+            produced = True
+            yield chunk
     except Exception as e:
-        print(f"Gemini API error in call: {e}")
-        if is_initial:
-            return f"Hello, I am calling on behalf of {patient_name} to book an appointment. Could you please help me with that?"
-        return "Yes, please proceed. What time slots do you have available?"
+        logger.warning("Gemini API error in call: %s", e)
+        if not produced:
+            yield fallback
+
+
+class _StreamedReply:
+    """A call reply filling in on a worker thread; readable while it streams."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._text = ''
+        self.done = threading.Event()
+    
+    @property
+    def text(self) -> str:
+        with self._lock:
+            return self._text
+    
+    def fill(self, chunks: Iterator[str]) -> None:
+        try:
+            for chunk in chunks:
+                with self._lock:
+                    self._text += chunk
+        finally:
+            self.done.set()
+    
+    def complete_sentences(self) -> str:
+        """The prefix of the reply that ends on a sentence boundary, or ''."""
+        text = self.text
+        end = 0
+        for match in _SENTENCE_END_RE.finditer(text):
+            end = match.end()
+        return text[:end].strip()
+
+
+# Fields Gemini can be asked for, with the format each must come back in
+_DETAIL_FIELDS = {
+    'appointment_confirmed': 'boolean (true if appointment was successfully booked)',
+    'appointment_date': 'string in YYYY-MM-DD format (or null if not mentioned)',
+    'appointment_time': 'string in HH:MM format 24-hour (or null if not mentioned)',
+    'doctor_name': 'string (or null if not mentioned)',
+    'department': 'string (or null if not mentioned)',
+    'notes': 'string with any other relevant information',
+}
+
+_DETAIL_FIELD_LINES = "\n".join(f"- {key}: {spec}" for key, spec in _DETAIL_FIELDS.items())
+
+_SIMULATION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'transcript': {'type': 'string'},
+        'appointment_confirmed': {'type': 'boolean'},
+        'appointment_date': {'type': 'string', 'nullable': True},
+        'appointment_time': {'type': 'string', 'nullable': True},
+        'doctor_name': {'type': 'string', 'nullable': True},
+        'department': {'type': 'string', 'nullable': True},
+        'notes': {'type': 'string'},
+    },
+    'required': ['transcript', 'appointment_confirmed'],
+}
+
+
+def _regex_hints(transcript: str) -> dict:
+    """
+    Date, time and doctor the regex extractor spotted, in the JSON shape Gemini
+    returns. Confirmation is left out: a slot being mentioned is not a booking.
+    """
+    fast = extract_appointment_details_fast(transcript)
+    hints = {}
+    if fast['appointment_date']:
+        hints['appointment_date'] = fast['appointment_date'].strftime('%Y-%m-%d')
+    if fast['appointment_time']:
+        hints['appointment_time'] = fast['appointment_time'].strftime('%H:%M')
+    if fast['doctor_name']:
+        hints['doctor_name'] = fast['doctor_name']
+    return hints
 
 
 def extract_appointment_details(transcript: str, hospital_name: str) -> dict:
     """
-    Use Gemini to extract appointment details from the call transcript.
+    Extract appointment details from the call transcript.
+    
+    Gemini decides every field, including whether the booking was confirmed.
+    The regex extractor's findings are passed along as hints to check, and are
+    returned (unconfirmed) only if Gemini cannot be reached.
     """
+    hints = _regex_hints(transcript)
+    hint_lines = "\n".join(f"- {key}: {value}" for key, value in hints.items()) or "- none"
+    
     prompt = f"""Analyze this phone call transcript where someone is booking a hospital appointment at {hospital_name}.
 
 Transcript:
 {transcript}
 
 Extract the following information if mentioned. Return a JSON object with these fields:
-- appointment_confirmed: boolean (true if appointment was successfully booked)
-- appointment_date: string in YYYY-MM-DD format (or null if not mentioned)
-- appointment_time: string in HH:MM format 24-hour (or null if not mentioned)
-- doctor_name: string (or null if not mentioned)
-- department: string (or null if not mentioned)
-- notes: string with any other relevant information
+{_DETAIL_FIELD_LINES}
+
+A quick pattern match suggested the values below. Verify each one against the transcript:
+the hospital may have declined that slot or offered a different one.
+{hint_lines}
 
 Return ONLY the JSON object, no other text:"""
 
     try:
-        result_text = call_gemini_for_appointment(prompt)
+        result_text = call_gemini_for_appointment(prompt, tier='flex')
         
-        if result_text.startswith('```'):
-            result_text = re.sub(r'^```json?\n?', '', result_text)
-            result_text = re.sub(r'\n?```$', '', result_text)
+        # Tolerate a markdown fence around the JSON
+        result_text = result_text.strip().removeprefix('```json').removeprefix('```').removesuffix('```')
         
-        return json.loads(result_text)
+        extracted = orjson.loads(result_text)
+        return {key: extracted[key] for key in _DETAIL_FIELDS if key in extracted}
         
     except Exception as e:
-        print(f"Error extracting appointment details: {e}")
-        return {}
+        logger.warning("Error extracting appointment details: %s", e)
+        return hints
 
 
 def simulate_appointment_booking(appointment_id: int, patient_info: dict) -> dict:
@@ -169,13 +465,11 @@ def simulate_appointment_booking(appointment_id: int, patient_info: dict) -> dic
     Uses Gemini to simulate the conversation.
     """
     from .models import Appointment
-    import time as time_module
-    import random
     
     try:
         appointment = Appointment.objects.get(id=appointment_id)
         appointment.status = 'calling'
-        appointment.save()
+        appointment.save(update_fields=['status', 'updated_at'])
         
         time_module.sleep(2)
         
@@ -195,18 +489,20 @@ Include realistic details like:
 - Department
 - Any instructions
 
-Format each line as:
+Format each line of the transcript as:
 AI: [what AI says]
 Receptionist: [what receptionist says]
 
 End with a confirmed appointment date and time (use dates within the next 2 weeks from today {date.today().strftime('%Y-%m-%d')}).
 
-Conversation:"""
+Return a JSON object with the full conversation in "transcript" and the booked appointment's details:
+{_DETAIL_FIELD_LINES}"""
         
-        transcript = call_gemini_for_appointment(prompt)
+        # One structured call returns both the conversation and its details
+        result = orjson.loads(call_gemini_for_appointment(prompt, tier='flex', response_schema=_SIMULATION_SCHEMA))
+        transcript = result.get('transcript', '')
         appointment.call_transcript = transcript
-        
-        details = extract_appointment_details(transcript, appointment.hospital_name)
+        details = result
         
         if details.get('appointment_confirmed', True):
             appointment.status = 'confirmed'
@@ -217,10 +513,8 @@ Conversation:"""
                         details['appointment_date'], '%Y-%m-%d'
                     ).date()
                 except:
-                    from datetime import timedelta
                     appointment.appointment_date = date.today() + timedelta(days=random.randint(2, 14))
             else:
-                from datetime import timedelta
                 appointment.appointment_date = date.today() + timedelta(days=random.randint(2, 14))
             
             if details.get('appointment_time'):
@@ -254,12 +548,11 @@ Conversation:"""
         }
         
     except Exception as e:
-        print(f"Simulation error: {e}")
+        logger.exception("Simulation error: %s", e)
         try:
-            appointment = Appointment.objects.get(id=appointment_id)
-            appointment.status = 'failed'
-            appointment.notes = f'Simulation failed: {str(e)}'
-            appointment.save()
+            Appointment.objects.filter(id=appointment_id).update(
+                status='failed', notes=f'Simulation failed: {str(e)}', updated_at=timezone.now()
+            )
         except:
             pass
         
@@ -279,28 +572,14 @@ def initiate_appointment_call(appointment_id: int, hospital_phone: str,
     Initiate an outbound call to the hospital for appointment booking.
     """
     from .models import Appointment
-    from twilio.twiml.voice_response import VoiceResponse, Gather
     
+    opening = None
     try:
-        client = get_twilio_client()
-        phone_to_call = get_phone_number_to_call(hospital_phone)
-        from_number = settings.TWILIO_PHONE_NUMBER.strip("'\"")
-        
         appointment = Appointment.objects.get(id=appointment_id)
-        appointment.status = 'calling'
-        appointment.save()
-        
-        response = VoiceResponse()
-        
-        gather = Gather(
-            input='speech',
-            action=f'{callback_url}/api/appointments/call-response/{appointment_id}/',
-            method='POST',
-            speech_timeout='auto',
-            language='en-IN'
-        )
         
-        initial_message = generate_ai_response(
+        # Generate the opening line while Twilio setup and the status update run
+        opening = _reply_executor.submit(
+            generate_ai_response,
             appointment.hospital_name,
             patient_info,
             purpose,
@@ -308,6 +587,18 @@ def initiate_appointment_call(appointment_id: int, hospital_phone: str,
             is_initial=True
         )
         
+        client = get_twilio_client()
+        phone_to_call = get_phone_number_to_call(hospital_phone)
+        from_number = _unquote(settings.TWILIO_PHONE_NUMBER)
+        
+        appointment.status = 'calling'
+        appointment.save(update_fields=['status', 'updated_at'])
+        
+        response = VoiceResponse()
+        gather = _build_gather(appointment_id, callback_url)
+        
+        initial_message = opening.result()
+        
         gather.say(initial_message, voice='Polly.Aditi', language='en-IN')
         response.append(gather)
         
@@ -325,7 +616,8 @@ def initiate_appointment_call(appointment_id: int, hospital_phone: str,
         )
         
         appointment.call_sid = call.sid
-        appointment.save()
+        appointment.call_history = [{'role': 'ai', 'text': initial_message}]
+        appointment.save(update_fields=['call_sid', 'call_history', 'updated_at'])
         
         return {
             'success': True,
@@ -335,11 +627,12 @@ def initiate_appointment_call(appointment_id: int, hospital_phone: str,
         }
         
     except Exception as e:
+        if opening is not None:
+            opening.cancel()
         try:
-            appointment = Appointment.objects.get(id=appointment_id)
-            appointment.status = 'failed'
-            appointment.notes = f'Call initiation failed: {str(e)}'
-            appointment.save()
+            Appointment.objects.filter(id=appointment_id).update(
+                status='failed', notes=f'Call initiation failed: {str(e)}', updated_at=timezone.now()
+            )
         except:
             pass
         
@@ -354,105 +647,196 @@ def process_call_response(appointment_id: int, speech_result: str,
                           callback_url: str) -> str:
     """
     Process the hospital's response and generate the next AI response.
+    
+    The reply streams in on a worker thread. If it is not finished within
+    INTERIM_REPLY_WAIT, Twilio gets whatever complete sentences are ready
+    (or a short filler line) plus a redirect to the call-next webhook, which
+    speaks the rest once it lands, so the hospital never hears dead air.
     """
     from .models import Appointment
-    from twilio.twiml.voice_response import VoiceResponse, Gather
     
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
+        appointment = Appointment.objects.select_related('profile').get(id=appointment_id)
         
         patient_info = appointment.profile.onboarding_data or {}
         patient_info['full_name'] = appointment.profile.full_name
         
-        current_transcript = appointment.call_transcript or ''
-        current_transcript += f"\nHospital: {speech_result}"
-        
-        history = [line.split(': ', 1)[1] for line in current_transcript.strip().split('\n') if ': ' in line]
+        # The new utterance is passed separately from the history
+        history = _dedupe_turns(_unsummarized_turns(appointment))
+        appointment.call_history.append({'role': 'hospital', 'text': speech_result})
         
         # Check if appointment seems confirmed from speech
-        speech_lower = speech_result.lower()
-        confirmation_keywords = ['confirmed', 'booked', 'scheduled', 'appointment is', 'see you', 'tomorrow at', 'today at', 'available at']
-        appointment_confirmed_in_speech = any(kw in speech_lower for kw in confirmation_keywords)
-        
-        end_keywords = ['goodbye', 'thank you', 'have a nice day', 'bye']
-        should_end = any(kw in speech_lower for kw in end_keywords) or appointment_confirmed_in_speech
+        appointment_confirmed_in_speech = bool(_SPEECH_CONFIRM_RE.search(speech_result))
+        should_end = appointment_confirmed_in_speech or bool(_SPEECH_END_RE.search(speech_result))
         
-        ai_response = generate_ai_response(
+        reply = _StreamedReply()
+        filling = _reply_executor.submit(reply.fill, generate_ai_response_stream(
             appointment.hospital_name,
             patient_info,
             appointment.purpose,
             history,
             hospital_response=speech_result,
-            is_initial=False
-        )
+            is_initial=False,
+            history_summary=appointment.history_summary
+        ))
         
-        current_transcript += f"\nAI: {ai_response}"
-        appointment.call_transcript = current_transcript
-        appointment.save()
+        if reply.done.wait(INTERIM_REPLY_WAIT):
+            return _complete_turn(appointment, reply.text,
+                                  appointment_confirmed_in_speech, should_end, callback_url)
         
-        response = VoiceResponse()
+        appointment.save(update_fields=_TURN_FIELDS)
         
-        ai_lower = ai_response.lower()
-        ai_ends_call = 'goodbye' in ai_lower or 'thank you' in ai_lower or 'bye' in ai_lower
+        spoken = reply.complete_sentences()
+        filling.add_done_callback(lambda _: cache.set(_pending_reply_key(appointment_id), {
+            'token': uuid.uuid4().hex,
+            'text': reply.text,
+            'spoken': spoken,
+            'confirmed_in_speech': appointment_confirmed_in_speech,
+            'should_end': should_end,
+        }, PENDING_REPLY_TIMEOUT))
         
-        if should_end or ai_ends_call:
-            response.say(ai_response, voice='Polly.Aditi', language='en-IN')
-            response.hangup()
-            
-            # Extract details - use simpler regex-based extraction for speed
-            details = extract_appointment_details_fast(current_transcript)
-            
-            # If we detected confirmation keywords, mark as confirmed
-            if appointment_confirmed_in_speech or details.get('appointment_confirmed'):
-                appointment.status = 'confirmed'
-                appointment.appointment_date = details.get('appointment_date')
-                appointment.appointment_time = details.get('appointment_time')
-                appointment.doctor_name = details.get('doctor_name', '')
-                appointment.department = details.get('department', 'General Medicine')
-                appointment.notes = 'Appointment confirmed via AI call'
-            else:
-                appointment.status = 'failed'
-                appointment.notes = 'Appointment could not be confirmed'
-            
-            appointment.save()
-        else:
-            gather = Gather(
-                input='speech',
-                action=f'{callback_url}/api/appointments/call-response/{appointment_id}/',
-                method='POST',
-                speech_timeout='auto',
-                language='en-IN'
-            )
-            gather.say(ai_response, voice='Polly.Aditi', language='en-IN')
+        response = VoiceResponse()
+        response.say(spoken or "One moment, please.", voice='Polly.Aditi', language='en-IN')
+        response.redirect(f'{callback_url}/api/appointments/call-next/{appointment_id}/')
+        return str(response)
+        
+    except Exception as e:
+        return _call_error_twiml(appointment_id, e)
+
+
+def _pending_reply_key(appointment_id: int) -> str:
+    return f'call-reply:{appointment_id}'
+
+
+def _take_pending_reply(appointment_id: int) -> Optional[dict]:
+    """
+    Claim the deferred reply if it has been published, else None.
+    
+    cache.add on a per-reply token is the atomic claim: if Twilio retries
+    call-next against two workers, only one of them speaks the reply.
+    """
+    key = _pending_reply_key(appointment_id)
+    pending = cache.get(key)
+    if pending is None or not cache.add(f"{key}:claimed:{pending['token']}", True, PENDING_REPLY_TIMEOUT):
+        return None
+    cache.delete(key)
+    return pending
+
+
+def _pending_reply_polls() -> int:
+    """How many PENDING_REPLY_PAUSE rounds call-next waits before giving up on a reply."""
+    return math.ceil((REQUEST_TIMEOUTS['priority'] + INTERIM_REPLY_WAIT) / PENDING_REPLY_PAUSE)
+
+
+def process_call_next(appointment_id: int, callback_url: str, attempt: int = 0) -> str:
+    """Speak the rest of a reply that process_call_response left streaming."""
+    from .models import Appointment
+    
+    try:
+        pending = _take_pending_reply(appointment_id)
+        
+        if pending is None and attempt < _pending_reply_polls():
+            # Still generating: hold the line on Twilio's side and check again
+            response = VoiceResponse()
+            response.pause(length=PENDING_REPLY_PAUSE)
+            response.redirect(f'{callback_url}/api/appointments/call-next/{appointment_id}/'
+                              f'?attempt={attempt + 1}')
+            return str(response)
+        
+        if pending is None:
+            # The reply never arrived (or was already served)
+            response = VoiceResponse()
+            gather = _build_gather(appointment_id, callback_url)
+            gather.say("Sorry, could you please repeat that?", voice='Polly.Aditi', language='en-IN')
             response.append(gather)
-            
-            response.say("I didn't catch that. Could you please repeat?",
-                        voice='Polly.Aditi', language='en-IN')
             response.redirect(f'{callback_url}/api/appointments/call-retry/{appointment_id}/')
+            return str(response)
         
-        return str(response)
+        appointment = Appointment.objects.get(id=appointment_id)
+        return _complete_turn(appointment, pending['text'], pending['confirmed_in_speech'],
+                              pending['should_end'], callback_url, already_spoken=pending['spoken'])
         
     except Exception as e:
-        import traceback
-        print(f"Error processing call response: {e}")
-        traceback.print_exc()
+        return _call_error_twiml(appointment_id, e)
+
+
+def _build_gather(appointment_id: int, callback_url: str) -> Gather:
+    return Gather(
+        input='speech',
+        action=f'{callback_url}/api/appointments/call-response/{appointment_id}/',
+        method='POST',
+        speech_timeout='auto',
+        language='en-IN'
+    )
+
+
+def _complete_turn(appointment, ai_response: str, appointment_confirmed_in_speech: bool,
+                   should_end: bool, callback_url: str, already_spoken: str = '') -> str:
+    """Record the AI's reply and build the TwiML that speaks whatever was not yet said."""
+    appointment.call_history.append({'role': 'ai', 'text': ai_response})
+    update_fields = list(_TURN_FIELDS)
+    
+    response = VoiceResponse()
+    
+    ai_ends_call = bool(_AI_END_RE.search(ai_response))
+    to_say = ai_response.strip()[len(already_spoken):].strip()
+    
+    if should_end or ai_ends_call:
+        if to_say:
+            response.say(to_say, voice='Polly.Aditi', language='en-IN')
+        response.hangup()
         
-        # Try to mark appointment as failed
-        try:
-            from .models import Appointment
-            appointment = Appointment.objects.get(id=appointment_id)
+        # Extract details - use simpler regex-based extraction for speed
+        appointment.call_transcript = appointment.history_transcript()
+        details = extract_appointment_details_fast(appointment.call_transcript)
+        
+        # If we detected confirmation keywords, mark as confirmed
+        if appointment_confirmed_in_speech or details.get('appointment_confirmed'):
+            appointment.status = 'confirmed'
+            appointment.appointment_date = details.get('appointment_date')
+            appointment.appointment_time = details.get('appointment_time')
+            appointment.doctor_name = details.get('doctor_name', '')
+            appointment.department = details.get('department', 'General Medicine')
+            appointment.notes = 'Appointment confirmed via AI call'
+        else:
             appointment.status = 'failed'
-            appointment.notes = f'Call error: {str(e)}'
-            appointment.save()
-        except:
-            pass
+            appointment.notes = 'Appointment could not be confirmed'
+        update_fields += _OUTCOME_FIELDS
+    else:
+        gather = _build_gather(appointment.id, callback_url)
+        if to_say:
+            gather.say(to_say, voice='Polly.Aditi', language='en-IN')
+        response.append(gather)
         
-        from twilio.twiml.voice_response import VoiceResponse
-        response = VoiceResponse()
-        response.say("I apologize, there was a technical issue. Thank you for your time. Goodbye.", 
+        response.say("I didn't catch that. Could you please repeat?",
                     voice='Polly.Aditi', language='en-IN')
-        response.hangup()
-        return str(response)
+        response.redirect(f'{callback_url}/api/appointments/call-retry/{appointment.id}/')
+    
+    appointment.save(update_fields=update_fields)
+    if not (should_end or ai_ends_call):
+        _schedule_history_fold(appointment)
+    return str(response)
+
+
+def _call_error_twiml(appointment_id: int, error: Exception) -> str:
+    from .models import Appointment
+    
+    # Called from the webhooks' except blocks, so the traceback is still available
+    logger.exception("Error processing call response: %s", error)
+    
+    # Try to mark appointment as failed
+    try:
+        Appointment.objects.filter(id=appointment_id).update(
+            status='failed', notes=f'Call error: {str(error)}', updated_at=timezone.now()
+        )
+    except:
+        pass
+    
+    response = VoiceResponse()
+    response.say("I apologize, there was a technical issue. Thank you for your time. Goodbye.", 
+                voice='Polly.Aditi', language='en-IN')
+    response.hangup()
+    return str(response)
 
 
 def extract_appointment_details_fast(transcript: str) -> dict:
@@ -460,9 +844,6 @@ def extract_appointment_details_fast(transcript: str) -> dict:
     Fast regex-based extraction of appointment details.
     Avoids slow Gemini API call for real-time response.
     """
-    import re
-    from datetime import timedelta
-    
     result = {
         'appointment_confirmed': False,
         'appointment_date': None,
@@ -471,19 +852,17 @@ def extract_appointment_details_fast(transcript: str) -> dict:
         'department': 'General Medicine'
     }
     
-    transcript_lower = transcript.lower()
-    
     # Check for confirmation
-    if any(kw in transcript_lower for kw in ['confirmed', 'booked', 'scheduled', 'appointment is set']):
+    if _CONFIRM_RE.search(transcript):
         result['appointment_confirmed'] = True
     
     # Extract doctor name
-    doctor_match = re.search(r'(?:dr\.?|doctor)\s+([a-zA-Z]+)', transcript, re.IGNORECASE)
+    doctor_match = _DOCTOR_RE.search(transcript)
     if doctor_match:
         result['doctor_name'] = f"Dr. {doctor_match.group(1).title()}"
     
     # Extract time
-    time_match = re.search(r'(\d{1,2})[:\s]?(\d{2})?\s*(a\.?m\.?|p\.?m\.?)', transcript, re.IGNORECASE)
+    time_match = _TIME_RE.search(transcript)
     if time_match:
         hour = int(time_match.group(1))
         minute = int(time_match.group(2)) if time_match.group(2) else 0
@@ -496,16 +875,13 @@ def extract_appointment_details_fast(transcript: str) -> dict:
         
         result['appointment_time'] = time(hour, minute)
     
-    # Extract date - look for "tomorrow", "today", or specific dates
-    if 'tomorrow' in transcript_lower:
-        result['appointment_date'] = date.today() + timedelta(days=1)
-        result['appointment_confirmed'] = True
-    elif 'today' in transcript_lower:
-        result['appointment_date'] = date.today()
-        result['appointment_confirmed'] = True
-    elif 'day after tomorrow' in transcript_lower:
-        result['appointment_date'] = date.today() + timedelta(days=2)
-        result['appointment_confirmed'] = True
+    # Extract date - the most specific relative day mentioned anywhere wins
+    mentioned = {m.lower() for m in _REL_DATE_RE.findall(transcript)}
+    for phrase, offset in _REL_DATE_OFFSETS.items():
+        if phrase in mentioned:
+            result['appointment_date'] = date.today() + timedelta(days=offset)
+            result['appointment_confirmed'] = True
+            break
     
     return result
 
@@ -519,19 +895,90 @@ def update_call_status(appointment_id: int, call_status: str,
     
     try:
         appointment = Appointment.objects.get(id=appointment_id)
+        update_fields = []
         
         if call_duration:
             appointment.call_duration = call_duration
+            update_fields.append('call_duration')
         
         if call_status == 'completed':
             if appointment.status == 'calling':
                 appointment.status = 'failed'
                 appointment.notes = 'Call ended without confirmation'
+                update_fields += ['status', 'notes']
         elif call_status in ['busy', 'no-answer', 'failed', 'canceled']:
             appointment.status = 'failed'
             appointment.notes = f'Call {call_status}'
+            update_fields += ['status', 'notes']
         
-        appointment.save()
+        if appointment.status == 'failed' and not appointment.call_transcript and appointment.call_history:
+            # The call ended without a closing turn; store its transcript for re-extraction
+            appointment.call_transcript = appointment.history_transcript()
+            update_fields.append('call_transcript')
+        
+        if update_fields:
+            appointment.save(update_fields=update_fields + ['updated_at'])
         
     except Exception as e:
-        print(f"Error updating call status: {e}")
+        logger.exception("Error updating call status: %s", e)
+
+
+# ============ Offline re-extraction (nightly sweeps, backfills) ============
+
+BATCH_EXTRACT_WORKERS = 4
+# Only calls that never reached an outcome are re-analysed; confirmed and
+# cancelled appointments are final and must not be flipped by a re-read
+REEXTRACT_STATUSES = ('failed', 'calling')
+_EXTRACTED_FIELDS = ['status', 'appointment_date', 'appointment_time', 'doctor_name',
+                     'department', 'notes', 'updated_at']
+
+
+def _apply_extracted_details(appointment, details: dict) -> bool:
+    """Copy confirmed details onto the appointment; returns whether anything was applied."""
+    if not details.get('appointment_confirmed'):
+        return False
+    
+    appointment.status = 'confirmed'
+    try:
+        appointment.appointment_date = datetime.strptime(details['appointment_date'], '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        appointment.appointment_time = datetime.strptime(details['appointment_time'], '%H:%M').time()
+    except (KeyError, TypeError, ValueError):
+        pass
+    appointment.doctor_name = details.get('doctor_name') or appointment.doctor_name
+    appointment.department = details.get('department') or appointment.department or 'General Medicine'
+    appointment.notes = details.get('notes') or 'Appointment confirmed on transcript re-analysis'
+    appointment.updated_at = timezone.now()
+    return True
+
+
+def batch_extract_appointment_details(appointment_ids: list) -> int:
+    """
+    Re-run detail extraction over stored call transcripts and write every
+    confirmed result back in one bulk UPDATE. Extractions run concurrently
+    on the flex tier. Ids whose status is not in REEXTRACT_STATUSES are skipped.
+    Returns the number of appointments updated.
+    """
+    from .models import Appointment
+    
+    appointments = list(
+        Appointment.objects.filter(id__in=appointment_ids, status__in=REEXTRACT_STATUSES)
+        .exclude(call_transcript='')
+    )
+    if not appointments:
+        return 0
+    
+    with ThreadPoolExecutor(max_workers=BATCH_EXTRACT_WORKERS, thread_name_prefix='batch-extract') as pool:
+        results = list(pool.map(
+            lambda appointment: extract_appointment_details(appointment.transcript, appointment.hospital_name),
+            appointments
+        ))
+    
+    updated = [
+        appointment for appointment, details in zip(appointments, results)
+        if _apply_extracted_details(appointment, details)
+    ]
+    Appointment.objects.bulk_update(updated, _EXTRACTED_FIELDS)
+    return len(updated)
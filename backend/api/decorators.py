@@ -3,6 +3,7 @@ from __future__ import annotations
 from functools import wraps
 from typing import Any, Callable, TypeVar
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.http import HttpRequest, JsonResponse
 
 from .supabase_auth import get_supabase_user
@@ -11,26 +12,45 @@ from .supabase_auth import get_supabase_user
 F = TypeVar('F', bound=Callable[..., Any])
 
 
-def supabase_required(view_func: F) -> F:
-    @wraps(view_func)
-    def wrapped(request: HttpRequest, *args: Any, **kwargs: Any):
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            return JsonResponse({'detail': 'Missing bearer token'}, status=401)
+def _authenticate(request: HttpRequest) -> JsonResponse | None:
+    """Attach the Supabase user to the request, or return the error response."""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return JsonResponse({'detail': 'Missing bearer token'}, status=401)
+
+    access_token = auth_header.split(' ', 1)[1].strip()
+    if not access_token:
+        return JsonResponse({'detail': 'Missing bearer token'}, status=401)
+
+    try:
+        user = get_supabase_user(access_token)
+    except RuntimeError as e:
+        return JsonResponse({'detail': str(e)}, status=500)
 
-        access_token = auth_header.split(' ', 1)[1].strip()
-        if not access_token:
-            return JsonResponse({'detail': 'Missing bearer token'}, status=401)
+    if user is None:
+        return JsonResponse({'detail': 'Invalid token'}, status=401)
 
-        try:
-            user = get_supabase_user(access_token)
-        except RuntimeError as e:
-            return JsonResponse({'detail': str(e)}, status=500)
+    request.supabase_user = user  # type: ignore[attr-defined]
+    return None
 
-        if user is None:
-            return JsonResponse({'detail': 'Invalid token'}, status=401)
 
-        request.supabase_user = user  # type: ignore[attr-defined]
+def supabase_required(view_func: F) -> F:
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapped(request: HttpRequest, *args: Any, **kwargs: Any):
+            # Token verification does blocking network I/O; keep it off the event loop
+            error = await sync_to_async(_authenticate, thread_sensitive=False)(request)
+            if error is not None:
+                return error
+            return await view_func(request, *args, **kwargs)
+
+        return async_wrapped  # type: ignore[return-value]
+
+    @wraps(view_func)
+    def wrapped(request: HttpRequest, *args: Any, **kwargs: Any):
+        error = _authenticate(request)
+        if error is not None:
+            return error
         return view_func(request, *args, **kwargs)
 
     return wrapped  # type: ignore[return-value]
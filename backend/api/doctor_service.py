@@ -1,26 +1,126 @@
-import requests
+import asyncio
+import contextlib
+import hashlib
+import json
+import threading
+from functools import lru_cache
+
+import aiohttp
 from django.conf import settings
+from django.core.cache import cache
 from typing import Optional
 from datetime import datetime, timedelta
 
+from .ai_service import GEMINI_MAX_ATTEMPTS, _backoff_delay
+
 GEMINI_MODEL = 'gemini-2.0-flash'
+TIMELINE_MODEL = 'gemini-2.5-flash-lite'  # structured extraction; the case summary keeps GEMINI_MODEL
+GEMINI_CONNECTION_LIMIT = 10
+AI_RESULT_CACHE_TIMEOUT = 60 * 60 * 24  # seconds
+GEMINI_RETRY_STATUSES = {429, 503}
+TIMELINE_SOURCE_FIELDS = ('symptoms_current', 'symptoms_past', 'conditions', 'medical_history')
 
 
-def generate_ai_case_summary(patient_data: dict, appointment_reason: str = '') -> str:
-    """Generate AI case summary for doctor using Gemini."""
+def _gemini_api_key() -> Optional[str]:
+    """The configured Gemini key, or None when unset or left as the placeholder."""
     api_key = settings.GEMINI_API_KEY
-    if not api_key or api_key == 'your_gemini_api_key_here':
-        return 'AI summarization unavailable - API key not configured.'
+    return api_key if api_key and api_key != 'your_gemini_api_key_here' else None
+
+
+@lru_cache(maxsize=8)
+def _gemini_url(api_key: str, model: str = GEMINI_MODEL, method: str = 'generateContent') -> str:
+    url = f'https://generativelanguage.googleapis.com/v1beta/models/{model}:{method}?key={api_key}'
+    return url + '&alt=sse' if method == 'streamGenerateContent' else url
+
+
+def _ai_cache_key(kind: str, formatted_data: str, appointment_reason: str = '', model: str = GEMINI_MODEL) -> str:
+    """Content address for an AI result: the exact prompt data the model sees."""
+    digest = hashlib.blake2b(digest_size=16)
+    for piece in (kind, model, formatted_data, appointment_reason):
+        digest.update(piece.encode('utf-8') + b'\0')
+    return f'doctor-ai:{kind}:{digest.hexdigest()}'
+
+
+# Gemini calls run on one long-lived event loop so a single keep-alive session (and its
+# TLS connections) is reused across requests instead of re-handshaking every call.
+_gemini_loop = None
+_gemini_client = None
+_gemini_loop_lock = threading.Lock()
+# Caps in-flight Gemini calls across all requests so bursts queue instead of tripping rate limits
+_gemini_slots = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENCY)
+
+
+def _run(coro):
+    """Run a coroutine on the shared Gemini event loop and wait for its result."""
+    global _gemini_loop
+    with _gemini_loop_lock:
+        if _gemini_loop is None:
+            _gemini_loop = asyncio.new_event_loop()
+            threading.Thread(target=_gemini_loop.run_forever, name='doctor-gemini', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _gemini_loop).result()
+
+
+def _gemini_session() -> aiohttp.ClientSession:
+    """Pooled keep-alive session shared by every Gemini call; only use it on the shared loop."""
+    global _gemini_client
+    if _gemini_client is None or _gemini_client.closed:
+        _gemini_client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=GEMINI_CONNECTION_LIMIT))
+    return _gemini_client
+
+
+async def _gemini_post(session: aiohttp.ClientSession, url: str, payload: dict, timeout: float) -> tuple[int, dict]:
+    """POST to Gemini and return (status, JSON body); the body is empty on errors."""
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        async with _gemini_slots:
+            async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.ok:
+                    return response.status, await response.json()
+                status = response.status
+        if status not in GEMINI_RETRY_STATUSES or attempt == GEMINI_MAX_ATTEMPTS - 1:
+            return status, {}
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
+async def _gemini_stream(session: aiohttp.ClientSession, url: str, payload: dict, timeout: float):
+    """POST to Gemini's SSE stream endpoint and yield text chunks as they arrive."""
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        async with _gemini_slots:
+            async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.ok:
+                    async for line in response.content:
+                        if line.startswith(b'data:'):
+                            yield _response_text(json.loads(line[5:]), '')
+                    return
+                status = response.status
+        if status not in GEMINI_RETRY_STATUSES or attempt == GEMINI_MAX_ATTEMPTS - 1:
+            raise Exception(f'Gemini API error: {status}')
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
+def _strip_code_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return text.strip()
+
+
+def _response_text(data: dict, default: Optional[str] = None) -> Optional[str]:
+    return data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', default)
 
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}'
 
-    prompt = f"""You are a medical AI assistant helping doctors prepare for patient consultations.
-Generate a comprehensive case summary for the doctor based on the patient data below.
+def generate_ai_case_summary(patient_data: dict, appointment_reason: str = '') -> str:
+    """Generate AI case summary for doctor using Gemini."""
+    async def run():
+        return await agenerate_ai_case_summary(_gemini_session(), patient_data, appointment_reason)
+    return _run(run())
 
-PATIENT DATA:
-{_format_patient_data(patient_data)}
 
-APPOINTMENT REASON: {appointment_reason if appointment_reason else 'General consultation'}
+# Fixed case-summary instructions, sent as the system instruction so every request
+# shares an identical prefix and only the patient-specific part varies.
+CASE_SUMMARY_INSTRUCTIONS = """You are a medical AI assistant helping doctors prepare for patient consultations.
+Generate a comprehensive case summary for the doctor based on the patient data provided.
 
 Generate a structured case summary with the following sections:
 
@@ -64,10 +164,42 @@ Keep the summary concise but comprehensive. Use bullet points for readability.
 Highlight any critical or urgent findings.
 """
 
+
+class _SummaryUnavailable(Exception):
+    """Raised with the user-facing message when a case summary cannot be generated."""
+
+
+async def agenerate_ai_case_summary(session: aiohttp.ClientSession, patient_data: dict, appointment_reason: str = '') -> str:
+    """Async case summary over a shared aiohttp session."""
+    try:
+        return await _fetch_case_summary(session, patient_data, appointment_reason)
+    except _SummaryUnavailable as e:
+        return str(e)
+
+
+async def _fetch_case_summary(session: aiohttp.ClientSession, patient_data: dict, appointment_reason: str) -> str:
+    api_key = _gemini_api_key()
+    if not api_key:
+        raise _SummaryUnavailable('AI summarization unavailable - API key not configured.')
+
+    formatted_data = _format_patient_data(patient_data)
+    cache_key = _ai_cache_key('summary', formatted_data, appointment_reason)
+    cached = await cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = f"""PATIENT DATA:
+{formatted_data}
+
+APPOINTMENT REASON: {appointment_reason if appointment_reason else 'General consultation'}
+"""
+
     try:
-        response = requests.post(
-            url,
-            json={
+        status, data = await _gemini_post(
+            session,
+            _gemini_url(api_key),
+            {
+                'systemInstruction': {'parts': [{'text': CASE_SUMMARY_INSTRUCTIONS}]},
                 'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
                 'generationConfig': {
                     'temperature': 0.3,
@@ -77,28 +209,43 @@ Highlight any critical or urgent findings.
             timeout=60
         )
 
-        if response.ok:
-            data = response.json()
-            text = data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text')
-            return text if text else 'Failed to generate summary.'
-        else:
-            return f'AI service error: {response.status_code}'
     except Exception as e:
-        return f'AI service unavailable: {str(e)}'
+        raise _SummaryUnavailable(f'AI service unavailable: {str(e)}') from e
+
+    if not data:
+        raise _SummaryUnavailable(f'AI service error: {status}')
+    text = _response_text(data)
+    if not text:
+        raise _SummaryUnavailable('Failed to generate summary.')
+    await cache.aset(cache_key, text, AI_RESULT_CACHE_TIMEOUT)
+    return text
 
 
 def generate_symptom_timeline(patient_data: dict) -> list:
     """Extract and structure symptom timeline from patient data."""
-    api_key = settings.GEMINI_API_KEY
-    if not api_key or api_key == 'your_gemini_api_key_here':
+    async def run():
+        return await agenerate_symptom_timeline(_gemini_session(), patient_data)
+    return _run(run())
+
+
+async def agenerate_symptom_timeline(session: aiohttp.ClientSession, patient_data: dict) -> list:
+    """Async symptom timeline over a shared aiohttp session."""
+    api_key = _gemini_api_key()
+    if not api_key:
         return _fallback_symptom_timeline(patient_data)
+    if not any(patient_data.get(key) for key in TIMELINE_SOURCE_FIELDS):
+        return _fallback_symptom_timeline(patient_data)  # nothing the model could extract from
 
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}'
+    formatted_data = _format_patient_data(patient_data)
+    cache_key = _ai_cache_key('timeline', formatted_data, model=TIMELINE_MODEL)
+    cached = await cache.aget(cache_key)
+    if cached is not None:
+        return cached
 
     prompt = f"""Analyze the patient data and extract a symptom timeline.
 
 PATIENT DATA:
-{_format_patient_data(patient_data)}
+{formatted_data}
 
 Return a JSON array of symptom events with this structure:
 [
@@ -114,29 +261,32 @@ Return a JSON array of symptom events with this structure:
 Only include actual symptoms mentioned in the data.
 Return ONLY the JSON array, no other text."""
 
-    try:
-        response = requests.post(
-            url,
-            json={
-                'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
-                'generationConfig': {
-                    'temperature': 0.2,
-                    'maxOutputTokens': 1024,
-                }
-            },
-            timeout=30
-        )
+    payload = {
+        'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+        'generationConfig': {
+            'temperature': 0.2,
+            'maxOutputTokens': 1024,
+        }
+    }
+    url = _gemini_url(api_key, TIMELINE_MODEL, 'streamGenerateContent')
 
-        if response.ok:
-            import json
-            data = response.json()
-            text = data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '[]')
-            text = text.strip()
-            if text.startswith('```'):
-                text = text.split('\n', 1)[1] if '\n' in text else text[3:]
-            if text.endswith('```'):
-                text = text[:-3]
-            return json.loads(text.strip())
+    try:
+        # Parse as soon as the top-level array closes rather than waiting for the stream to end
+        text = ''
+        timeline = None
+        async with contextlib.aclosing(_gemini_stream(session, url, payload, timeout=30)) as chunks:
+            async for chunk in chunks:
+                text += chunk
+                if _strip_code_fence(text).endswith(']'):
+                    try:
+                        timeline = json.loads(_strip_code_fence(text))
+                        break
+                    except ValueError:
+                        pass  # an inner array closed; keep reading
+        if timeline is None:
+            timeline = json.loads(_strip_code_fence(text))
+        await cache.aset(cache_key, timeline, AI_RESULT_CACHE_TIMEOUT)
+        return timeline
     except Exception:
         pass
     
@@ -147,7 +297,6 @@ def generate_medication_overview(patient_data: dict) -> dict:
     """Generate structured medication and allergy overview."""
     medications = patient_data.get('medications') or patient_data.get('prescriptions') or ''
     allergies = patient_data.get('allergies', '')
-    
     return {
         'current_medications': _parse_medications(medications),
         'allergies': _parse_allergies(allergies),
@@ -158,6 +307,91 @@ def generate_medication_overview(patient_data: dict) -> dict:
 
 def get_patient_dashboard_data(profile) -> dict:
     """Get comprehensive patient data for doctor dashboard."""
+    dashboard, _ = _run(aget_patient_dashboard_data(profile))
+    return dashboard
+
+
+def get_patient_dashboard_with_summary(profile, appointment_reason: str = '') -> tuple[dict, str]:
+    """Dashboard data plus an AI case summary, generated concurrently."""
+    return _run(aget_patient_dashboard_data(profile, appointment_reason=appointment_reason))
+
+
+async def aget_patient_dashboard_data(profile, appointment_reason: Optional[str] = None) -> tuple[dict, Optional[str]]:
+    """
+    Build the dashboard and, when appointment_reason is given, the case summary.
+    Runs on the shared Gemini loop (see _run); the calls are issued
+    concurrently on its pooled session, so the wall-clock
+    cost is the slowest call rather than their sum. The summary is generated
+    from the dashboard without the AI timeline, which is still in flight.
+    """
+    dashboard = _build_dashboard_data(profile)
+    onboarding_data = profile.onboarding_data or {}
+    
+    session = _gemini_session()
+    tasks = [agenerate_symptom_timeline(session, onboarding_data)]
+    if appointment_reason is not None:
+        tasks.append(agenerate_ai_case_summary(session, _case_summary_input(dashboard), appointment_reason))
+    results = await asyncio.gather(*tasks)
+    
+    dashboard['symptom_timeline'] = results[0]
+    summary = results[1] if appointment_reason is not None else None
+    return dashboard, summary
+
+
+PRECOMPUTE_CONCURRENCY = 5
+
+
+def precompute_case_summaries(appointments) -> dict:
+    """
+    Generate case summaries ahead of time for the given appointments (with
+    profiles loaded), using each appointment's purpose as the visit reason.
+    Returns {appointment_id: summary} for the summaries that succeeded; each
+    one is also left in the AI result cache for the dashboard to reuse.
+    """
+    async def run():
+        semaphore = asyncio.Semaphore(PRECOMPUTE_CONCURRENCY)
+        
+        async def summarize(session, appointment):
+            async with semaphore:
+                try:
+                    summary = await _fetch_case_summary(
+                        session, _case_summary_input(_build_dashboard_data(appointment.profile)), appointment.purpose
+                    )
+                except _SummaryUnavailable:
+                    return None
+                return appointment.id, summary
+        
+        session = _gemini_session()
+        results = await asyncio.gather(*(summarize(session, a) for a in appointments))
+        return dict(r for r in results if r)
+    
+    return _run(run())
+
+
+def _case_summary_input(dashboard: dict) -> dict:
+    """
+    Patient data for the case-summary prompt. The AI health summary only
+    covers uploaded documents (plus appended ECG and voice notes), so the
+    onboarding medical history is always passed through unchanged alongside
+    it; what is dropped is contact and account detail the summary never uses.
+    Without a health summary the full dashboard is used.
+    """
+    if not dashboard.get('ai_health_summary'):
+        return dashboard
+    info = dashboard['patient_info']
+    return {
+        'patient_info': {key: info.get(key) for key in ('name', 'age', 'sex', 'blood_type')},
+        'ai_health_summary': dashboard['ai_health_summary'],
+        'current_symptoms': dashboard['current_symptoms'],
+        'medications_allergies': dashboard['medications_allergies'],
+        'vitals': dashboard['vitals'],
+        'medical_history': dashboard['medical_history'],
+        'lifestyle': dashboard['lifestyle'],
+    }
+
+
+def _build_dashboard_data(profile) -> dict:
+    """Dashboard fields that need no AI call."""
     onboarding_data = profile.onboarding_data or {}
     
     # Calculate BMI if height and weight available
@@ -215,7 +449,6 @@ def get_patient_dashboard_data(profile) -> dict:
         },
         'health_goals': onboarding_data.get('health_goals'),
         'ai_health_summary': profile.health_summary,
-        'symptom_timeline': generate_symptom_timeline(onboarding_data),
         'profile_updated_at': profile.updated_at.isoformat() if profile.updated_at else None,
     }
 
@@ -225,11 +458,15 @@ def _format_patient_data(data: dict) -> str:
     lines = []
     for key, value in data.items():
         if value:
-            formatted_key = key.replace('_', ' ').title()
-            lines.append(f"- {formatted_key}: {value}")
+            lines.append(f"- {_format_key(key)}: {value}")
     return '\n'.join(lines) if lines else 'No data available'
 
 
+@lru_cache(maxsize=256)
+def _format_key(key: str) -> str:
+    return key.replace('_', ' ').title()
+
+
 def _fallback_symptom_timeline(patient_data: dict) -> list:
     """Fallback symptom timeline when AI is not available."""
     timeline = []
@@ -257,21 +494,21 @@ def _fallback_symptom_timeline(patient_data: dict) -> list:
     return timeline
 
 
+@lru_cache(maxsize=1024)
+def _split_list(text: str) -> tuple:
+    """Comma-separated entries, stripped and non-empty; memoized per text as an immutable tuple."""
+    return tuple(item for item in (part.strip() for part in text.split(',')) if item)
+
+
 def _parse_medications(medications_str: str) -> list:
     """Parse medication string into structured list."""
     if not medications_str:
         return []
     
-    meds = []
-    for med in medications_str.split(','):
-        med = med.strip()
-        if med:
-            meds.append({
-                'name': med,
-                'dosage': 'Not specified',
-                'frequency': 'Not specified'
-            })
-    return meds
+    return [
+        {'name': med, 'dosage': 'Not specified', 'frequency': 'Not specified'}
+        for med in _split_list(medications_str)
+    ]
 
 
 def _parse_allergies(allergies_str: str) -> list:
@@ -279,16 +516,10 @@ def _parse_allergies(allergies_str: str) -> list:
     if not allergies_str:
         return []
     
-    allergies = []
-    for allergy in allergies_str.split(','):
-        allergy = allergy.strip()
-        if allergy:
-            allergies.append({
-                'allergen': allergy,
-                'severity': 'unknown',
-                'reaction': 'Not specified'
-            })
-    return allergies
+    return [
+        {'allergen': allergy, 'severity': 'unknown', 'reaction': 'Not specified'}
+        for allergy in _split_list(allergies_str)
+    ]
 
 
 def _generate_medication_warnings(medications: str, allergies: str) -> list:
@@ -3,21 +3,80 @@ ECG-based Heart Disease Prediction Service
 Adapted from: Cardiovascular-Detection-using-ECG-images
 """
 
+import cv2
 from skimage.io import imread
-from skimage import color
+from skimage import color, img_as_float
 import matplotlib
 matplotlib.use('Agg')
 from skimage.filters import threshold_otsu, gaussian
 from skimage.transform import resize
 from skimage import measure
 import joblib
-from sklearn.preprocessing import MinMaxScaler
-import pandas as pd
+from joblib import Parallel, delayed
 import numpy as np
 import os
+from functools import lru_cache
 from pathlib import Path
-import tempfile
-import shutil
+
+MODELS_DIR = Path(__file__).resolve().parent / 'ecg_models'
+SCALER_FILE = 'scaler_ECG.pkl'
+PCA_FILE = 'PCA_ECG (1).pkl'
+CLASSIFIER_FILE = 'Heart_Disease_Prediction_using_ECG (4).pkl'
+
+NUM_LEADS = 12
+SAMPLES_PER_LEAD = 255
+# Leads are independent, CPU-bound work; joblib's loky executor keeps its worker processes
+# alive between predictions, so only the first request pays the spawn cost.
+ECG_LEAD_WORKERS = min(4, os.cpu_count() or 1)
+
+
+@lru_cache(maxsize=None)
+def load_artifact(filename):
+    """Unpickle a model artifact once per process and share it across predictions."""
+    return joblib.load(MODELS_DIR / filename)
+
+
+def _to_rgb(image):
+    """
+    View an image as (H, W, 3) without copying where possible: colour images drop
+    any alpha channel, single-channel and gray+alpha images broadcast channel 0.
+    """
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    if image.shape[2] >= 3:
+        return image[:, :, :3]
+    return np.broadcast_to(image[:, :, :1], image.shape[:2] + (3,))
+
+
+def _to_gray(image):
+    return image if image.ndim == 2 else color.rgb2gray(_to_rgb(image))
+
+
+def _process_one_lead(y):
+    """Extract a lead's dominant contour as a min-max scaled 1D signal of SAMPLES_PER_LEAD points."""
+    grayscale = _to_gray(y)
+    
+    blurred_image = gaussian(grayscale, sigma=0.7)
+    global_thresh = threshold_otsu(blurred_image)
+    binary_global = blurred_image < global_thresh
+    # Nearest-exact matches skimage's order-0 resize of boolean images pixel for pixel
+    binary_global = cv2.resize(
+        binary_global.astype(np.uint8), (450, 300), interpolation=cv2.INTER_NEAREST_EXACT
+    ).astype(bool)
+    
+    contours = measure.find_contours(binary_global, 0.8)
+    if contours:
+        # The trace is the longest contour; on ties the last one found wins
+        longest = max(reversed(contours), key=len)
+        test = resize(longest, (SAMPLES_PER_LEAD, 2))
+    else:
+        test = np.zeros((SAMPLES_PER_LEAD, 2))
+    
+    # Min-max scale the first coordinate, as MinMaxScaler would (constant signals map to 0)
+    signal = test[:, 0]
+    low = signal.min()
+    span = signal.max() - low
+    return (signal - low) / span if span else np.zeros(SAMPLES_PER_LEAD)
 
 
 class ECGPredictor:
@@ -33,46 +92,22 @@ class ECGPredictor:
     
     def __init__(self):
         self.base_dir = Path(__file__).resolve().parent
-        self.models_dir = self.base_dir / 'ecg_models'
-        self.temp_dir = None
-        
-    def create_temp_workspace(self):
-        self.temp_dir = tempfile.mkdtemp()
-        return self.temp_dir
-    
-    def cleanup_temp_workspace(self):
-        if self.temp_dir and os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
-            self.temp_dir = None
+        self.models_dir = MODELS_DIR
     
     def get_image(self, image_path):
-        image = imread(image_path)
-        
-        if len(image.shape) == 2:
-            image = np.stack([image, image, image], axis=-1)
-        elif len(image.shape) == 3:
-            if image.shape[2] == 4:
-                image = image[:, :, :3]
-            elif image.shape[2] == 2:
-                image = np.stack([image[:, :, 0], image[:, :, 0], image[:, :, 0]], axis=-1)
-            elif image.shape[2] == 1:
-                image = np.concatenate([image, image, image], axis=-1)
-        
-        return image
+        return _to_rgb(imread(image_path))
     
     def gray_image(self, image):
-        if len(image.shape) == 2:
-            image_gray = image
+        image_gray = _to_gray(image)
+        # INTER_AREA averages every source pixel when shrinking, which is what
+        # skimage's anti-aliased resize did; INTER_LINEAR samples and aliases
+        # the fine grid lines of high-resolution scans.
+        height, width = image_gray.shape[:2]
+        if height > 1572 or width > 2213:
+            interpolation = cv2.INTER_AREA
         else:
-            if image.shape[2] == 4:
-                image = image[:, :, :3]
-            elif image.shape[2] == 2:
-                image = np.stack([image[:, :, 0], image[:, :, 0], image[:, :, 0]], axis=-1)
-            elif image.shape[2] == 1:
-                image = np.concatenate([image, image, image], axis=-1)
-            image_gray = color.rgb2gray(image)
-        
-        image_gray = resize(image_gray, (1572, 2213))
+            interpolation = cv2.INTER_LINEAR
+        image_gray = cv2.resize(img_as_float(image_gray), (2213, 1572), interpolation=interpolation)
         return image_gray
     
     def divide_leads(self, image):
@@ -94,99 +129,48 @@ class ECGPredictor:
                 Lead_7, Lead_8, Lead_9, Lead_10, Lead_11, Lead_12, Lead_13]
     
     def signal_extraction_scaling(self, Leads):
-        original_dir = os.getcwd()
-        os.chdir(self.temp_dir)
-        
-        try:
-            for x, y in enumerate(Leads[:len(Leads)-1]):
-                if len(y.shape) == 2:
-                    grayscale = y
-                else:
-                    if y.shape[2] == 4:
-                        y = y[:, :, :3]
-                    elif y.shape[2] == 2:
-                        y = np.stack([y[:, :, 0], y[:, :, 0], y[:, :, 0]], axis=-1)
-                    elif y.shape[2] == 1:
-                        y = np.concatenate([y, y, y], axis=-1)
-                    grayscale = color.rgb2gray(y)
-                
-                blurred_image = gaussian(grayscale, sigma=0.7)
-                global_thresh = threshold_otsu(blurred_image)
-                binary_global = blurred_image < global_thresh
-                binary_global = resize(binary_global, (300, 450))
-                
-                contours = measure.find_contours(binary_global, 0.8)
-                contours_shape = sorted([c.shape for c in contours])[::-1][0:1]
-                
-                test = None
-                for contour in contours:
-                    if contour.shape in contours_shape:
-                        test = resize(contour, (255, 2))
-                
-                if test is None:
-                    test = np.zeros((255, 2))
-                
-                lead_no = x
-                scaler = MinMaxScaler()
-                fit_transform_data = scaler.fit_transform(test)
-                Normalized_Scaled = pd.DataFrame(fit_transform_data[:, 0], columns=['X'])
-                Normalized_Scaled = Normalized_Scaled.T
-                
-                csv_filename = f'Scaled_1DLead_{lead_no+1}.csv'
-                Normalized_Scaled.to_csv(csv_filename, index=False)
-        
-        finally:
-            os.chdir(original_dir)
+        """Extract each lead's dominant contour as a min-max scaled 1D signal, shape (12, 255)."""
+        leads = Leads[:NUM_LEADS]
+        if ECG_LEAD_WORKERS > 1:
+            signals = Parallel(n_jobs=ECG_LEAD_WORKERS)(delayed(_process_one_lead)(lead) for lead in leads)
+        else:
+            signals = [_process_one_lead(lead) for lead in leads]
+        return np.stack(signals)
     
-    def combine_convert_1d_signal(self):
-        original_dir = os.getcwd()
-        os.chdir(self.temp_dir)
-        
-        try:
-            test_final = pd.read_csv('Scaled_1DLead_1.csv')
-            
-            from natsort import natsorted
-            for files in natsorted(os.listdir('.')):
-                if files.endswith(".csv") and files != 'Scaled_1DLead_1.csv':
-                    df = pd.read_csv(files)
-                    test_final = pd.concat([test_final, df], axis=1, ignore_index=True)
-            
-            return test_final
-        
-        finally:
-            os.chdir(original_dir)
+    def combine_convert_1d_signal(self, leads_1d):
+        """Concatenate the per-lead signals into one (1, 12*255) feature row."""
+        return leads_1d.reshape(1, -1)
     
     def dimensional_reduction(self, test_final):
         import warnings
         warnings.filterwarnings('ignore', category=UserWarning)
         
-        scaler_path = self.models_dir / 'scaler_ECG.pkl'
-        if scaler_path.exists():
-            scaler = joblib.load(scaler_path)
-            test_scaled = scaler.transform(test_final)
+        if (MODELS_DIR / SCALER_FILE).exists():
+            test_scaled = load_artifact(SCALER_FILE).transform(test_final)
         else:
             test_scaled = test_final
-        
-        pca_model_path = self.models_dir / 'PCA_ECG (1).pkl'
-        pca_loaded_model = joblib.load(pca_model_path)
-        result = pca_loaded_model.transform(test_scaled)
-        final_df = pd.DataFrame(result)
-        return final_df
+        return load_artifact(PCA_FILE).transform(test_scaled)
     
     def model_load_predict(self, final_df):
         import warnings
         warnings.filterwarnings('ignore', category=UserWarning)
         
         try:
-            model_path = self.models_dir / 'Heart_Disease_Prediction_using_ECG (4).pkl'
-            loaded_model = joblib.load(model_path)
-            result = loaded_model.predict(final_df)
-            
-            try:
+            loaded_model = load_artifact(CLASSIFIER_FILE)
+            if getattr(loaded_model, 'voting', None) == 'soft':
+                # Soft voting predicts argmax of the averaged probabilities, so one
+                # ensemble pass yields both the label and the confidence
                 proba = loaded_model.predict_proba(final_df)
+                result = loaded_model.classes_[np.argmax(proba, axis=1)]
                 confidence = float(np.max(proba) * 100)
-            except:
-                confidence = None
+            else:
+                result = loaded_model.predict(final_df)
+                
+                try:
+                    proba = loaded_model.predict_proba(final_df)
+                    confidence = float(np.max(proba) * 100)
+                except:
+                    confidence = None
             
             prediction_map = {
                 0: ("Abnormal Heartbeat", "Your ECG shows signs of abnormal heartbeat (arrhythmia). Please consult a cardiologist.", "attention"),
@@ -211,13 +195,11 @@ class ECGPredictor:
     
     def predict_from_ecg_image(self, image_path):
         try:
-            self.create_temp_workspace()
-            
             ecg_image = self.get_image(image_path)
             gray_image = self.gray_image(ecg_image)
             leads = self.divide_leads(gray_image)
-            self.signal_extraction_scaling(leads)
-            combined_signal = self.combine_convert_1d_signal()
+            leads_1d = self.signal_extraction_scaling(leads)
+            combined_signal = self.combine_convert_1d_signal(leads_1d)
             reduced_features = self.dimensional_reduction(combined_signal)
             pred_code, pred_label, pred_message, confidence, status = self.model_load_predict(reduced_features)
             
@@ -242,6 +224,3 @@ class ECGPredictor:
                 'prediction_message': f'Failed to process ECG image: {str(e)}',
                 'status': 'attention'
             }
-        
-        finally:
-            self.cleanup_temp_workspace()
@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.doctor_service import precompute_case_summaries
+from api.models import Appointment
+
+
+class Command(BaseCommand):
+    help = "Generate doctor case summaries ahead of time for a day's confirmed appointments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Appointment date, YYYY-MM-DD (default: tomorrow)')
+        parser.add_argument('--force', action='store_true', help='Regenerate summaries that already exist')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate() + timedelta(days=1)
+        appointments = Appointment.objects.filter(
+            appointment_date=day, status='confirmed'
+        ).select_related('profile')
+        if not options['force']:
+            appointments = appointments.filter(ai_case_summary='')
+        appointments = list(appointments)
+
+        summaries = precompute_case_summaries(appointments)
+        for appointment in appointments:
+            appointment.ai_case_summary = summaries.get(appointment.id, '')
+        Appointment.objects.bulk_update(
+            [a for a in appointments if a.ai_case_summary], ['ai_case_summary']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Precomputed {len(summaries)} of {len(appointments)} case summaries for {day}'
+        ))
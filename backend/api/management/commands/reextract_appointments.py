@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.appointment_service import REEXTRACT_STATUSES, batch_extract_appointment_details
+from api.models import Appointment
+
+
+class Command(BaseCommand):
+    help = 'Re-extract appointment details from stored call transcripts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Appointment ids (default: all with --status)')
+        parser.add_argument('--status', default='failed', choices=REEXTRACT_STATUSES,
+                            help='Status to sweep when no ids are given')
+
+    def handle(self, *args, **options):
+        ids = options['ids'] or list(
+            Appointment.objects.filter(status=options['status'])
+            .exclude(call_transcript='')
+            .values_list('id', flat=True)
+        )
+        updated = batch_extract_appointment_details(ids)
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} of {len(ids)} appointments'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-15 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_add_appointments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='call_history',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
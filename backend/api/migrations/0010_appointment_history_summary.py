@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-15 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_appointment_call_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='history_summarized_turns',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='history_summary',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-15 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_appointment_history_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='ai_case_summary',
+            field=models.TextField(blank=True),
+        ),
+    ]
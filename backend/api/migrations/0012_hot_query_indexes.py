@@ -0,0 +1,25 @@
+# Generated by Django 5.2.10 on 2026-10-15 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_appointment_ai_case_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['profile', '-created_at'], name='api_appoint_profile_106f85_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'appointment_date'], name='api_appoint_status_2dfa8e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['profile', '-record_date', '-created_at'], name='api_medical_profile_be2418_idx'),
+        ),
+    ]
@@ -77,6 +77,9 @@ class MedicalRecord(models.Model):
 
     class Meta:
         ordering = ['-record_date', '-created_at']
+        indexes = [
+            models.Index(fields=['profile', '-record_date', '-created_at']),
+        ]
 
     def __str__(self) -> str:
         return f'{self.title} - {self.category}'
@@ -109,13 +112,35 @@ class Appointment(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     call_sid = models.CharField(max_length=100, blank=True)
     call_transcript = models.TextField(blank=True)
+    call_history = models.JSONField(default=list, blank=True)  # [{'role': 'hospital' | 'ai', 'text': ...}]
+    history_summary = models.TextField(blank=True)
+    history_summarized_turns = models.PositiveIntegerField(default=0)  # call_history turns covered by history_summary
     call_duration = models.IntegerField(null=True, blank=True)
     
+    # Doctor-facing case summary generated ahead of the visit
+    ai_case_summary = models.TextField(blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['profile', '-created_at']),
+            models.Index(fields=['status', 'appointment_date']),
+        ]
 
     def __str__(self) -> str:
         return f'{self.hospital_name} - {self.status}'
+
+    def history_transcript(self) -> str:
+        """The live call as "AI: ..." / "Hospital: ..." lines, built from call_history."""
+        return '\n'.join(
+            f"{'AI' if turn['role'] == 'ai' else 'Hospital'}: {turn['text']}"
+            for turn in self.call_history
+        )
+
+    @property
+    def transcript(self) -> str:
+        """Stored transcript for finished or simulated calls; built from call_history while a call is live."""
+        return self.call_transcript or self.history_transcript()
@@ -1,7 +1,134 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import orjson
 import requests
 from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 GEMINI_MODEL = 'gemini-2.0-flash'
+RECOMMENDATION_CACHE_TIMEOUT = 60 * 60  # seconds
+GEOCODE_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+PLACE_DETAILS_CACHE_TIMEOUT = 60 * 60 * 24
+HTTP_POOL_SIZE = 32  # keep-alive connections per host, and lookup threads to drive them
+
+# Optional markdown fence Gemini sometimes wraps around its JSON
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.S)
+
+# Pooled keep-alive session shared by the Gemini and Maps calls, so repeat
+# requests to the same host skip the TCP/TLS handshake
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.25,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # Gemini generateContent is safe to repeat, so POSTs are retried too
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    ),
+))
+
+
+class _ProviderUnavailable(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class _CircuitBreaker:
+    """Fails fast for reset_timeout seconds after fail_max consecutive provider failures."""
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = 0.0
+
+    def allow(self) -> bool:
+        with self._lock:
+            return self._failures < self.fail_max or time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def record(self, healthy: bool) -> None:
+        with self._lock:
+            if healthy:
+                self._failures = 0
+            else:
+                self._failures += 1
+                if self._failures >= self.fail_max:
+                    self._opened_at = time.monotonic()
+
+
+_gemini_breaker = _CircuitBreaker('gemini')
+_maps_breaker = _CircuitBreaker('google-maps')
+_UNHEALTHY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _guarded(breaker: _CircuitBreaker, send, url: str, **kwargs) -> requests.Response:
+    """Send a request through the pooled session unless the provider's breaker is open."""
+    if not breaker.allow():
+        raise _ProviderUnavailable(f'{breaker.name} circuit open')
+    try:
+        response = send(url, **kwargs)
+    except requests.RequestException:
+        breaker.record(False)
+        raise
+    breaker.record(response.ok or response.status_code not in _UNHEALTHY_STATUSES)
+    return response
+
+# Maps lookups are independent network calls, so they are fanned out on this pool. It
+# matches the connection pool so concurrent users' lookups don't queue behind each other.
+_lookup_executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix='maps-lookup')
+
+# Fixed instructions go out as the system instruction so every request shares the
+# same prompt prefix; only the patient context varies per call
+RECOMMENDATION_INSTRUCTIONS = """Based on the patient's health profile, recommend which medical specialists they should consult.
+
+Return a JSON array with up to 4 specialty recommendations. Each should have:
+- "specialty": The medical specialty (e.g., "Cardiologist", "General Physician", "Orthopedic")
+- "search_term": Google Maps search term (e.g., "cardiologist", "general physician clinic", "orthopedic doctor")
+- "reason": Brief reason for this recommendation (1 sentence)
+- "urgency": "low", "medium", or "high"
+- "priority": 1-4 (1 being most important)
+
+If no specific symptoms, recommend General Physician first.
+ONLY return valid JSON array, no markdown or explanation."""
+
+# Static parts of the request body, built once and shared read-only by every call
+_SYSTEM_INSTRUCTION = {'parts': [{'text': RECOMMENDATION_INSTRUCTIONS}]}
+_GENERATION_CONFIG = {
+    'temperature': 0.3,
+    'maxOutputTokens': 1024,
+}
+
+
+@lru_cache(maxsize=8)
+def _gemini_url(api_key: str) -> str:
+    return f'https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse&key={api_key}'
+
+
+def _stream_text(response: requests.Response):
+    """Yield the text of each SSE event in a streamed Gemini response."""
+    for line in response.iter_lines():
+        if line.startswith(b'data:'):
+            data = orjson.loads(line[5:])
+            yield data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
 
 
 def get_specialty_recommendations(onboarding_data: dict) -> list[dict]:
@@ -10,8 +137,6 @@ def get_specialty_recommendations(onboarding_data: dict) -> list[dict]:
     if not api_key or api_key == 'your_gemini_api_key_here':
         return get_fallback_recommendations(onboarding_data)
 
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}'
-
     patient_context = f"""
 Patient Data:
 - Age: {onboarding_data.get('age', 'Unknown')}
@@ -26,92 +151,98 @@ Patient Data:
 - Vitals: BP {onboarding_data.get('blood_pressure', 'N/A')}, HR {onboarding_data.get('heart_rate', 'N/A')} bpm
 """
 
-    prompt = f"""Based on this patient's health profile, recommend which medical specialists they should consult.
-
-{patient_context}
-
-Return a JSON array with up to 4 specialty recommendations. Each should have:
-- "specialty": The medical specialty (e.g., "Cardiologist", "General Physician", "Orthopedic")
-- "search_term": Google Maps search term (e.g., "cardiologist", "general physician clinic", "orthopedic doctor")
-- "reason": Brief reason for this recommendation (1 sentence)
-- "urgency": "low", "medium", or "high"
-- "priority": 1-4 (1 being most important)
-
-If no specific symptoms, recommend General Physician first.
-ONLY return valid JSON array, no markdown or explanation."""
+    # Keyed on the exact patient context the model sees, so edited onboarding data misses
+    cache_key = f'recommendations:{GEMINI_MODEL}:{hashlib.blake2b(patient_context.encode("utf-8"), digest_size=16).hexdigest()}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        response = requests.post(
-            url,
+        response = _guarded(
+            _gemini_breaker, _http.post, _gemini_url(api_key),
             json={
-                'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
-                'generationConfig': {
-                    'temperature': 0.3,
-                    'maxOutputTokens': 1024,
-                }
+                'systemInstruction': _SYSTEM_INSTRUCTION,
+                'contents': [{'role': 'user', 'parts': [{'text': patient_context}]}],
+                'generationConfig': _GENERATION_CONFIG,
             },
-            timeout=30
+            timeout=30,
+            stream=True
         )
-
-        if response.ok:
-            data = response.json()
-            text = data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '[]')
-            text = text.strip()
-            if text.startswith('```'):
-                text = text.split('\n', 1)[1] if '\n' in text else text[3:]
-            if text.endswith('```'):
-                text = text[:-3]
-            
-            import json
-            recommendations = json.loads(text.strip())
-            if isinstance(recommendations, list):
-                return sorted(recommendations, key=lambda x: x.get('priority', 99))[:4]
+        try:
+            if response.ok:
+                # Parse as soon as the array closes rather than waiting for the stream to end
+                text = ''
+                recommendations = None
+                for chunk in _stream_text(response):
+                    text += chunk
+                    body = _FENCE_RE.sub('', text)
+                    if body.endswith(']'):
+                        try:
+                            recommendations = orjson.loads(body)
+                            break
+                        except ValueError:
+                            pass  # an inner array closed; keep reading
+                if recommendations is None:
+                    recommendations = orjson.loads(_FENCE_RE.sub('', text) or '[]')
+                if isinstance(recommendations, list):
+                    recommendations = sorted(recommendations, key=lambda x: x.get('priority', 99))[:4]
+                    cache.set(cache_key, recommendations, RECOMMENDATION_CACHE_TIMEOUT)
+                    return recommendations
+        finally:
+            response.close()
     except Exception as e:
-        print(f'Gemini recommendation error: {e}')
+        logger.warning("Gemini recommendation error: %s", e)
 
     return get_fallback_recommendations(onboarding_data)
 
 
+# Substring matches, so e.g. "breathing" and "itchy" still count
+_CARDIO_RE = re.compile('chest|heart|breath|palpitation')
+_ORTHO_RE = re.compile('joint|bone|back|knee|spine')
+_DERMA_RE = re.compile('skin|rash|itch|acne')
+
+_GENERAL_PHYSICIAN = {
+    'specialty': 'General Physician',
+    'search_term': 'general physician clinic',
+    'reason': 'Primary care for overall health assessment and referrals.',
+    'urgency': 'medium',
+    'priority': 1
+}
+_CARDIOLOGIST = {
+    'specialty': 'Cardiologist',
+    'search_term': 'cardiologist',
+    'reason': 'Cardiovascular symptoms or conditions detected.',
+    'urgency': 'high',
+    'priority': 1
+}
+_ORTHOPEDIC = {
+    'specialty': 'Orthopedic',
+    'search_term': 'orthopedic doctor',
+    'reason': 'Musculoskeletal symptoms reported.',
+    'urgency': 'medium',
+    'priority': 2
+}
+_DERMATOLOGIST = {
+    'specialty': 'Dermatologist',
+    'search_term': 'dermatologist',
+    'reason': 'Skin-related symptoms reported.',
+    'urgency': 'low',
+    'priority': 3
+}
+
+
 def get_fallback_recommendations(onboarding_data: dict) -> list[dict]:
     """Fallback recommendations when Gemini is unavailable."""
-    recs = []
     symptoms = (onboarding_data.get('symptoms_current', '') or '').lower()
     conditions = (onboarding_data.get('conditions', '') or '').lower()
 
-    recs.append({
-        'specialty': 'General Physician',
-        'search_term': 'general physician clinic',
-        'reason': 'Primary care for overall health assessment and referrals.',
-        'urgency': 'medium',
-        'priority': 1
-    })
-
-    if any(k in symptoms for k in ['chest', 'heart', 'breath', 'palpitation']) or 'hypertension' in conditions:
-        recs.append({
-            'specialty': 'Cardiologist',
-            'search_term': 'cardiologist',
-            'reason': 'Cardiovascular symptoms or conditions detected.',
-            'urgency': 'high',
-            'priority': 1
-        })
-
-    if any(k in symptoms for k in ['joint', 'bone', 'back', 'knee', 'spine']):
-        recs.append({
-            'specialty': 'Orthopedic',
-            'search_term': 'orthopedic doctor',
-            'reason': 'Musculoskeletal symptoms reported.',
-            'urgency': 'medium',
-            'priority': 2
-        })
-
-    if any(k in symptoms for k in ['skin', 'rash', 'itch', 'acne']):
-        recs.append({
-            'specialty': 'Dermatologist',
-            'search_term': 'dermatologist',
-            'reason': 'Skin-related symptoms reported.',
-            'urgency': 'low',
-            'priority': 3
-        })
+    recs = [dict(_GENERAL_PHYSICIAN)]
+    if _CARDIO_RE.search(symptoms) or 'hypertension' in conditions:
+        recs.append(dict(_CARDIOLOGIST))
+    if _ORTHO_RE.search(symptoms):
+        recs.append(dict(_ORTHOPEDIC))
+    if _DERMA_RE.search(symptoms):
+        recs.append(dict(_DERMATOLOGIST))
 
     return recs[:4]
 
@@ -119,29 +250,57 @@ def get_fallback_recommendations(onboarding_data: dict) -> list[dict]:
 def geocode_location(location: str) -> dict | None:
     """Convert location string to lat/lng using Google Geocoding API."""
     api_key = settings.GOOGLE_MAPS_API_KEY
-    if not api_key:
+    address = ' '.join((location or '').lower().split())
+    if not api_key or not address:
         return None
 
     try:
-        response = requests.get(
-            'https://maps.googleapis.com/maps/api/geocode/json',
-            params={
-                'address': location,
-                'key': api_key
-            },
-            timeout=10
-        )
-        if response.ok:
-            data = response.json()
-            if data.get('results'):
-                loc = data['results'][0]['geometry']['location']
-                return {'lat': loc['lat'], 'lng': loc['lng']}
+        coords = _geocode(address, api_key)
+        return dict(coords) if coords else None
     except Exception as e:
-        print(f'Geocoding error: {e}')
+        logger.warning("Geocoding error: %s", e)
 
     return None
 
 
+@lru_cache(maxsize=10_000)
+def _geocode(address: str, api_key: str) -> tuple | None:
+    # Geocodes are stable, so answers are memoized per normalized address, in-process
+    # and in the shared cache. Failures raise instead of returning, which keeps them
+    # out of both.
+    cache_key = f'geocode:{hashlib.blake2b(address.encode("utf-8"), digest_size=16).hexdigest()}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached or None
+
+    response = _guarded(
+        _maps_breaker, _http.get, 'https://maps.googleapis.com/maps/api/geocode/json',
+        params={
+            'address': address,
+            'key': api_key
+        },
+        timeout=10
+    )
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    if data.get('results'):
+        loc = data['results'][0]['geometry']['location']
+        coords = (('lat', loc['lat']), ('lng', loc['lng']))
+    elif data.get('status') == 'ZERO_RESULTS':
+        coords = ()
+    else:
+        raise LookupError(f"geocoding status {data.get('status')}")
+    cache.set(cache_key, coords, GEOCODE_CACHE_TIMEOUT)
+    return coords or None
+
+
+def geocode_locations_bulk(locations: list[str]) -> list[dict | None]:
+    """Geocode many locations concurrently, looking up each distinct address once."""
+    distinct = list(dict.fromkeys(locations))
+    coords = dict(zip(distinct, _lookup_executor.map(geocode_location, distinct)))
+    return [coords[location] for location in locations]
+
+
 def search_nearby_places(lat: float, lng: float, search_term: str, radius: int = 10000) -> list[dict]:
     """Search for nearby hospitals/doctors using Google Places API."""
     api_key = settings.GOOGLE_MAPS_API_KEY
@@ -149,8 +308,8 @@ def search_nearby_places(lat: float, lng: float, search_term: str, radius: int =
         return []
 
     try:
-        response = requests.get(
-            'https://maps.googleapis.com/maps/api/place/nearbysearch/json',
+        response = _guarded(
+            _maps_breaker, _http.get, 'https://maps.googleapis.com/maps/api/place/nearbysearch/json',
             params={
                 'location': f'{lat},{lng}',
                 'radius': radius,
@@ -161,36 +320,44 @@ def search_nearby_places(lat: float, lng: float, search_term: str, radius: int =
             timeout=15
         )
         if response.ok:
-            data = response.json()
-            results = []
-            for place in data.get('results', [])[:5]:
-                results.append({
-                    'place_id': place.get('place_id'),
-                    'name': place.get('name'),
-                    'address': place.get('vicinity'),
-                    'rating': place.get('rating'),
-                    'user_ratings_total': place.get('user_ratings_total', 0),
-                    'lat': place['geometry']['location']['lat'],
-                    'lng': place['geometry']['location']['lng'],
-                    'open_now': place.get('opening_hours', {}).get('open_now'),
-                    'types': place.get('types', []),
-                })
-            return results
+            data = orjson.loads(response.content)
+            return [_project_place(place) for place in data.get('results', ())[:5]]
     except Exception as e:
-        print(f'Places search error: {e}')
+        logger.warning("Places search error: %s", e)
 
     return []
 
 
+def _project_place(place: dict) -> dict:
+    get = place.get
+    location = place['geometry']['location']
+    return {
+        'place_id': get('place_id'),
+        'name': get('name'),
+        'address': get('vicinity'),
+        'rating': get('rating'),
+        'user_ratings_total': get('user_ratings_total', 0),
+        'lat': location['lat'],
+        'lng': location['lng'],
+        'open_now': get('opening_hours', {}).get('open_now'),
+        'types': get('types', []),
+    }
+
+
 def get_place_details(place_id: str) -> dict | None:
     """Get detailed info about a place."""
     api_key = settings.GOOGLE_MAPS_API_KEY
     if not api_key:
         return None
 
+    cache_key = f'place-details:{place_id}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.get(
-            'https://maps.googleapis.com/maps/api/place/details/json',
+        response = _guarded(
+            _maps_breaker, _http.get, 'https://maps.googleapis.com/maps/api/place/details/json',
             params={
                 'place_id': place_id,
                 'fields': 'name,formatted_address,formatted_phone_number,website,opening_hours,rating,reviews,url',
@@ -199,9 +366,9 @@ def get_place_details(place_id: str) -> dict | None:
             timeout=10
         )
         if response.ok:
-            data = response.json()
+            data = orjson.loads(response.content)
             result = data.get('result', {})
-            return {
+            details = {
                 'name': result.get('name'),
                 'address': result.get('formatted_address'),
                 'phone': result.get('formatted_phone_number'),
@@ -210,23 +377,30 @@ def get_place_details(place_id: str) -> dict | None:
                 'rating': result.get('rating'),
                 'opening_hours': result.get('opening_hours', {}).get('weekday_text', []),
             }
+            if result:
+                cache.set(cache_key, details, PLACE_DETAILS_CACHE_TIMEOUT)
+            return details
     except Exception as e:
-        print(f'Place details error: {e}')
+        logger.warning("Place details error: %s", e)
 
     return None
 
 
 def get_full_recommendations(onboarding_data: dict, user_lat: float = None, user_lng: float = None) -> dict:
     """Get complete recommendations with nearby places."""
-    specialty_recs = get_specialty_recommendations(onboarding_data)
-    
     location = onboarding_data.get('location', '')
     coords = None
+    geocoding = None
     
     if user_lat and user_lng:
         coords = {'lat': user_lat, 'lng': user_lng}
     elif location:
-        coords = geocode_location(location)
+        # Geocode while Gemini picks the specialties
+        geocoding = _lookup_executor.submit(geocode_location, location)
+    
+    specialty_recs = get_specialty_recommendations(onboarding_data)
+    if geocoding is not None:
+        coords = geocoding.result()
 
     result = {
         'specialties': specialty_recs,
@@ -235,9 +409,13 @@ def get_full_recommendations(onboarding_data: dict, user_lat: float = None, user
     }
 
     if coords:
-        for rec in specialty_recs:
-            search_term = rec.get('search_term', rec['specialty'])
-            places = search_nearby_places(coords['lat'], coords['lng'], search_term)
-            result['places'][rec['specialty']] = places
+        searches = {
+            rec['specialty']: _lookup_executor.submit(
+                search_nearby_places, coords['lat'], coords['lng'], rec.get('search_term', rec['specialty'])
+            )
+            for rec in specialty_recs
+        }
+        for specialty, search in searches.items():
+            result['places'][specialty] = search.result()
 
     return result
@@ -0,0 +1,108 @@
+"""
+Response cache for chatbot replies.
+
+Repeat questions asked against the same patient context and the same chat
+history are answered from memory instead of paying a full Gemini round-trip.
+Matching is exact after case and punctuation normalization: medical advice can
+flip on a single word or digit ("500mg" vs "5000mg", "take" vs "not take"), so
+fuzzy similarity is never used to pick a cached answer.
+
+Eviction follows psi(d) = alpha * freq + (1 - alpha) * exp(-t / beta), where
+freq is the entry's normalized hit count and t the seconds since last access.
+"""
+
+import hashlib
+import math
+import re
+import threading
+import time
+
+MAX_ENTRIES = 500
+EVICTION_ALPHA = 0.6
+EVICTION_BETA = 3600.0  # seconds
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_question(text: str) -> str:
+    """Lower-case the text and drop punctuation and extra whitespace, keeping every word and number."""
+    return ' '.join(_TOKEN_RE.findall(text.lower()))
+
+
+def response_key(messages: list, patient_context: str) -> bytes | None:
+    """
+    Digest of the patient context, the prior chat history and the normalized
+    last question, or None when there is no question to answer.
+    """
+    if not messages or not messages[-1].get('content'):
+        return None
+
+    digest = hashlib.blake2b(patient_context.encode('utf-8'), digest_size=16)
+    for message in messages[:-1]:
+        digest.update(b'\x00' + message.get('role', '').encode('utf-8'))
+        digest.update(b'\x01' + message.get('content', '').encode('utf-8'))
+    digest.update(b'\x02' + normalize_question(messages[-1]['content']).encode('utf-8'))
+    return digest.digest()
+
+
+class ResponseCache:
+    """Fixed-capacity exact-match cache keyed by patient context, chat history and normalized question."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: dict[bytes, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+
+    def get(self, messages: list, patient_context: str) -> str | None:
+        """Return the cached response for this exact conversation state, or None."""
+        key = response_key(messages, patient_context)
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            entry['usage_count'] += 1
+            entry['last_access'] = time.monotonic()
+            return entry['response']
+
+    def put(self, messages: list, patient_context: str, response: str) -> None:
+        """Store a response, evicting the lowest-value entry when the cache is full."""
+        key = response_key(messages, patient_context)
+        if key is None or not response:
+            return
+
+        entry = {
+            'response': response,
+            'usage_count': 1,
+            'last_access': time.monotonic(),
+        }
+
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._evict_one()
+            self._entries[key] = entry
+
+    def _evict_one(self) -> None:
+        now = time.monotonic()
+        max_usage = max(e['usage_count'] for e in self._entries.values())
+
+        def psi(entry: dict) -> float:
+            freq = entry['usage_count'] / max_usage
+            recency = math.exp(-(now - entry['last_access']) / EVICTION_BETA)
+            return EVICTION_ALPHA * freq + (1 - EVICTION_ALPHA) * recency
+
+        victim = min(self._entries, key=lambda k: psi(self._entries[k]))
+        del self._entries[victim]
+
+
+response_cache = ResponseCache()
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-import json
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Any
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
 
+import jwt
+import orjson
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 
 
 @dataclass(frozen=True)
@@ -16,32 +22,116 @@ class SupabaseUser:
     user_metadata: dict[str, Any]
 
 
+# Verified tokens are remembered (by digest, never the raw token) until they
+# expire or TOKEN_CACHE_TTL passes, so repeat requests skip the Supabase round-trip
+TOKEN_CACHE_TTL = 300  # seconds
+TOKEN_CACHE_MAX_ENTRIES = 10_000
+
+_token_cache: OrderedDict[bytes, tuple[SupabaseUser, float]] = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Keep-alive session so cache misses reuse a warm TLS connection to Supabase
+_http = requests.Session()
+_http.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=32))
+
+
+def clear_token_cache() -> None:
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+def _token_expiry(access_token: str) -> float | None:
+    """The JWT's exp claim, read without verification (only used to bound the cache TTL)."""
+    try:
+        payload = access_token.split('.')[1]
+        claims = orjson.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
 def get_supabase_user(access_token: str) -> SupabaseUser | None:
+    key = hashlib.sha256(access_token.encode('utf-8')).digest()
+    now = time.time()
+
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is not None:
+            user, expires_at = entry
+            if expires_at > now:
+                _token_cache.move_to_end(key)
+                return user
+            del _token_cache[key]
+
+    try:
+        user = _verify_supabase_token(access_token)
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        # Not verifiable with the shared secret (e.g. asymmetric signing keys); ask Supabase
+        user = _fetch_supabase_user(access_token)
+    if user is None:
+        return None
+
+    expires_at = now + TOKEN_CACHE_TTL
+    token_exp = _token_expiry(access_token)
+    if token_exp is not None:
+        expires_at = min(expires_at, token_exp)
+
+    if expires_at > now:
+        with _token_cache_lock:
+            _token_cache[key] = (user, expires_at)
+            while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+                _token_cache.popitem(last=False)
+    return user
+
+
+def _verify_supabase_token(access_token: str) -> SupabaseUser | None:
+    """Verify an HS256 access token against the project JWT secret, with no network call.
+
+    Raises jwt.InvalidTokenError when the token cannot be verified locally.
+    """
+    if not settings.SUPABASE_JWT_SECRET:
+        raise jwt.InvalidTokenError('SUPABASE_JWT_SECRET is not configured')
+
+    claims = jwt.decode(
+        access_token,
+        settings.SUPABASE_JWT_SECRET,
+        algorithms=['HS256'],
+        audience='authenticated',
+        options={'require': ['exp', 'sub']},
+    )
+    return _user_from_payload({**claims, 'id': claims['sub']})
+
+
+def _fetch_supabase_user(access_token: str) -> SupabaseUser | None:
     if not settings.SUPABASE_URL or not settings.SUPABASE_ANON_KEY:
         raise RuntimeError('Missing SUPABASE_URL or SUPABASE_ANON_KEY in backend/.env')
 
     url = settings.SUPABASE_URL.rstrip('/') + '/auth/v1/user'
-    req = Request(
-        url,
-        method='GET',
-        headers={
-            'Authorization': f'Bearer {access_token}',
-            'apikey': settings.SUPABASE_ANON_KEY,
-            'Accept': 'application/json',
-        },
-    )
 
     try:
-        with urlopen(req, timeout=8) as resp:
-            if resp.status != 200:
-                return None
-            payload = json.loads(resp.read().decode('utf-8'))
-    except (HTTPError, URLError, TimeoutError, ValueError):
+        resp = _http.get(
+            url,
+            headers={
+                'Authorization': f'Bearer {access_token}',
+                'apikey': settings.SUPABASE_ANON_KEY,
+                'Accept': 'application/json',
+            },
+            timeout=8,
+        )
+        if resp.status_code != 200:
+            return None
+        payload = orjson.loads(resp.content)
+    except (requests.RequestException, ValueError):
         return None
 
     if not isinstance(payload, dict):
         return None
+    return _user_from_payload(payload)
+
 
+def _user_from_payload(payload: dict) -> SupabaseUser | None:
     user_id = payload.get('id')
     if not isinstance(user_id, str) or not user_id:
         return None
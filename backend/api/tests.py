@@ -1,3 +1,114 @@
-from django.test import TestCase
+import base64
+import json
+import time
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+import jwt
+from django.test import TestCase, override_settings
+
+from api.supabase_auth import SupabaseUser, _fetch_supabase_user, clear_token_cache, get_supabase_user
+
+
+def make_token(exp: float) -> str:
+    claims = base64.urlsafe_b64encode(json.dumps({'sub': 'user-1', 'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{claims}.signature'
+
+
+class SupabaseTokenCacheTestCase(TestCase):
+    """Tests for the verified-token cache in get_supabase_user."""
+
+    def setUp(self):
+        clear_token_cache()
+        self.user = SupabaseUser(id='user-1', email='a@example.com', user_metadata={})
+
+    def tearDown(self):
+        clear_token_cache()
+
+    @patch('api.supabase_auth._fetch_supabase_user')
+    def test_repeat_token_skips_supabase(self, mock_fetch):
+        mock_fetch.return_value = self.user
+        token = make_token(time.time() + 3600)
+
+        self.assertEqual(get_supabase_user(token), self.user)
+        self.assertEqual(get_supabase_user(token), self.user)
+
+        mock_fetch.assert_called_once_with(token)
+
+    @patch('api.supabase_auth._fetch_supabase_user')
+    def test_invalid_token_is_not_cached(self, mock_fetch):
+        mock_fetch.return_value = None
+        token = make_token(time.time() + 3600)
+
+        self.assertIsNone(get_supabase_user(token))
+        self.assertIsNone(get_supabase_user(token))
+
+        self.assertEqual(mock_fetch.call_count, 2)
+
+    @patch('api.supabase_auth._fetch_supabase_user')
+    def test_expired_token_is_not_cached(self, mock_fetch):
+        mock_fetch.return_value = self.user
+        token = make_token(time.time() - 10)
+
+        get_supabase_user(token)
+        get_supabase_user(token)
+
+        self.assertEqual(mock_fetch.call_count, 2)
+
+
+@override_settings(SUPABASE_JWT_SECRET='test-jwt-secret-with-at-least-32-bytes')
+class SupabaseLocalVerificationTestCase(TestCase):
+    """Tests for verifying access tokens with the project JWT secret."""
+
+    def setUp(self):
+        clear_token_cache()
+
+    def tearDown(self):
+        clear_token_cache()
+
+    def sign(self, secret='test-jwt-secret-with-at-least-32-bytes', **claims):
+        claims = {'sub': 'user-1', 'aud': 'authenticated', 'exp': time.time() + 3600, **claims}
+        return jwt.encode(claims, secret, algorithm='HS256')
+
+    @patch('api.supabase_auth._fetch_supabase_user')
+    def test_signed_token_skips_supabase(self, mock_fetch):
+        token = self.sign(email='a@example.com', user_metadata={'name': 'A'})
+
+        user = get_supabase_user(token)
+
+        self.assertEqual(user, SupabaseUser(id='user-1', email='a@example.com', user_metadata={'name': 'A'}))
+        mock_fetch.assert_not_called()
+
+    @patch('api.supabase_auth._fetch_supabase_user')
+    def test_expired_token_is_rejected_locally(self, mock_fetch):
+        self.assertIsNone(get_supabase_user(self.sign(exp=time.time() - 10)))
+        mock_fetch.assert_not_called()
+
+    @patch('api.supabase_auth._fetch_supabase_user')
+    def test_unverifiable_token_falls_back_to_supabase(self, mock_fetch):
+        mock_fetch.return_value = None
+        token = self.sign(secret='other-jwt-secret-with-at-least-32-bytes')
+
+        self.assertIsNone(get_supabase_user(token))
+        mock_fetch.assert_called_once_with(token)
+
+
+@override_settings(SUPABASE_URL='https://project.supabase.co', SUPABASE_ANON_KEY='anon')
+class SupabaseFetchUserTestCase(TestCase):
+    """Tests for the Supabase /auth/v1/user lookup."""
+
+    @patch('api.supabase_auth._http')
+    def test_valid_user_is_parsed(self, mock_http):
+        mock_http.get.return_value = MagicMock(status_code=200, content=json.dumps({
+            'id': 'user-1', 'email': 'a@example.com', 'user_metadata': {'name': 'A'},
+        }).encode())
+
+        user = _fetch_supabase_user('token')
+
+        self.assertEqual(user, SupabaseUser(id='user-1', email='a@example.com', user_metadata={'name': 'A'}))
+        self.assertEqual(mock_http.get.call_args.args[0], 'https://project.supabase.co/auth/v1/user')
+
+    @patch('api.supabase_auth._http')
+    def test_rejected_token_returns_none(self, mock_http):
+        mock_http.get.return_value = MagicMock(status_code=401)
+
+        self.assertIsNone(_fetch_supabase_user('token'))
@@ -7,17 +7,25 @@ import uuid
 from datetime import date, time, timedelta
 from unittest.mock import patch, MagicMock
 
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TestCase
 from django.conf import settings
 
+from .ai_service import clear_model_cache
 from .models import Profile, Appointment
+from .supabase_auth import SupabaseUser
+
+
+def fake_simulate_booking(appointment_id, patient_info):
+    return {'success': True, 'status': 'confirmed'}
 
 
 class AppointmentModelTestCase(TestCase):
     """Tests for the Appointment model."""
 
-    def setUp(self):
-        self.profile = Profile.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = Profile.objects.create(
             supabase_uid=uuid.uuid4(),
             email='patient@test.com',
             full_name='Test Patient',
@@ -37,13 +45,13 @@ class AppointmentModelTestCase(TestCase):
 
     def test_appointment_status_choices(self):
         """Test all valid status choices."""
-        for status in ['pending', 'calling', 'confirmed', 'failed', 'cancelled']:
-            apt = Appointment.objects.create(
-                profile=self.profile,
-                hospital_name=f'Hospital {status}',
-                status=status
-            )
-            self.assertEqual(apt.status, status)
+        statuses = ['pending', 'calling', 'confirmed', 'failed', 'cancelled']
+        Appointment.objects.bulk_create([
+            Appointment(profile=self.profile, hospital_name=f'Hospital {status}', status=status)
+            for status in statuses
+        ])
+        saved = Appointment.objects.filter(profile=self.profile).values_list('status', flat=True)
+        self.assertEqual(set(saved), set(statuses))
 
     def test_confirmed_appointment_with_details(self):
         """Test a confirmed appointment with full details."""
@@ -61,29 +69,32 @@ class AppointmentModelTestCase(TestCase):
 
     def test_cascade_delete(self):
         """Test that appointments are deleted when profile is deleted."""
-        Appointment.objects.create(profile=self.profile, hospital_name='H1')
-        Appointment.objects.create(profile=self.profile, hospital_name='H2')
+        Appointment.objects.bulk_create([
+            Appointment(profile=self.profile, hospital_name='H1'),
+            Appointment(profile=self.profile, hospital_name='H2'),
+        ])
         self.assertEqual(Appointment.objects.count(), 2)
         self.profile.delete()
-        self.assertEqual(Appointment.objects.count(), 0)
+        self.assertFalse(Appointment.objects.exists())
 
 
 class AppointmentAPITestCase(TestCase):
     """Tests for appointment API endpoints."""
 
-    def setUp(self):
-        self.client = Client()
-        self.user_uid = uuid.uuid4()
-        self.profile = Profile.objects.create(
-            supabase_uid=self.user_uid,
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_uid = uuid.uuid4()
+        cls.profile = Profile.objects.create(
+            supabase_uid=cls.user_uid,
             email='api_test@example.com',
             full_name='API Test User',
             onboarding_completed=True,
             onboarding_data={'full_name': 'API Test User', 'age': 35}
         )
-        self.mock_user = MagicMock()
-        self.mock_user.id = str(self.user_uid)
-        self.mock_user.email = 'api_test@example.com'
+        cls.mock_user = SupabaseUser(id=str(cls.user_uid), email='api_test@example.com', user_metadata={})
+
+    def setUp(self):
+        self.client = Client()
 
     @patch('api.decorators.get_supabase_user')
     def test_get_appointments_empty(self, mock_auth):
@@ -106,12 +117,11 @@ class AppointmentAPITestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()['appointments']), 1)
 
-    @patch('api.appointment_service.simulate_appointment_booking')
+    @patch('api.appointment_service.simulate_appointment_booking', new=fake_simulate_booking)
     @patch('api.decorators.get_supabase_user')
-    def test_create_appointment(self, mock_auth, mock_simulate):
+    def test_create_appointment(self, mock_auth):
         """Test creating a new appointment."""
         mock_auth.return_value = self.mock_user
-        mock_simulate.return_value = {'success': True, 'status': 'confirmed'}
         
         response = self.client.post(
             '/api/appointments/',
@@ -156,15 +166,17 @@ class AppointmentAPITestCase(TestCase):
         """Test that users can only see their own appointments."""
         mock_auth.return_value = self.mock_user
         other_profile = Profile.objects.create(supabase_uid=uuid.uuid4(), email='other@test.com')
-        Appointment.objects.create(profile=other_profile, hospital_name='Other Hospital')
-        Appointment.objects.create(profile=self.profile, hospital_name='My Hospital')
+        Appointment.objects.bulk_create([
+            Appointment(profile=other_profile, hospital_name='Other Hospital'),
+            Appointment(profile=self.profile, hospital_name='My Hospital'),
+        ])
         
         response = self.client.get('/api/appointments/', HTTP_AUTHORIZATION='Bearer test')
         self.assertEqual(len(response.json()['appointments']), 1)
         self.assertEqual(response.json()['appointments'][0]['hospital_name'], 'My Hospital')
 
 
-class TestPhoneNumberConfigTestCase(TestCase):
+class TestPhoneNumberConfigTestCase(SimpleTestCase):
     """Tests to verify TEST_PHONE_NUMBER is always used."""
 
     def test_test_phone_number_configured(self):
@@ -188,28 +200,40 @@ class TestPhoneNumberConfigTestCase(TestCase):
 class AppointmentServiceTestCase(TestCase):
     """Tests for appointment service functions."""
 
-    def setUp(self):
-        self.profile = Profile.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = Profile.objects.create(
             supabase_uid=uuid.uuid4(),
             email='service@test.com',
             full_name='Service Test',
             onboarding_data={'full_name': 'Service Test', 'symptoms_current': 'Headache'}
         )
 
-    @patch('api.appointment_service.genai')
+    def setUp(self):
+        clear_model_cache()
+        cache.clear()
+
+    def _wait_for_published_reply(self, appointment_id, timeout=5):
+        """Block until the streaming worker has published its deferred reply."""
+        import time
+        from .appointment_service import _pending_reply_key
+        
+        deadline = time.monotonic() + timeout
+        while cache.get(_pending_reply_key(appointment_id)) is None:
+            self.assertLess(time.monotonic(), deadline, 'deferred reply was never published')
+            time.sleep(0.01)
+
+    @patch('api.ai_service.genai')
     def test_simulate_appointment_booking(self, mock_genai):
         """Test simulated appointment booking."""
         from .appointment_service import simulate_appointment_booking
         
         mock_model = MagicMock()
         
-        # First call - conversation simulation
-        conv_resp = MagicMock()
-        conv_resp.text = "AI: Hello\nReceptionist: Hi, confirmed for tomorrow 10AM with Dr. Test"
-        
-        # Second call - extract details
-        details_resp = MagicMock()
-        details_resp.text = json.dumps({
+        # One structured call returns the conversation and its details
+        conv_and_details_resp = MagicMock()
+        conv_and_details_resp.text = json.dumps({
+            'transcript': "AI: Hello\nReceptionist: Hi, confirmed for tomorrow 10AM with Dr. Test",
             'appointment_confirmed': True,
             'appointment_date': '2025-01-15',
             'appointment_time': '10:00',
@@ -217,7 +241,7 @@ class AppointmentServiceTestCase(TestCase):
             'department': 'General'
         })
         
-        mock_model.generate_content.side_effect = [conv_resp, details_resp]
+        mock_model.generate_content.return_value = conv_and_details_resp
         mock_genai.GenerativeModel.return_value = mock_model
         
         apt = Appointment.objects.create(
@@ -231,26 +255,496 @@ class AppointmentServiceTestCase(TestCase):
         self.assertTrue(result['success'])
         apt.refresh_from_db()
         self.assertEqual(apt.status, 'confirmed')
+        self.assertEqual(apt.appointment_date, date(2025, 1, 15))
+        self.assertTrue(apt.call_transcript.startswith('AI: Hello'))
+        mock_model.generate_content.assert_called_once()
+        generation_config = mock_model.generate_content.call_args.kwargs['generation_config']
+        self.assertEqual(generation_config['response_mime_type'], 'application/json')
+
+
+    @patch('api.ai_service.settings')
+    @patch('api.ai_service.genai')
+    def test_generate_ai_response_keeps_preamble_stable(self, mock_genai, mock_settings):
+        """Patient details live in a per-call system instruction; turns only send the delta."""
+        from .appointment_service import generate_ai_response
+        
+        mock_settings.GEMINI_API_KEY = 'test-key'
+        mock_genai.GenerativeModel.return_value.generate_content.return_value.text = 'Sure.'
+        patient_info = {'full_name': 'Service Test', 'age': 40, 'symptoms_current': 'Headache'}
+        
+        generate_ai_response('City Hospital', patient_info, 'Headache', [], is_initial=True)
+        generate_ai_response('City Hospital', patient_info, 'Headache',
+                             [{'role': 'ai', 'text': 'Hello'}, {'role': 'hospital', 'text': 'Hi'}],
+                             hospital_response='We have 3 PM free')
+        
+        # Both turns share one model built around the call's preamble
+        mock_genai.GenerativeModel.assert_called_once()
+        self.assertIn('Service Test', mock_genai.GenerativeModel.call_args.kwargs['system_instruction'])
+        generate_call = mock_genai.GenerativeModel.return_value.generate_content.call_args
+        turn_prompt = generate_call[0][0]
+        self.assertIn('We have 3 PM free', turn_prompt)
+        self.assertNotIn('Service Test', turn_prompt)
+        # Live-call turns use the tight priority deadline
+        self.assertEqual(generate_call.kwargs['request_options'], {'timeout': 8})
+        self.assertEqual(generate_call.kwargs['generation_config'], {'max_output_tokens': 2048})
+
+    def test_extract_appointment_details_fast(self):
+        """Regex extraction picks up doctor, time, relative date and confirmation."""
+        from .appointment_service import extract_appointment_details_fast
+        
+        details = extract_appointment_details_fast(
+            "Hospital: Not today, sorry. Dr. mehta is free the day after tomorrow at 4:30 p.m.\n"
+            "AI: Great, please book it.\nHospital: It's booked."
+        )
+        
+        self.assertTrue(details['appointment_confirmed'])
+        self.assertEqual(details['doctor_name'], 'Dr. Mehta')
+        self.assertEqual(details['appointment_time'], time(16, 30))
+        self.assertEqual(details['appointment_date'], date.today() + timedelta(days=2))
+
+    @patch('api.appointment_service.generate_ai_response_stream')
+    def test_process_call_response_replies_inline(self, mock_stream):
+        """A reply that is ready within the wait window is spoken in the same TwiML."""
+        from .appointment_service import process_call_response
+        
+        mock_stream.return_value = iter(['Does 3 PM ', 'work for the patient?'])
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=[{'role': 'ai', 'text': 'Hello'}])
+        
+        twiml = process_call_response(apt.id, 'We have some slots', 'https://example.com')
+        
+        self.assertIn('Does 3 PM work for the patient?', twiml)
+        self.assertIn('/api/appointments/call-response/', twiml)
+        apt.refresh_from_db()
+        self.assertEqual(apt.call_transcript, '')
+        self.assertEqual(apt.transcript, 'AI: Hello\nHospital: We have some slots\nAI: Does 3 PM work for the patient?')
+        self.assertEqual(apt.call_history, [
+            {'role': 'ai', 'text': 'Hello'},
+            {'role': 'hospital', 'text': 'We have some slots'},
+            {'role': 'ai', 'text': 'Does 3 PM work for the patient?'},
+        ])
+
+    @patch('api.appointment_service.generate_ai_response_stream')
+    def test_process_call_response_final_turn_saves_once(self, mock_stream):
+        """The closing turn writes transcript and outcome in a single UPDATE."""
+        from .appointment_service import process_call_response
+        
+        mock_stream.return_value = iter(['Thank you, goodbye.'])
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=[{'role': 'ai', 'text': 'Hello'}])
+        
+        # appointment lookup joined with its profile, then one UPDATE
+        with self.assertNumQueries(2):
+            twiml = process_call_response(apt.id, 'You are booked with Dr. Rao tomorrow at 10 am',
+                                          'https://example.com')
+        
+        self.assertIn('<Hangup', twiml)
+        apt.refresh_from_db()
+        self.assertEqual(apt.status, 'confirmed')
+        self.assertEqual(apt.doctor_name, 'Dr. Rao')
+        self.assertEqual(apt.appointment_time, time(10, 0))
+        self.assertEqual(apt.call_transcript,
+                         'AI: Hello\nHospital: You are booked with Dr. Rao tomorrow at 10 am\nAI: Thank you, goodbye.')
+
+    def test_update_call_status_marks_unanswered_call_failed(self):
+        """Status callbacks only touch the columns they change."""
+        from .appointment_service import update_call_status
+        
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', doctor_name='Dr. Keep')
+        
+        with self.assertNumQueries(2):
+            update_call_status(apt.id, 'no-answer', 12)
+        
+        apt.refresh_from_db()
+        self.assertEqual(apt.status, 'failed')
+        self.assertEqual(apt.notes, 'Call no-answer')
+        self.assertEqual(apt.call_duration, 12)
+        self.assertEqual(apt.doctor_name, 'Dr. Keep')
+
+    def test_update_call_status_stores_transcript_of_abandoned_call(self):
+        """A call that ends without a closing turn keeps its transcript for re-extraction."""
+        from .appointment_service import update_call_status
+        
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital', status='calling',
+                                         call_history=[{'role': 'ai', 'text': 'Hello'},
+                                                       {'role': 'hospital', 'text': 'Please hold'}])
+        
+        update_call_status(apt.id, 'completed')
+        
+        apt.refresh_from_db()
+        self.assertEqual(apt.status, 'failed')
+        self.assertEqual(apt.call_transcript, 'AI: Hello\nHospital: Please hold')
+
+    @patch('api.appointment_service.summarize_call_history')
+    @patch('api.appointment_service.generate_ai_response_stream')
+    def test_process_call_response_sends_short_history_verbatim(self, mock_stream, mock_summarize):
+        """History under the token threshold is sent in full without summarising."""
+        from .appointment_service import process_call_response
+        
+        mock_stream.return_value = iter(['Okay.'])
+        turns = [{'role': 'hospital' if i % 2 else 'ai', 'text': f'turn {i}'} for i in range(20)]
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=turns)
+        
+        process_call_response(apt.id, 'Anything else?', 'https://example.com')
+        
+        mock_summarize.assert_not_called()
+        self.assertEqual(mock_stream.call_args[0][3], turns)
+
+    @patch('api.appointment_service.call_gemini_for_appointment')
+    def test_extract_appointment_details_accepts_fenced_json(self, mock_gemini):
+        """A markdown-fenced Gemini reply is still parsed."""
+        from .appointment_service import extract_appointment_details
+        
+        mock_gemini.return_value = '```json\n{"appointment_confirmed": false, "notes": "Call back Monday"}\n```'
+        
+        details = extract_appointment_details('Hospital: Please call back on Monday.', 'City Hospital')
+        
+        self.assertEqual(details, {'appointment_confirmed': False, 'notes': 'Call back Monday'})
+
+    def test_dedupe_turns_keeps_latest_repeat(self):
+        """A speaker's word-for-word repeat is sent once, at its latest position."""
+        from .appointment_service import _dedupe_turns
+        
+        turns = [
+            {'role': 'hospital', 'text': 'We have 3 PM on Tuesday'},
+            {'role': 'ai', 'text': 'Yes, 3pm works'},
+            {'role': 'hospital', 'text': 'Which doctor would you prefer?'},
+            {'role': 'ai', 'text': 'yes 3pm works'},
+            {'role': 'hospital', 'text': 'We have 3 PM on Tuesday.'},
+        ]
+        
+        self.assertEqual(_dedupe_turns(turns), [turns[2], turns[3], turns[4]])
+
+    def test_dedupe_turns_keeps_turns_that_differ_in_meaning(self):
+        """Changed slots and negations are never merged, however similar the spelling."""
+        from .appointment_service import _dedupe_turns
+        
+        turns = [
+            {'role': 'hospital', 'text': 'We have Dr Sharma available tomorrow at 10 am'},
+            {'role': 'ai', 'text': 'The patient is allergic to penicillin'},
+            {'role': 'hospital', 'text': 'We have Dr Sharma available tomorrow at 11 am'},
+            {'role': 'ai', 'text': 'The patient is not allergic to penicillin'},
+        ]
+        
+        self.assertEqual(_dedupe_turns(turns), turns)
+
+    @patch('api.appointment_service.HISTORY_SUMMARY_TOKENS', 10)
+    @patch('api.appointment_service._fold_in_background')
+    @patch('api.appointment_service._reply_executor')
+    @patch('api.appointment_service.summarize_call_history')
+    @patch('api.appointment_service.generate_ai_response_stream')
+    def test_process_call_response_folds_older_turns_after_replying(self, mock_stream, mock_summarize,
+                                                                      mock_executor, mock_fold):
+        """The reply uses the stored summary; older turns are folded on a worker once the turn is saved."""
+        from .appointment_service import CALL_HISTORY_WINDOW, _dedupe_turns, process_call_response
+        
+        mock_stream.return_value = iter(['Okay.'])
+        mock_executor.submit.side_effect = lambda fn, *args: fn(*args)
+        turns = [{'role': 'hospital' if i % 2 else 'ai', 'text': f'turn number {i}'} for i in range(20)]
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=turns,
+                                         history_summary='Hospital asked for the patient name.',
+                                         history_summarized_turns=4)
+        
+        process_call_response(apt.id, 'Anything else?', 'https://example.com')
+        
+        mock_summarize.assert_not_called()
+        self.assertEqual(mock_stream.call_args[0][3], _dedupe_turns(turns[4:]))
+        self.assertEqual(mock_stream.call_args.kwargs['history_summary'], 'Hospital asked for the patient name.')
+        window_start = 22 - CALL_HISTORY_WINDOW
+        mock_fold.assert_called_once()
+        self.assertEqual(mock_fold.call_args[0][:4], (apt.id, 'Hospital asked for the patient name.', 4, window_start))
+        self.assertEqual(len(mock_fold.call_args[0][4]), window_start - 4)
+
+    @patch('api.appointment_service.summarize_call_history')
+    def test_store_history_fold_skips_turns_already_folded(self, mock_summarize):
+        """A fold only lands if no other fold moved the summary on in the meantime."""
+        from .appointment_service import _store_history_fold
+        
+        mock_summarize.return_value = 'Hospital offered Tuesday 3 PM with Dr. Rao.'
+        turns = [{'role': 'hospital' if i % 2 else 'ai', 'text': f'turn number {i}'} for i in range(20)]
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=turns)
+        
+        _store_history_fold(apt.id, '', 0, 14, turns[:14])
+        _store_history_fold(apt.id, '', 0, 16, turns[:16])
+        
+        mock_summarize.assert_called_with('', turns[:16])
+        apt.refresh_from_db()
+        self.assertEqual(apt.history_summarized_turns, 14)
+        self.assertEqual(apt.history_summary, 'Hospital offered Tuesday 3 PM with Dr. Rao.')
+
+    @patch('api.appointment_service.INTERIM_REPLY_WAIT', 0.2)
+    @patch('api.appointment_service.generate_ai_response_stream')
+    def test_process_call_response_speaks_first_sentence_early(self, mock_stream):
+        """A slow reply's finished sentences are spoken at once; call-next speaks the rest."""
+        import threading
+        from .appointment_service import process_call_next, process_call_response
+        
+        release = threading.Event()
+        
+        def slow_reply(*args, **kwargs):
+            yield 'Thank you for checking. '
+            release.wait(5)
+            yield 'Could we get a morning slot?'
+        
+        mock_stream.side_effect = slow_reply
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=[{'role': 'ai', 'text': 'Hello'}])
+        
+        twiml = process_call_response(apt.id, 'Let me check', 'https://example.com')
+        
+        self.assertIn('Thank you for checking.', twiml)
+        self.assertNotIn('One moment', twiml)
+        self.assertIn('https://example.com/api/appointments/call-next/', twiml)
+        
+        release.set()
+        self._wait_for_published_reply(apt.id)
+        twiml = process_call_next(apt.id, 'https://example.com')
+        
+        self.assertIn('Could we get a morning slot?', twiml)
+        self.assertNotIn('Thank you for checking.', twiml)
+        apt.refresh_from_db()
+        self.assertIn('Hospital: Let me check\nAI: Thank you for checking. Could we get a morning slot?',
+                      apt.transcript)
+
+    @patch('api.appointment_service.INTERIM_REPLY_WAIT', 0.05)
+    @patch('api.appointment_service.generate_ai_response_stream')
+    def test_process_call_response_fills_silence_before_first_sentence(self, mock_stream):
+        """With no finished sentence yet, a filler line bridges to call-next."""
+        import threading
+        from .appointment_service import process_call_next, process_call_response
+        
+        release = threading.Event()
+        
+        def slow_reply(*args, **kwargs):
+            release.wait(5)
+            yield 'Could we get a morning slot?'
+        
+        mock_stream.side_effect = slow_reply
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital',
+                                         status='calling', call_history=[{'role': 'ai', 'text': 'Hello'}])
+        
+        twiml = process_call_response(apt.id, 'Let me check', 'https://example.com')
+        self.assertIn('One moment, please.', twiml)
+        
+        release.set()
+        self._wait_for_published_reply(apt.id)
+        self.assertIn('Could we get a morning slot?', process_call_next(apt.id, 'https://example.com'))
+
+    def test_process_call_next_collects_reply_published_by_another_worker(self):
+        """call-next reads the deferred reply from the shared cache, not process memory."""
+        from .appointment_service import _pending_reply_key, process_call_next
+        
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital', status='calling',
+                                         call_history=[{'role': 'ai', 'text': 'Hello'},
+                                                       {'role': 'hospital', 'text': 'Let me check'}])
+        cache.set(_pending_reply_key(apt.id), {
+            'token': 'reply-1',
+            'text': 'Thank you for checking. Could we get a morning slot?',
+            'spoken': 'Thank you for checking.',
+            'confirmed_in_speech': False,
+            'should_end': False,
+        })
+        
+        twiml = process_call_next(apt.id, 'https://example.com')
+        
+        self.assertIn('Could we get a morning slot?', twiml)
+        self.assertNotIn('Thank you for checking.', twiml)
+        self.assertIsNone(cache.get(_pending_reply_key(apt.id)))
+        apt.refresh_from_db()
+        self.assertEqual(apt.call_history[-1]['text'], 'Thank you for checking. Could we get a morning slot?')
+
+    def test_process_call_next_pauses_while_reply_is_generating(self):
+        """call-next hands the wait back to Twilio as a pause and a redirect to itself."""
+        from .appointment_service import process_call_next
+        
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital', status='calling')
+        
+        twiml = process_call_next(apt.id, 'https://example.com', attempt=2)
+        
+        self.assertIn('<Pause length="1" />', twiml)
+        self.assertIn(f'https://example.com/api/appointments/call-next/{apt.id}/?attempt=3', twiml)
+        self.assertNotIn('repeat', twiml)
+
+    def test_take_pending_reply_claims_each_reply_once(self):
+        """Two webhooks that both read the published reply cannot both claim it."""
+        from .appointment_service import _pending_reply_key, _take_pending_reply
+        
+        pending = {'token': 'reply-1', 'text': 'Could we get a morning slot?', 'spoken': '',
+                   'confirmed_in_speech': False, 'should_end': False}
+        cache.set(_pending_reply_key(1), pending)
+        
+        self.assertEqual(_take_pending_reply(1), pending)
+        
+        # A second worker that read the value before the first one deleted it
+        cache.set(_pending_reply_key(1), pending)
+        self.assertIsNone(_take_pending_reply(1))
+
+    @patch('api.appointment_service.INTERIM_REPLY_WAIT', 0)
+    @patch.dict('api.appointment_service.REQUEST_TIMEOUTS', {'priority': 0})
+    def test_process_call_next_without_reply_asks_to_repeat(self):
+        """With no published reply, call-next re-prompts instead of failing the call."""
+        from .appointment_service import process_call_next
+        
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital', status='calling')
+        
+        twiml = process_call_next(apt.id, 'https://example.com')
+        
+        self.assertIn('could you please repeat that?', twiml)
+        apt.refresh_from_db()
+        self.assertEqual(apt.status, 'calling')
+
+    @patch('api.appointment_service.call_gemini_for_appointment')
+    def test_extract_appointment_details_lets_gemini_decide_confirmation(self, mock_gemini):
+        """A declined slot the regex spots is only a hint; Gemini's verdict is returned."""
+        from .appointment_service import extract_appointment_details
+        
+        mock_gemini.return_value = json.dumps({'appointment_confirmed': False, 'appointment_date': None,
+                                               'appointment_time': None, 'notes': 'Offered Friday 10am'})
+        
+        details = extract_appointment_details(
+            'Hospital: Sorry, we have nothing available tomorrow at 3pm. How about Friday at 10am?', 'City Hospital'
+        )
+        
+        prompt = mock_gemini.call_args[0][0]
+        self.assertIn('- appointment_confirmed:', prompt)
+        self.assertIn('- appointment_time: 15:00', prompt)
+        self.assertEqual(details, {'appointment_confirmed': False, 'appointment_date': None,
+                                   'appointment_time': None, 'notes': 'Offered Friday 10am'})
+
+    @patch('api.appointment_service.call_gemini_for_appointment')
+    def test_extract_appointment_details_falls_back_to_unconfirmed_hints(self, mock_gemini):
+        """Without Gemini the regex findings are returned, but never as a confirmed booking."""
+        from .appointment_service import extract_appointment_details
+        
+        mock_gemini.side_effect = Exception('Gemini down')
+        
+        details = extract_appointment_details(
+            "Receptionist: You're booked with Dr. Rao tomorrow at 11 am.", 'City Hospital'
+        )
+        
+        self.assertEqual(details, {
+            'appointment_date': (date.today() + timedelta(days=1)).strftime('%Y-%m-%d'),
+            'appointment_time': '11:00',
+            'doctor_name': 'Dr. Rao',
+        })
+
+    @patch('api.appointment_service.settings')
+    def test_get_twilio_client_is_shared(self, mock_settings):
+        """The Twilio client is built once per set of credentials."""
+        from .appointment_service import _twilio_client_for, get_twilio_client
+        
+        _twilio_client_for.cache_clear()
+        mock_settings.TWILIO_ACCOUNT_SID = "'AC123'"
+        mock_settings.TWILIO_AUTH_TOKEN = 'token'
+        
+        with patch('twilio.rest.Client') as mock_client_class:
+            first = get_twilio_client()
+            second = get_twilio_client()
+            mock_settings.TWILIO_AUTH_TOKEN = 'rotated'
+            get_twilio_client()
+        
+        self.assertIs(first, second)
+        self.assertEqual(mock_client_class.call_count, 2)
+        mock_client_class.assert_any_call('AC123', 'token')
+        _twilio_client_for.cache_clear()
 
+    @patch('api.appointment_service.settings')
+    @patch('api.appointment_service.get_phone_number_to_call', return_value='+911234567890')
+    @patch('api.appointment_service.get_twilio_client')
+    @patch('api.appointment_service.generate_ai_response')
+    def test_initiate_appointment_call(self, mock_generate, mock_client, mock_phone, mock_settings):
+        """The opening line is generated alongside Twilio setup and lands in the call TwiML."""
+        from .appointment_service import initiate_appointment_call
+        
+        mock_settings.TWILIO_PHONE_NUMBER = "'+15550001111'"
+        mock_generate.return_value = 'Hello, I am calling to book an appointment.'
+        mock_client.return_value.calls.create.return_value.sid = 'CA123'
+        apt = Appointment.objects.create(profile=self.profile, hospital_name='City Hospital')
+        
+        result = initiate_appointment_call(apt.id, '+910000000000', {'full_name': 'Service Test'},
+                                           'Headache', 'https://example.com')
+        
+        self.assertTrue(result['success'])
+        create_kwargs = mock_client.return_value.calls.create.call_args.kwargs
+        self.assertIn('Hello, I am calling to book an appointment.', create_kwargs['twiml'])
+        self.assertEqual(create_kwargs['from_'], '+15550001111')
+        apt.refresh_from_db()
+        self.assertEqual(apt.status, 'calling')
+        self.assertEqual(apt.call_sid, 'CA123')
+
+    @patch('api.appointment_service.call_gemini_for_appointment')
+    def test_reextract_appointments_command(self, mock_gemini):
+        """Failed calls with confirmable transcripts are re-extracted and bulk-updated."""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        mock_gemini.side_effect = lambda prompt, **kwargs: json.dumps(
+            {'appointment_confirmed': True, 'appointment_date': '2025-03-10', 'appointment_time': '11:00',
+             'doctor_name': 'Dr. Rao'}
+            if "You're booked" in prompt else {'appointment_confirmed': False}
+        )
+        confirmed = Appointment.objects.create(
+            profile=self.profile, hospital_name='City Hospital', status='failed',
+            call_transcript="Hospital: You're booked with Dr. Rao tomorrow at 11 am."
+        )
+        unclear = Appointment.objects.create(
+            profile=self.profile, hospital_name='City Hospital', status='failed',
+            call_transcript='Hospital: Please call back later.'
+        )
+        
+        out = StringIO()
+        call_command('reextract_appointments', stdout=out)
+        
+        self.assertIn('Updated 1 of 2 appointments', out.getvalue())
+        confirmed.refresh_from_db()
+        unclear.refresh_from_db()
+        self.assertEqual(confirmed.status, 'confirmed')
+        self.assertEqual(confirmed.appointment_time, time(11, 0))
+        self.assertEqual(confirmed.doctor_name, 'Dr. Rao')
+        self.assertEqual(unclear.status, 'failed')
+        self.assertEqual(mock_gemini.call_count, 2)
+
+    @patch('api.appointment_service.call_gemini_for_appointment')
+    def test_batch_extract_leaves_cancelled_appointments_alone(self, mock_gemini):
+        """A cancelled appointment passed by id is never re-read into 'confirmed'."""
+        from .appointment_service import batch_extract_appointment_details
+        
+        mock_gemini.return_value = json.dumps({'appointment_confirmed': True, 'appointment_time': '11:00'})
+        cancelled = Appointment.objects.create(
+            profile=self.profile, hospital_name='City Hospital', status='cancelled',
+            call_transcript="Hospital: You're booked with Dr. Rao tomorrow at 11 am."
+        )
+        
+        self.assertEqual(batch_extract_appointment_details([cancelled.id]), 0)
+        
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'cancelled')
+        mock_gemini.assert_not_called()
 
 class IntegrationTestCase(TestCase):
     """Integration tests for the complete booking flow."""
 
-    def setUp(self):
-        self.client = Client()
-        self.user_uid = uuid.uuid4()
-        self.profile = Profile.objects.create(
-            supabase_uid=self.user_uid,
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_uid = uuid.uuid4()
+        cls.profile = Profile.objects.create(
+            supabase_uid=cls.user_uid,
             email='integration@test.com',
             full_name='Integration User',
             onboarding_completed=True,
             onboarding_data={'full_name': 'Integration User', 'symptoms_current': 'Fever'}
         )
-        self.mock_user = MagicMock()
-        self.mock_user.id = str(self.user_uid)
-        self.mock_user.email = 'integration@test.com'
+        cls.mock_user = SupabaseUser(id=str(cls.user_uid), email='integration@test.com', user_metadata={})
 
-    @patch('api.appointment_service.genai')
+    def setUp(self):
+        self.client = Client()
+        clear_model_cache()
+
+    @patch('api.ai_service.genai')
     @patch('api.decorators.get_supabase_user')
     def test_full_booking_flow(self, mock_auth, mock_genai):
         """Test complete appointment booking flow."""
@@ -258,13 +752,10 @@ class IntegrationTestCase(TestCase):
         
         mock_model = MagicMock()
         
-        # First call - conversation simulation
-        conv_resp = MagicMock()
-        conv_resp.text = "AI: Booking for fever\nReceptionist: Confirmed tomorrow 2PM Dr. Kumar"
-        
-        # Second call - extract details
-        details_resp = MagicMock()
-        details_resp.text = json.dumps({
+        # One structured call returns the conversation and its details
+        conv_and_details_resp = MagicMock()
+        conv_and_details_resp.text = json.dumps({
+            'transcript': "AI: Booking for fever\nReceptionist: Confirmed tomorrow 2PM Dr. Kumar",
             'appointment_confirmed': True,
             'appointment_date': (date.today() + timedelta(days=1)).strftime('%Y-%m-%d'),
             'appointment_time': '14:00',
@@ -272,7 +763,7 @@ class IntegrationTestCase(TestCase):
             'department': 'General Medicine'
         })
         
-        mock_model.generate_content.side_effect = [conv_resp, details_resp]
+        mock_model.generate_content.return_value = conv_and_details_resp
         mock_genai.GenerativeModel.return_value = mock_model
         
         # Create appointment
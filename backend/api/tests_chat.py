@@ -1,22 +1,48 @@
 import json
-from unittest.mock import patch, MagicMock
-from django.test import TestCase, Client
-from django.urls import reverse
+import re
+from collections import Counter
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch, MagicMock
+
+import responses
+from django.core.cache import caches
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from api.models import Profile, ChatSession, ChatMessage
-from api.ai_service import build_patient_context, get_ai_response
+from api.ai_service import DECODO_URL, build_patient_context, get_patient_context, get_ai_response, clear_model_cache
+from api.response_cache import response_cache
+from api.supabase_auth import SupabaseUser
 import uuid
 
 
-class MockSupabaseUser:
-    def __init__(self, user_id, email='test@example.com'):
-        self.id = user_id
-        self.email = email
-        self.user_metadata = {'full_name': 'Test User'}
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+CREATE_BODY = json.dumps({'title': 'New Chat'}).encode()
+SEND_BODY = json.dumps({'message': 'What should I do for a headache?'}).encode()
+EMPTY_BODY = b'{"message": ""}'
+
+
+class NPlusOneGuardMixin:
+    """Fails a block that issues the same SELECT shape more than once, i.e. a lazy load per row."""
+
+    @contextmanager
+    def assertNoRepeatedSelects(self):
+        with CaptureQueriesContext(connection) as ctx:
+            yield
+        shapes = Counter(
+            _SQL_LITERAL_RE.sub('?', q['sql']) for q in ctx.captured_queries
+            if q['sql'].lstrip().upper().startswith('SELECT')
+        )
+        repeated = [sql for sql, count in shapes.items() if count > 1]
+        self.assertFalse(repeated, f'Repeated SELECTs (N+1?): {repeated}')
 
 
 class ChatModelsTestCase(TestCase):
-    def setUp(self):
-        self.profile = Profile.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = Profile.objects.create(
             supabase_uid=uuid.uuid4(),
             email='test@example.com',
             full_name='Test User',
@@ -69,10 +95,29 @@ class ChatModelsTestCase(TestCase):
         ChatMessage.objects.create(session=session, role='user', content='Test')
         session_id = session.id
         session.delete()
-        self.assertEqual(ChatMessage.objects.filter(session_id=session_id).count(), 0)
+        self.assertFalse(ChatMessage.objects.filter(session_id=session_id).exists())
 
 
-class AIServiceTestCase(TestCase):
+class AIServiceTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Patched once for the class; setUp resets the mocks between tests
+        settings_patcher = patch('api.ai_service.settings')
+        genai_patcher = patch('api.ai_service.genai')
+        cls.mock_settings = settings_patcher.start()
+        cls.mock_genai = genai_patcher.start()
+        cls.addClassCleanup(settings_patcher.stop)
+        cls.addClassCleanup(genai_patcher.stop)
+
+    def setUp(self):
+        self.mock_genai.reset_mock(return_value=True, side_effect=True)
+        self.mock_settings.reset_mock()
+        self.mock_settings.GEMINI_API_KEY = 'test_api_key'
+        self.mock_settings.DECODO_AUTH_TOKEN = ''
+        response_cache.clear()
+        clear_model_cache()
+
     def test_build_patient_context_with_data(self):
         onboarding_data = {
             'full_name': 'John Doe',
@@ -102,56 +147,201 @@ class AIServiceTestCase(TestCase):
         context = build_patient_context(None)
         self.assertEqual(context, 'No patient data available.')
 
-    @patch('api.ai_service.settings')
-    @patch('api.ai_service.genai')
-    def test_get_ai_response_gemini_success(self, mock_genai, mock_settings):
-        mock_settings.GEMINI_API_KEY = 'test_api_key'
-        mock_settings.DECODO_AUTH_TOKEN = ''
-        
-        mock_model = MagicMock()
-        mock_chat = MagicMock()
-        mock_response = MagicMock()
-        mock_response.text = 'I recommend rest and hydration.'
-        mock_chat.send_message.return_value = mock_response
-        mock_model.start_chat.return_value = mock_chat
-        mock_genai.GenerativeModel.return_value = mock_model
+    def test_build_patient_context_ranks_records_within_budget(self):
+        records = [
+            {'category': 'vitals', 'title': f'Routine {i}', 'summary': 'x' * 300, 'status': 'normal',
+             'record_date': f'2024-01-{i + 1:02d}', 'details': {'notes': 'y' * 2000}}
+            for i in range(30)
+        ]
+        records.append({'category': 'imaging', 'title': 'Old CT', 'summary': 'Mass found',
+                        'status': 'critical', 'record_date': '2019-05-01', 'details': {}})
+        context = build_patient_context({}, '', records)
+        self.assertLess(context.index('Old CT'), context.index('Routine 29'))
+        self.assertNotIn('Routine 0\n', context)
+        self.assertNotIn('y' * 500, context)
+
+    def test_get_patient_context_matches_uncached_render(self):
+        from datetime import date
+        onboarding_data = {'full_name': 'John Doe', 'age': 35, 'height': 175}
+        records = [{
+            'category': 'lab_result', 'title': 'CBC', 'summary': 'Normal',
+            'status': 'normal', 'record_date': date(2024, 1, 15), 'details': {'Hemoglobin': '14'},
+        }]
+        expected = build_patient_context(onboarding_data, 'Healthy', records)
+        self.assertEqual(get_patient_context(onboarding_data, 'Healthy', records), expected)
+        self.assertIs(get_patient_context(dict(onboarding_data), 'Healthy', list(records)),
+                      get_patient_context(onboarding_data, 'Healthy', records))
+
+    def test_get_ai_response_gemini_success(self):
+        mock_response = SimpleNamespace(text='I recommend rest and hydration.')
+        mock_chat = SimpleNamespace(send_message=lambda *a, **k: mock_response)
+        self.mock_genai.GenerativeModel.return_value = SimpleNamespace(start_chat=lambda *a, **k: mock_chat)
         
         messages = [{'role': 'user', 'content': 'I have a headache'}]
         response = get_ai_response(messages, {'full_name': 'Test'})
         
         self.assertEqual(response, 'I recommend rest and hydration.')
-        mock_genai.configure.assert_called_once()
+        self.mock_genai.configure.assert_called_once()
 
-    @patch('api.ai_service.requests.post')
-    @patch('api.ai_service.settings')
-    @patch('api.ai_service.genai')
-    def test_get_ai_response_fallback_to_decodo(self, mock_genai, mock_settings, mock_requests_post):
-        mock_settings.GEMINI_API_KEY = 'test_api_key'
-        mock_settings.DECODO_AUTH_TOKEN = 'Basic test_token'
+    @responses.activate
+    def test_get_ai_response_fallback_to_decodo(self):
+        self.mock_settings.DECODO_AUTH_TOKEN = 'Basic test_token'
         
         # Make Gemini fail
-        mock_genai.configure.return_value = None
+        self.mock_genai.configure.return_value = None
         mock_model = MagicMock()
         mock_model.start_chat.side_effect = Exception('Gemini error')
-        mock_genai.GenerativeModel.return_value = mock_model
+        self.mock_genai.GenerativeModel.return_value = mock_model
         
-        # Decodo fallback success
-        decodo_response = MagicMock()
-        decodo_response.ok = True
-        decodo_response.json.return_value = {
-            'results': [{'content': 'Fallback response'}]
-        }
-        mock_requests_post.return_value = decodo_response
+        # Decodo fallback success, served over the real pooled session
+        decodo = responses.post(DECODO_URL, json={'results': [{'content': 'Fallback response'}]})
         
         messages = [{'role': 'user', 'content': 'Test'}]
         response = get_ai_response(messages, {})
         
         self.assertEqual(response, 'Fallback response')
+        self.assertEqual(decodo.call_count, 1)
+        self.assertEqual(decodo.calls[0].request.headers['Authorization'], 'Basic test_token')
+
+    def test_extract_decodo_content_strips_page_chrome(self):
+        from api.ai_service import extract_decodo_content
+        content = 'ChatGPT said: old turn You said: hi ChatGPT said: Drink water. Citations [1] Sources x'
+        self.assertEqual(extract_decodo_content({'results': [{'content': content}]}), 'Drink water.')
+        self.assertEqual(extract_decodo_content({'content': 'Plain answer'}), 'Plain answer')
+        self.assertEqual(
+            extract_decodo_content({'content': 'ChatGPT said: Sources'}),
+            'Sorry, I could not generate a response.',
+        )
 
-    @patch('api.ai_service.settings')
-    def test_get_ai_response_no_service_configured(self, mock_settings):
-        mock_settings.GEMINI_API_KEY = ''
-        mock_settings.DECODO_AUTH_TOKEN = ''
+    @patch('api.ai_service.HEDGE_DELAY_SECONDS', 0.05)
+    @patch('api.ai_service.call_decodo_fallback')
+    @patch('api.ai_service.call_gemini_api')
+    def test_get_ai_response_hedges_slow_gemini(self, mock_gemini, mock_decodo):
+        import threading
+        
+        self.mock_settings.DECODO_AUTH_TOKEN = 'Basic test_token'
+        
+        release = threading.Event()
+        mock_gemini.side_effect = lambda *args: release.wait(5) and 'Late Gemini response'
+        mock_decodo.return_value = 'Hedged Decodo response'
+        
+        try:
+            response = get_ai_response([{'role': 'user', 'content': 'Test'}], {})
+        finally:
+            release.set()
+        
+        self.assertEqual(response, 'Hedged Decodo response')
+        mock_decodo.assert_called_once()
+
+    def test_call_gemini_api_async_sets_up_chat_off_the_event_loop(self):
+        import asyncio
+        import threading
+        from api.ai_service import call_gemini_api_async
+
+        setup_threads = []
+        mock_chat = MagicMock()
+        mock_chat.send_message_async = AsyncMock(return_value=SimpleNamespace(text='Async reply'))
+
+        def fake_start(messages, patient_context):
+            setup_threads.append(threading.current_thread())
+            return mock_chat, messages[-1]['content']
+
+        async def run():
+            return await call_gemini_api_async([{'role': 'user', 'content': 'Hi'}], 'ctx'), threading.current_thread()
+
+        with patch('api.ai_service.start_gemini_chat', side_effect=fake_start):
+            response, loop_thread = asyncio.run(run())
+
+        self.assertEqual(response, 'Async reply')
+        self.assertNotEqual(setup_threads, [loop_thread])
+
+    @patch('api.ai_service.call_decodo_fallback_async')
+    @patch('api.ai_service.call_gemini_api_async')
+    def test_aget_ai_response_falls_back_to_decodo(self, mock_gemini, mock_decodo):
+        import asyncio
+        from api.ai_service import aget_ai_response
+        
+        self.mock_settings.DECODO_AUTH_TOKEN = 'Basic test_token'
+        mock_gemini.side_effect = Exception('Gemini error')
+        mock_decodo.return_value = 'Async fallback response'
+        
+        response = asyncio.run(aget_ai_response([{'role': 'user', 'content': 'Test'}], {}))
+        
+        self.assertEqual(response, 'Async fallback response')
+        mock_decodo.assert_awaited_once()
+
+    def test_get_ai_response_cache_hit(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.text = 'Stay hydrated and rest.'
+        self.mock_genai.GenerativeModel.return_value.start_chat.return_value = mock_chat
+        
+        first = get_ai_response([{'role': 'user', 'content': 'What should I do for a headache?'}], {'full_name': 'Test'})
+        second = get_ai_response([{'role': 'user', 'content': 'what should I do  for a headache'}], {'full_name': 'Test'})
+        
+        self.assertEqual(first, 'Stay hydrated and rest.')
+        self.assertEqual(second, 'Stay hydrated and rest.')
+        self.assertEqual(mock_chat.send_message.call_count, 1)
+
+    def test_get_ai_response_cache_requires_exact_question(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.text = 'Answer'
+        self.mock_genai.GenerativeModel.return_value.start_chat.return_value = mock_chat
+        
+        for question in ('Can I take 500mg of paracetamol?', 'Can I take 5000mg of paracetamol?',
+                         'Should I take ibuprofen', 'Should I not take ibuprofen'):
+            get_ai_response([{'role': 'user', 'content': question}], {'full_name': 'Test'})
+        
+        self.assertEqual(mock_chat.send_message.call_count, 4)
+
+    def test_get_ai_response_cache_respects_history(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.text = 'Answer'
+        self.mock_genai.GenerativeModel.return_value.start_chat.return_value = mock_chat
+        
+        for earlier in ('Should I see a cardiologist?', 'Should I stop my medication?'):
+            get_ai_response([
+                {'role': 'user', 'content': earlier},
+                {'role': 'assistant', 'content': 'Do you have chest pain?'},
+                {'role': 'user', 'content': 'yes'},
+            ], {'full_name': 'Test'})
+        
+        self.assertEqual(mock_chat.send_message.call_count, 2)
+
+    def test_get_ai_response_cache_respects_patient_context(self):
+        mock_chat = MagicMock()
+        mock_chat.send_message.return_value.text = 'Stay hydrated and rest.'
+        self.mock_genai.GenerativeModel.return_value.start_chat.return_value = mock_chat
+        
+        messages = [{'role': 'user', 'content': 'What should I do for a headache?'}]
+        get_ai_response(messages, {'full_name': 'Patient A'})
+        get_ai_response(messages, {'full_name': 'Patient B'})
+        
+        self.assertEqual(mock_chat.send_message.call_count, 2)
+
+    @patch('api.ai_service._backoff_delay', return_value=0)
+    def test_call_gemini_api_retries_transient_errors(self, mock_delay):
+        from google.api_core import exceptions as google_exceptions
+        from api.ai_service import call_gemini_api
+        mock_chat = MagicMock()
+        mock_chat.send_message.side_effect = [
+            google_exceptions.ServiceUnavailable('overloaded'),
+            MagicMock(text='Recovered response'),
+        ]
+        self.mock_genai.GenerativeModel.return_value.start_chat.return_value = mock_chat
+
+        response = call_gemini_api([{'role': 'user', 'content': 'Hi'}], 'ctx')
+
+        self.assertEqual(response, 'Recovered response')
+        self.assertEqual(mock_chat.send_message.call_count, 2)
+
+        mock_chat.send_message.reset_mock()
+        mock_chat.send_message.side_effect = google_exceptions.ResourceExhausted('quota')
+        with self.assertRaises(google_exceptions.ResourceExhausted):
+            call_gemini_api([{'role': 'user', 'content': 'Hi'}], 'ctx')
+        self.assertEqual(mock_chat.send_message.call_count, 3)
+
+    def test_get_ai_response_no_service_configured(self):
+        self.mock_settings.GEMINI_API_KEY = ''
         
         with self.assertRaises(Exception) as context:
             get_ai_response([{'role': 'user', 'content': 'Test'}], {})
@@ -159,25 +349,28 @@ class AIServiceTestCase(TestCase):
         self.assertIn('AI services are unavailable', str(context.exception))
 
 
-class ChatAPITestCase(TestCase):
-    def setUp(self):
-        self.client = Client()
-        self.user_uid = uuid.uuid4()
-        self.profile = Profile.objects.create(
-            supabase_uid=self.user_uid,
+class ChatAPITestCase(NPlusOneGuardMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_uid = uuid.uuid4()
+        cls.profile = Profile.objects.create(
+            supabase_uid=cls.user_uid,
             email='test@example.com',
             full_name='Test User',
             onboarding_completed=True,
             onboarding_data={'full_name': 'Test User', 'age': 30}
         )
+        cls.mock_user = SupabaseUser(
+            id=str(cls.user_uid), email='test@example.com', user_metadata={'full_name': 'Test User'}
+        )
 
     @patch('api.decorators.get_supabase_user')
     def test_create_chat_session(self, mock_get_user):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
+        mock_get_user.return_value = self.mock_user
         
         response = self.client.post(
             '/api/chat/sessions/',
-            data=json.dumps({'title': 'New Chat'}),
+            data=CREATE_BODY,
             content_type='application/json',
             HTTP_AUTHORIZATION='Bearer test_token'
         )
@@ -189,32 +382,42 @@ class ChatAPITestCase(TestCase):
 
     @patch('api.decorators.get_supabase_user')
     def test_list_chat_sessions(self, mock_get_user):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
-        
-        ChatSession.objects.create(profile=self.profile, title='Session 1')
-        ChatSession.objects.create(profile=self.profile, title='Session 2')
+        mock_get_user.return_value = self.mock_user
         
-        response = self.client.get(
-            '/api/chat/sessions/',
-            HTTP_AUTHORIZATION='Bearer test_token'
+        sessions = ChatSession.objects.bulk_create(
+            ChatSession(profile=self.profile, title=f'Session {i}') for i in range(5)
+        )
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=session, role='user', content='Hello') for session in sessions for _ in range(3)
         )
         
+        # Profile lookup + one session query, however many sessions exist
+        with self.assertNumQueries(2), self.assertNoRepeatedSelects():
+            response = self.client.get(
+                '/api/chat/sessions/',
+                HTTP_AUTHORIZATION='Bearer test_token'
+            )
+        
         self.assertEqual(response.status_code, 200)
         data = response.json()
-        self.assertEqual(len(data['sessions']), 2)
+        self.assertEqual(len(data['sessions']), 5)
 
     @patch('api.decorators.get_supabase_user')
     def test_get_chat_session_detail(self, mock_get_user):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
+        mock_get_user.return_value = self.mock_user
         
         session = ChatSession.objects.create(profile=self.profile, title='Test Session')
-        ChatMessage.objects.create(session=session, role='user', content='Hello')
-        ChatMessage.objects.create(session=session, role='ai', content='Hi there!')
-        
-        response = self.client.get(
-            f'/api/chat/sessions/{session.id}/',
-            HTTP_AUTHORIZATION='Bearer test_token'
-        )
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, role='user', content='Hello'),
+            ChatMessage(session=session, role='ai', content='Hi there!'),
+        ])
+        
+        # Session (scoped to the caller's profile) + one message query
+        with self.assertNumQueries(2), self.assertNoRepeatedSelects():
+            response = self.client.get(
+                f'/api/chat/sessions/{session.id}/',
+                HTTP_AUTHORIZATION='Bearer test_token'
+            )
         
         self.assertEqual(response.status_code, 200)
         data = response.json()
@@ -223,7 +426,7 @@ class ChatAPITestCase(TestCase):
 
     @patch('api.decorators.get_supabase_user')
     def test_delete_chat_session(self, mock_get_user):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
+        mock_get_user.return_value = self.mock_user
         
         session = ChatSession.objects.create(profile=self.profile, title='To Delete')
         
@@ -235,35 +438,85 @@ class ChatAPITestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertFalse(ChatSession.objects.filter(id=session.id).exists())
 
-    @patch('api.views.get_ai_response')
+    @patch('api.views.aget_ai_response')
     @patch('api.decorators.get_supabase_user')
     def test_send_chat_message(self, mock_get_user, mock_ai_response):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
+        mock_get_user.return_value = self.mock_user
         mock_ai_response.return_value = 'AI response here'
         
         session = ChatSession.objects.create(profile=self.profile)
-        
-        response = self.client.post(
-            f'/api/chat/sessions/{session.id}/send/',
-            data=json.dumps({'message': 'What should I do for a headache?'}),
-            content_type='application/json',
-            HTTP_AUTHORIZATION='Bearer test_token'
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=session, role=role, content='Earlier turn') for role in ('user', 'ai') * 3
         )
         
+        with self.assertNoRepeatedSelects():
+            response = self.client.post(
+                f'/api/chat/sessions/{session.id}/send/',
+                data=SEND_BODY,
+                content_type='application/json',
+                HTTP_AUTHORIZATION='Bearer test_token'
+            )
+        
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertEqual(data['user_message']['content'], 'What should I do for a headache?')
         self.assertEqual(data['ai_message']['content'], 'AI response here')
 
+    @patch('api.views.stream_ai_response')
+    @patch('api.decorators.get_supabase_user')
+    def test_send_chat_message_stream(self, mock_get_user, mock_stream):
+        mock_get_user.return_value = self.mock_user
+        mock_stream.return_value = iter(['Rest ', 'and ', 'hydrate.'])
+        
+        session = ChatSession.objects.create(profile=self.profile)
+        
+        with self.assertNoRepeatedSelects():
+            response = self.client.post(
+                f'/api/chat/sessions/{session.id}/send/stream/',
+                data=SEND_BODY,
+                content_type='application/json',
+                HTTP_AUTHORIZATION='Bearer test_token'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'Rest and hydrate.')
+        self.assertEqual(session.messages.last().content, 'Rest and hydrate.')
+
+    @patch('api.views.stream_ai_response')
+    @patch('api.decorators.get_supabase_user')
+    def test_send_chat_message_stream_failure_ends_with_marker(self, mock_get_user, mock_stream):
+        from api.views import STREAM_ERROR_MARKER
+        mock_get_user.return_value = self.mock_user
+        
+        def failing_stream(*args):
+            yield 'Rest '
+            raise Exception('Gemini internal detail')
+        
+        mock_stream.side_effect = failing_stream
+        session = ChatSession.objects.create(profile=self.profile)
+        
+        with self.assertLogs('api.views', 'ERROR'):
+            response = self.client.post(
+                f'/api/chat/sessions/{session.id}/send/stream/',
+                data=SEND_BODY,
+                content_type='application/json',
+                HTTP_AUTHORIZATION='Bearer test_token'
+            )
+            body = b''.join(response.streaming_content).decode()
+        
+        self.assertEqual(response['X-Stream-Error-Marker'], STREAM_ERROR_MARKER.strip())
+        self.assertEqual(body, 'Rest ' + STREAM_ERROR_MARKER)
+        self.assertNotIn('internal detail', body)
+        self.assertEqual(session.messages.last().role, 'user')
+
     @patch('api.decorators.get_supabase_user')
     def test_send_empty_message(self, mock_get_user):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
+        mock_get_user.return_value = self.mock_user
         
         session = ChatSession.objects.create(profile=self.profile)
         
         response = self.client.post(
             f'/api/chat/sessions/{session.id}/send/',
-            data=json.dumps({'message': ''}),
+            data=EMPTY_BODY,
             content_type='application/json',
             HTTP_AUTHORIZATION='Bearer test_token'
         )
@@ -272,7 +525,7 @@ class ChatAPITestCase(TestCase):
 
     @patch('api.decorators.get_supabase_user')
     def test_access_other_user_session(self, mock_get_user):
-        mock_get_user.return_value = MockSupabaseUser(str(self.user_uid))
+        mock_get_user.return_value = self.mock_user
         
         other_profile = Profile.objects.create(
             supabase_uid=uuid.uuid4(),
@@ -289,8 +542,9 @@ class ChatAPITestCase(TestCase):
 
 
 class IntegrationTestCase(TestCase):
-    def setUp(self):
-        self.profile = Profile.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = Profile.objects.create(
             supabase_uid=uuid.uuid4(),
             email='integration@test.com',
             full_name='Integration Test User',
@@ -313,29 +567,28 @@ class IntegrationTestCase(TestCase):
             title=''
         )
         
-        msg1 = ChatMessage.objects.create(
-            session=session,
-            role='user',
-            content='I have been experiencing back pain for a week'
-        )
-        
-        msg2 = ChatMessage.objects.create(
-            session=session,
-            role='ai',
-            content='I see you mentioned back pain. Given your profile shows high stress and limited exercise, this could be related. Consider gentle stretching and improving sleep quality.'
-        )
-        
-        msg3 = ChatMessage.objects.create(
-            session=session,
-            role='user',
-            content='What exercises do you recommend?'
-        )
-        
-        msg4 = ChatMessage.objects.create(
-            session=session,
-            role='ai',
-            content='For back pain relief, try cat-cow stretches, child pose, and gentle walking. Start with 10-15 minutes daily.'
-        )
+        msg1, msg2, msg3, msg4 = ChatMessage.objects.bulk_create([
+            ChatMessage(
+                session=session,
+                role='user',
+                content='I have been experiencing back pain for a week'
+            ),
+            ChatMessage(
+                session=session,
+                role='ai',
+                content='I see you mentioned back pain. Given your profile shows high stress and limited exercise, this could be related. Consider gentle stretching and improving sleep quality.'
+            ),
+            ChatMessage(
+                session=session,
+                role='user',
+                content='What exercises do you recommend?'
+            ),
+            ChatMessage(
+                session=session,
+                role='ai',
+                content='For back pain relief, try cat-cow stretches, child pose, and gentle walking. Start with 10-15 minutes daily.'
+            ),
+        ])
         
         session.title = msg1.content[:50]
         session.save()
@@ -347,13 +600,17 @@ class IntegrationTestCase(TestCase):
         self.assertEqual(session.title, 'I have been experiencing back pain for a week')
 
     def test_multiple_sessions_per_user(self):
-        session1 = ChatSession.objects.create(profile=self.profile, title='Back Pain')
-        session2 = ChatSession.objects.create(profile=self.profile, title='Diet Questions')
-        session3 = ChatSession.objects.create(profile=self.profile, title='Sleep Issues')
-        
-        ChatMessage.objects.create(session=session1, role='user', content='Back hurts')
-        ChatMessage.objects.create(session=session2, role='user', content='What should I eat?')
-        ChatMessage.objects.create(session=session3, role='user', content='Cannot sleep')
+        session1, session2, session3 = ChatSession.objects.bulk_create([
+            ChatSession(profile=self.profile, title='Back Pain'),
+            ChatSession(profile=self.profile, title='Diet Questions'),
+            ChatSession(profile=self.profile, title='Sleep Issues'),
+        ])
+        
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session1, role='user', content='Back hurts'),
+            ChatMessage(session=session2, role='user', content='What should I eat?'),
+            ChatMessage(session=session3, role='user', content='Cannot sleep'),
+        ])
         
         sessions = ChatSession.objects.filter(profile=self.profile)
         self.assertEqual(sessions.count(), 3)
@@ -377,20 +634,21 @@ class IntegrationTestCase(TestCase):
 class DocumentParsingTestCase(TestCase):
     """Tests for document parsing functionality."""
     
-    def setUp(self):
-        self.client = Client()
-        self.user_uid = uuid.uuid4()
-        self.profile = Profile.objects.create(
-            supabase_uid=self.user_uid,
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_uid = uuid.uuid4()
+        cls.profile = Profile.objects.create(
+            supabase_uid=cls.user_uid,
             email='doc_test@example.com',
             full_name='Doc Test User',
             onboarding_completed=True,
             onboarding_data={'full_name': 'Doc Test User'}
         )
-        self.mock_user = MagicMock()
-        self.mock_user.id = str(self.user_uid)
-        self.mock_user.email = 'doc_test@example.com'
-        self.mock_user.user_metadata = {}
+        cls.mock_user = SupabaseUser(id=str(cls.user_uid), email='doc_test@example.com', user_metadata={})
+
+    def setUp(self):
+        clear_model_cache()
+        caches['parse'].clear()
 
     @patch('api.ai_service.parse_document_to_records')
     @patch('api.decorators.get_supabase_user')
@@ -443,17 +701,17 @@ class DocumentParsingTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('No documents provided', response.json()['detail'])
 
+    @patch('api.views.MAX_UPLOAD_BYTES', 1024)
     @patch('api.decorators.get_supabase_user')
     def test_parse_documents_file_too_large(self, mock_auth):
         mock_auth.return_value = self.mock_user
         
         from django.core.files.uploadedfile import SimpleUploadedFile
         
-        # Create a file > 10MB
-        large_content = b'x' * (11 * 1024 * 1024)
+        # Shrink the limit rather than pushing an 11MB body through the test client
         test_file = SimpleUploadedFile(
             'large_file.txt',
-            large_content,
+            b'x' * 1025,
             content_type='text/plain'
         )
         
@@ -466,6 +724,17 @@ class DocumentParsingTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('exceeds 10MB limit', response.json()['detail'])
 
+    def test_parse_cache_key_tracks_prompt_version(self):
+        from api.ai_service import _parse_cache_key
+
+        documents = [{'type': 'text', 'name': 'notes.txt', 'content': 'BP 120/80'}]
+        before = _parse_cache_key('document', documents, '')
+        with patch('api.ai_service.PARSE_PROMPT_VERSION', 2):
+            after = _parse_cache_key('document', documents, '')
+
+        self.assertNotEqual(before, after)
+        self.assertNotEqual(before, _parse_cache_key('records', documents, ''))
+
     @patch('api.ai_service.settings')
     def test_parse_document_with_gemini_no_api_key(self, mock_settings):
         from api.ai_service import parse_document_with_gemini
@@ -479,39 +748,23 @@ class DocumentParsingTestCase(TestCase):
 
     @patch('api.ai_service.genai')
     @patch('api.ai_service.settings')
-    def test_parse_document_with_gemini_success(self, mock_settings, mock_genai):
+    def test_parse_document_with_gemini(self, mock_settings, mock_genai):
         from api.ai_service import parse_document_with_gemini
         
         mock_settings.GEMINI_API_KEY = 'test-key'
-        mock_model = MagicMock()
-        mock_response = MagicMock()
-        mock_response.text = '{"blood_pressure": "130/85", "heart_rate": "72"}'
-        mock_model.generate_content.return_value = mock_response
-        mock_genai.GenerativeModel.return_value = mock_model
-        
-        result = parse_document_with_gemini(
-            [{'type': 'text', 'name': 'report.txt', 'content': 'BP: 130/85, HR: 72'}],
-            {}
-        )
-        
-        self.assertEqual(result['blood_pressure'], '130/85')
-        self.assertEqual(result['heart_rate'], '72')
-
-    @patch('api.ai_service.genai')
-    @patch('api.ai_service.settings')
-    def test_parse_document_handles_markdown_response(self, mock_settings, mock_genai):
-        from api.ai_service import parse_document_with_gemini
-        
-        mock_settings.GEMINI_API_KEY = 'test-key'
-        mock_model = MagicMock()
-        mock_response = MagicMock()
-        mock_response.text = '```json\n{"allergies": "Penicillin"}\n```'
-        mock_model.generate_content.return_value = mock_response
-        mock_genai.GenerativeModel.return_value = mock_model
-        
-        result = parse_document_with_gemini(
-            [{'type': 'text', 'name': 'notes.txt', 'content': 'Allergic to Penicillin'}],
-            {}
-        )
-        
-        self.assertEqual(result['allergies'], 'Penicillin')
+        cases = [
+            ('{"blood_pressure": "130/85", "heart_rate": "72"}', {'blood_pressure': '130/85', 'heart_rate': '72'}),
+            ('{"allergies": "Penicillin"}', {'allergies': 'Penicillin'}),
+        ]
+        for response_text, expected in cases:
+            with self.subTest(response_text=response_text):
+                clear_model_cache()
+                mock_response = SimpleNamespace(text=response_text)
+                mock_genai.GenerativeModel.return_value = SimpleNamespace(generate_content=lambda *a, **k: mock_response)
+                documents = [{'type': 'text', 'name': 'notes.txt', 'content': response_text}]
+                
+                result = parse_document_with_gemini(documents, {})
+                
+                generation_config = mock_genai.GenerativeModel.call_args.kwargs['generation_config']
+                self.assertEqual(generation_config['response_mime_type'], 'application/json')
+                self.assertEqual(result, expected)
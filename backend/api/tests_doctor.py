@@ -0,0 +1,347 @@
+"""
+Tests for the doctor dashboard service.
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .doctor_service import (
+    CASE_SUMMARY_INSTRUCTIONS, TIMELINE_MODEL, get_patient_dashboard_data, get_patient_dashboard_with_summary,
+)
+from .models import Appointment, Profile
+
+
+class FakeResponse:
+    def __init__(self, status, body=None):
+        self.status = status
+        self.ok = status < 400
+        self.body = body or {}
+
+    async def json(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Stand-in aiohttp session replaying canned responses and tracking concurrency."""
+
+    def __init__(self, statuses, delay=0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+
+    def post(self, url, json, timeout):
+        session = self
+        status = self.statuses.pop(0)
+
+        class Response(FakeResponse):
+            async def __aenter__(self):
+                session.calls += 1
+                session.in_flight += 1
+                session.peak = max(session.peak, session.in_flight)
+                await asyncio.sleep(session.delay)
+                return self
+
+            async def __aexit__(self, *exc):
+                session.in_flight -= 1
+                return False
+
+        return Response(status, {'candidates': [{'content': {'parts': [{'text': 'ok'}]}}]})
+
+
+def stream_of(*chunks):
+    """Fake _gemini_stream yielding the given text chunks."""
+    async def fake_stream(session, url, payload, timeout):
+        for chunk in chunks:
+            yield chunk
+    return fake_stream
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class DoctorDashboardTestCase(TestCase):
+    """Tests for dashboard assembly and its Gemini calls."""
+
+    def setUp(self):
+        cache.clear()
+        self.profile = Profile.objects.create(
+            supabase_uid=uuid.uuid4(),
+            email='patient@test.com',
+            full_name='Test Patient',
+            onboarding_data={'age': 40, 'height': 180, 'weight': 81, 'symptoms_current': 'cough'}
+        )
+
+    @patch('api.doctor_service._gemini_stream')
+    def test_dashboard_includes_timeline(self, mock_stream):
+        mock_stream.side_effect = stream_of('```json\n[{"symptom": ', '"cough"}]\n```')
+
+        data = get_patient_dashboard_data(self.profile)
+
+        self.assertEqual(data['vitals']['bmi'], 25.0)
+        self.assertEqual(data['symptom_timeline'], [{'symptom': 'cough'}])
+        url = mock_stream.call_args.args[1]
+        self.assertIn(f'{TIMELINE_MODEL}:streamGenerateContent', url)
+        self.assertIn('alt=sse', url)
+
+    @patch('api.doctor_service._gemini_stream')
+    def test_timeline_parses_once_array_closes(self, mock_stream):
+        async def fake_stream(session, url, payload, timeout):
+            yield '[{"symptom": "cough", "notes": [1]'
+            yield '}]'
+            raise AssertionError('stream read past the closing bracket')
+
+        mock_stream.side_effect = fake_stream
+
+        data = get_patient_dashboard_data(self.profile)
+
+        self.assertEqual(data['symptom_timeline'], [{'symptom': 'cough', 'notes': [1]}])
+
+    @patch('api.doctor_service._gemini_stream')
+    @patch('api.doctor_service._gemini_post')
+    def test_summary_and_timeline_run_concurrently(self, mock_post, mock_stream):
+        in_flight = []
+        peak = []
+
+        async def fake_post(session, url, payload, timeout):
+            in_flight.append(url)
+            await asyncio.sleep(0.01)
+            peak.append(len(in_flight))
+            return 200, {'candidates': [{'content': {'parts': [{'text': 'Case summary'}]}}]}
+
+        async def fake_stream(session, url, payload, timeout):
+            in_flight.append(url)
+            await asyncio.sleep(0.01)
+            peak.append(len(in_flight))
+            yield '[]'
+
+        mock_post.side_effect = fake_post
+        mock_stream.side_effect = fake_stream
+
+        data, summary = get_patient_dashboard_with_summary(self.profile, 'Follow-up')
+
+        self.assertEqual(summary, 'Case summary')
+        self.assertEqual(data['symptom_timeline'], [])
+        self.assertEqual(max(peak), 2)
+
+    @patch('api.doctor_service._gemini_stream')
+    @patch('api.doctor_service._gemini_post')
+    def test_summary_reports_http_error(self, mock_post, mock_stream):
+        mock_post.return_value = (503, {})
+        mock_stream.side_effect = stream_of('[]')
+
+        _, summary = get_patient_dashboard_with_summary(self.profile)
+
+        self.assertEqual(summary, 'AI service error: 503')
+
+    @patch('api.doctor_service._gemini_stream')
+    @patch('api.doctor_service._gemini_post')
+    def test_summary_sends_fixed_instructions_as_system_prefix(self, mock_post, mock_stream):
+        mock_post.return_value = (200, {'candidates': [{'content': {'parts': [{'text': 'Case summary'}]}}]})
+        mock_stream.side_effect = stream_of('[]')
+
+        get_patient_dashboard_with_summary(self.profile, 'Follow-up')
+
+        payload = mock_post.call_args.args[2]
+        self.assertEqual(payload['systemInstruction']['parts'][0]['text'], CASE_SUMMARY_INSTRUCTIONS)
+        user_text = payload['contents'][0]['parts'][0]['text']
+        self.assertTrue(user_text.startswith('PATIENT DATA:'))
+        self.assertIn('APPOINTMENT REASON: Follow-up', user_text)
+        self.assertNotIn('PATIENT DATA', CASE_SUMMARY_INSTRUCTIONS)
+
+    @patch('api.doctor_service._gemini_stream')
+    @patch('api.doctor_service._gemini_post')
+    def test_summary_builds_on_health_summary(self, mock_post, mock_stream):
+        mock_post.return_value = (200, {'candidates': [{'content': {'parts': [{'text': 'Case summary'}]}}]})
+        mock_stream.side_effect = stream_of('[]')
+        self.profile.health_summary = 'ECG Analysis: Normal sinus rhythm.'
+        self.profile.onboarding_data.update({
+            'conditions': 'Type 2 diabetes',
+            'medical_history': 'Appendectomy in 2015',
+            'past_reports': 'HbA1c 7.1',
+            'allergies': 'Penicillin',
+            'emergency_contact_phone': '+911234567890',
+        })
+
+        get_patient_dashboard_with_summary(self.profile, 'Follow-up')
+
+        user_text = mock_post.call_args.args[2]['contents'][0]['parts'][0]['text']
+        self.assertIn('ECG Analysis: Normal sinus rhythm.', user_text)
+        self.assertIn('Penicillin', user_text)
+        for history in ('Type 2 diabetes', 'Appendectomy in 2015', 'HbA1c 7.1'):
+            self.assertIn(history, user_text)
+        self.assertNotIn('+911234567890', user_text)
+
+    @patch('api.doctor_service._gemini_stream')
+    def test_timeline_skips_gemini_without_symptom_data(self, mock_stream):
+        self.profile.onboarding_data = {'age': 40, 'height': 180}
+
+        data = get_patient_dashboard_data(self.profile)
+
+        self.assertEqual(data['symptom_timeline'], [])
+        mock_stream.assert_not_called()
+
+    @patch('api.doctor_service._gemini_stream')
+    def test_unchanged_data_reuses_cached_results(self, mock_stream):
+        mock_stream.side_effect = stream_of('[]')
+
+        get_patient_dashboard_data(self.profile)
+        get_patient_dashboard_data(self.profile)
+        self.assertEqual(mock_stream.call_count, 1)
+
+        self.profile.onboarding_data['symptoms_current'] = 'fever'
+        get_patient_dashboard_data(self.profile)
+        self.assertEqual(mock_stream.call_count, 2)
+
+    @patch('api.doctor_service._gemini_stream')
+    def test_requests_share_one_keepalive_session(self, mock_stream):
+        mock_stream.side_effect = Exception('Gemini API error: 503')
+
+        get_patient_dashboard_data(self.profile)
+        get_patient_dashboard_data(self.profile)
+
+        first_session, second_session = (c.args[0] for c in mock_stream.call_args_list)
+        self.assertIs(first_session, second_session)
+        self.assertFalse(first_session.closed)
+
+    @patch('api.doctor_service._gemini_stream')
+    @patch('api.doctor_service._gemini_post')
+    def test_errors_are_not_cached(self, mock_post, mock_stream):
+        mock_post.return_value = (503, {})
+        mock_stream.side_effect = Exception('Gemini API error: 503')
+
+        data, _ = get_patient_dashboard_with_summary(self.profile, 'Follow-up')
+        get_patient_dashboard_with_summary(self.profile, 'Follow-up')
+
+        self.assertEqual(data['symptom_timeline'][0]['notes'], 'Current symptoms as reported')
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_stream.call_count, 2)
+
+
+class GeminiTransportTestCase(TestCase):
+    """Tests for the rate-limit guards around doctor-service Gemini calls."""
+
+    @patch('api.doctor_service._backoff_delay', return_value=0)
+    def test_post_retries_rate_limited_requests(self, mock_backoff):
+        from .doctor_service import _gemini_post, _run
+
+        session = FakeSession([429, 503, 200])
+        status, data = _run(_gemini_post(session, 'url', {}, timeout=5))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(session.calls, 3)
+
+    def test_post_does_not_retry_client_errors(self):
+        from .doctor_service import _gemini_post, _run
+
+        session = FakeSession([400, 200])
+        status, data = _run(_gemini_post(session, 'url', {}, timeout=5))
+
+        self.assertEqual((status, data), (400, {}))
+        self.assertEqual(session.calls, 1)
+
+    def test_in_flight_calls_are_bounded(self):
+        from .doctor_service import _gemini_post, _run
+
+        session = FakeSession([200] * 6, delay=0.01)
+
+        async def burst():
+            await asyncio.gather(*(_gemini_post(session, 'url', {}, timeout=5) for _ in range(6)))
+
+        with patch('api.doctor_service._gemini_slots', asyncio.Semaphore(2)):
+            _run(burst())
+
+        self.assertEqual(session.calls, 6)
+        self.assertEqual(session.peak, 2)
+
+
+class MedicationOverviewTestCase(TestCase):
+    """Tests for the memoized medication overview."""
+
+    def test_overview_parsed_once_per_text(self):
+        from .doctor_service import _split_list, generate_medication_overview
+
+        _split_list.cache_clear()
+        data = {'medications': 'Metformin, Lisinopril', 'allergies': 'Penicillin'}
+        first = generate_medication_overview(data)
+        second = generate_medication_overview(dict(data))
+
+        self.assertEqual(first, second)
+        self.assertEqual(_split_list.cache_info().misses, 2)
+        self.assertEqual([m['name'] for m in first['current_medications']], ['Metformin', 'Lisinopril'])
+        self.assertEqual(first['warnings'][0]['type'], 'allergy')
+
+    def test_overview_is_not_shared_between_callers(self):
+        from .doctor_service import generate_medication_overview
+
+        data = {'medications': 'Metformin', 'allergies': 'Penicillin'}
+        first = generate_medication_overview(data)
+        first['current_medications'][0]['dosage'] = '500 mg'
+        first['warnings'].clear()
+
+        second = generate_medication_overview(data)
+
+        self.assertEqual(second['current_medications'][0]['dosage'], 'Not specified')
+        self.assertEqual(len(second['warnings']), 1)
+
+@override_settings(GEMINI_API_KEY='test-key')
+class PrecomputeCaseSummariesTestCase(TestCase):
+    """Tests for overnight case-summary precomputation."""
+
+    def setUp(self):
+        cache.clear()
+        self.profile = Profile.objects.create(
+            supabase_uid=uuid.uuid4(),
+            email='patient@test.com',
+            full_name='Test Patient',
+            onboarding_data={'age': 40}
+        )
+        self.appointment = Appointment.objects.create(
+            profile=self.profile, hospital_name='City Hospital', status='confirmed',
+            purpose='Chest pain', appointment_date=timezone.localdate() + timedelta(days=1)
+        )
+
+    @patch('api.doctor_service._gemini_post')
+    def test_precomputed_summary_is_served_without_gemini(self, mock_post):
+        mock_post.return_value = (200, {'candidates': [{'content': {'parts': [{'text': 'Case summary'}]}}]})
+
+        out = StringIO()
+        call_command('precompute_case_summaries', stdout=out)
+
+        self.assertIn('Precomputed 1 of 1', out.getvalue())
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.ai_case_summary, 'Case summary')
+
+        mock_post.reset_mock()
+        response = self.client.post(
+            f'/api/doctor/patients/{self.profile.supabase_uid}/summary/',
+            data=json.dumps({'appointment_id': self.appointment.id}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='Doctor token'
+        )
+
+        self.assertEqual(response.json()['summary'], 'Case summary')
+        mock_post.assert_not_called()
+
+    @patch('api.doctor_service._gemini_post')
+    def test_failed_summaries_are_not_stored(self, mock_post):
+        mock_post.return_value = (503, {})
+
+        call_command('precompute_case_summaries', stdout=StringIO())
+
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.ai_case_summary, '')
@@ -8,11 +8,12 @@ import uuid
 from unittest.mock import patch, MagicMock
 from datetime import date
 
+from django.core.cache import caches
 from django.test import TestCase, Client
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from api.models import Profile, MedicalRecord
-from api.ai_service import parse_document_to_records
+from api.ai_service import parse_document_to_records, clear_model_cache
 
 
 class MockSupabaseUser:
@@ -185,6 +186,10 @@ class MedicalRecordModelTestCase(TestCase):
 class ParseDocumentToRecordsTestCase(TestCase):
     """Unit tests for parse_document_to_records function."""
     
+    def setUp(self):
+        clear_model_cache()
+        caches['parse'].clear()
+
     @patch('api.ai_service.genai')
     @patch('api.ai_service.settings')
     def test_parse_single_lab_report(self, mock_settings, mock_genai):
@@ -198,10 +203,10 @@ class ParseDocumentToRecordsTestCase(TestCase):
                 'category': 'lab_reports',
                 'title': 'Dengue NS1 Antigen Test',
                 'summary': 'Positive for dengue fever',
-                'details': {
-                    'NS1 Antigen': 'Positive',
-                    'Method': 'ELISA'
-                },
+                'details': [
+                    {'name': 'NS1 Antigen', 'value': 'Positive'},
+                    {'name': 'Method', 'value': 'ELISA'}
+                ],
                 'doctor': 'Dr. Sharma',
                 'facility': 'Apollo Labs',
                 'record_date': '2024-01-15',
@@ -222,8 +227,34 @@ class ParseDocumentToRecordsTestCase(TestCase):
         self.assertEqual(result['records'][0]['category'], 'lab_reports')
         self.assertEqual(result['records'][0]['title'], 'Dengue NS1 Antigen Test')
         self.assertEqual(result['records'][0]['status'], 'critical')
+        self.assertEqual(result['records'][0]['details'], {'NS1 Antigen': 'Positive', 'Method': 'ELISA'})
         self.assertIn('dengue fever', result['health_summary'])
 
+    @patch('api.ai_service.genai')
+    @patch('api.ai_service.settings')
+    def test_parse_reuses_cached_result_for_same_content(self, mock_settings, mock_genai):
+        """Re-parsing identical content is served from the parse cache."""
+        mock_settings.GEMINI_API_KEY = 'test-key'
+        mock_model = MagicMock()
+        mock_model.generate_content.return_value = MagicMock(text=json.dumps({
+            'records': [{'category': 'vitals', 'title': 'BP Reading', 'status': 'normal'}],
+            'health_summary': 'Stable.'
+        }))
+        mock_genai.GenerativeModel.return_value = mock_model
+
+        first = parse_document_to_records(
+            [{'type': 'text', 'name': 'bp.txt', 'content': 'BP 120/80'}], ''
+        )
+        second = parse_document_to_records(
+            [{'type': 'text', 'name': 'bp-copy.txt', 'content': 'BP 120/80'}], ''
+        )
+        parse_document_to_records(
+            [{'type': 'text', 'name': 'bp.txt', 'content': 'BP 120/80'}], 'Known hypertension.'
+        )
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_model.generate_content.call_count, 2)
+
     @patch('api.ai_service.genai')
     @patch('api.ai_service.settings')
     def test_parse_multiple_records(self, mock_settings, mock_genai):
@@ -238,21 +269,21 @@ class ParseDocumentToRecordsTestCase(TestCase):
                     'category': 'lab_reports',
                     'title': 'CBC',
                     'summary': 'Low platelet count',
-                    'details': {'Platelet Count': '95000'},
+                    'details': [{'name': 'Platelet Count', 'value': '95000'}],
                     'status': 'attention'
                 },
                 {
                     'category': 'diagnoses',
                     'title': 'Dengue Fever',
                     'summary': 'Confirmed diagnosis',
-                    'details': {'Type': 'Primary infection'},
+                    'details': [{'name': 'Type', 'value': 'Primary infection'}],
                     'status': 'critical'
                 },
                 {
                     'category': 'prescriptions',
                     'title': 'Paracetamol 500mg',
                     'summary': 'For fever management',
-                    'details': {'Frequency': 'Every 6 hours'},
+                    'details': [{'name': 'Frequency', 'value': 'Every 6 hours'}],
                     'status': 'normal'
                 }
             ],
@@ -276,13 +307,13 @@ class ParseDocumentToRecordsTestCase(TestCase):
 
     @patch('api.ai_service.genai')
     @patch('api.ai_service.settings')
-    def test_parse_handles_markdown_json(self, mock_settings, mock_genai):
-        """Test that markdown-wrapped JSON is handled correctly."""
+    def test_parse_requests_structured_json(self, mock_settings, mock_genai):
+        """Test that Gemini is asked for schema-constrained JSON and bad output degrades safely."""
         mock_settings.GEMINI_API_KEY = 'test-key'
         
         mock_model = MagicMock()
         mock_response = MagicMock()
-        mock_response.text = '```json\n{"records": [], "health_summary": "Test", "profile_updates": {}}\n```'
+        mock_response.text = '{"records": [{"title": "Missing category"}], "health_summary": "Test"}'
         mock_model.generate_content.return_value = mock_response
         mock_genai.GenerativeModel.return_value = mock_model
         
@@ -291,7 +322,10 @@ class ParseDocumentToRecordsTestCase(TestCase):
             ''
         )
         
-        self.assertEqual(result['health_summary'], 'Test')
+        generation_config = mock_genai.GenerativeModel.call_args.kwargs['generation_config']
+        self.assertEqual(generation_config['response_mime_type'], 'application/json')
+        self.assertIn('response_schema', generation_config)
+        self.assertEqual(result, {'records': [], 'health_summary': '', 'profile_updates': {}})
 
     @patch('api.ai_service.settings')
     def test_parse_no_api_key(self, mock_settings):
@@ -324,6 +358,65 @@ class ParseDocumentToRecordsTestCase(TestCase):
         
         self.assertIn('Gemini API error', str(context.exception))
 
+    @patch('api.ai_service.genai')
+    @patch('api.ai_service.settings')
+    def test_parse_decodes_base64_image_once(self, mock_settings, mock_genai):
+        """Test that base64 image payloads reach Gemini as raw bytes."""
+        import base64
+        
+        mock_settings.GEMINI_API_KEY = 'test-key'
+        
+        mock_model = MagicMock()
+        mock_model.generate_content.return_value.text = '{"records": [], "health_summary": ""}'
+        mock_genai.GenerativeModel.return_value = mock_model
+        
+        parse_document_to_records([{
+            'type': 'image',
+            'name': 'scan.png',
+            'mime_type': 'image/png',
+            'data': base64.b64encode(b'png-bytes').decode('utf-8')
+        }], '')
+        
+        parts = mock_model.generate_content.call_args[0][0]
+        self.assertEqual(parts[1], {'mime_type': 'image/png', 'data': b'png-bytes'})
+
+    @patch('api.ai_service.genai')
+    @patch('api.ai_service.settings')
+    def test_parse_repairs_malformed_json_once(self, mock_settings, mock_genai):
+        """Test that malformed output gets a single repair pass before falling back."""
+        mock_settings.GEMINI_API_KEY = 'test-key'
+        
+        mock_model = MagicMock()
+        mock_model.generate_content.side_effect = [
+            MagicMock(text='{"records": [{"category": "vitals", "title": "BP"}], "health_summary": "Stable'),
+            MagicMock(text='{"records": [{"category": "vitals", "title": "BP"}], "health_summary": "Stable"}'),
+        ]
+        mock_genai.GenerativeModel.return_value = mock_model
+        
+        result = parse_document_to_records([{'type': 'text', 'name': 'bp.txt', 'content': 'BP 120/80'}], '')
+        
+        self.assertEqual(result['records'][0]['title'], 'BP')
+        self.assertEqual(result['health_summary'], 'Stable')
+        self.assertEqual(mock_model.generate_content.call_count, 2)
+        self.assertIn('Fix this malformed JSON', mock_model.generate_content.call_args[0][0])
+
+    def test_build_document_parts_merges_text_documents(self):
+        """Test that consecutive text documents share a single content part."""
+        from api.ai_service import build_document_parts
+        
+        parts = build_document_parts('instruction', [
+            {'type': 'text', 'name': 'a.txt', 'content': 'first'},
+            {'type': 'text', 'name': 'b.txt', 'content': 'second'},
+            {'type': 'image', 'name': 'c.png', 'mime_type': 'image/png', 'data': b'img'},
+            {'type': 'text', 'name': 'd.txt', 'content': 'x' * 20000},
+        ])
+        
+        self.assertEqual(parts[0], 'instruction')
+        self.assertEqual(parts[1], 'Document: a.txt\nfirst\n---\nDocument: b.txt\nsecond')
+        self.assertEqual(parts[2], {'mime_type': 'image/png', 'data': b'img'})
+        self.assertEqual(parts[3], '[Image: c.png]')
+        self.assertEqual(len(parts[4]), len('Document: d.txt\n') + 10000)
+
 
 class MedicalRecordsAPITestCase(TestCase):
     """Integration tests for medical records API endpoints."""
@@ -0,0 +1,226 @@
+"""
+Tests for specialty recommendations and nearby-place lookups.
+"""
+
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import orjson
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .recommendations_service import (
+    RECOMMENDATION_INSTRUCTIONS, _geocode, _gemini_breaker, _maps_breaker, geocode_location, geocode_locations_bulk, get_full_recommendations,
+    get_place_details, get_specialty_recommendations, search_nearby_places,
+)
+
+
+def json_reply(body: dict) -> MagicMock:
+    return MagicMock(ok=True, content=orjson.dumps(body))
+
+
+def gemini_reply(*chunks: str) -> MagicMock:
+    """Streamed Gemini reply delivering the text in the given SSE chunks."""
+    lines = [b'data: ' + orjson.dumps({'candidates': [{'content': {'parts': [{'text': c}]}}]}) for c in chunks]
+    return MagicMock(ok=True, iter_lines=lambda: iter(lines))
+
+
+@override_settings(GEMINI_API_KEY='test-key', GOOGLE_MAPS_API_KEY='maps-key')
+class RecommendationsServiceTestCase(TestCase):
+    """Tests for the recommendations service."""
+
+    def setUp(self):
+        cache.clear()
+        _geocode.cache_clear()
+        _gemini_breaker.reset()
+        _maps_breaker.reset()
+
+    @patch('api.recommendations_service._http')
+    def test_calls_share_pooled_session(self, mock_http):
+        mock_http.post.return_value = gemini_reply('[{"specialty": "Cardiologist", "priority": 1}]')
+        mock_http.get.return_value = json_reply({
+            'results': [{'geometry': {'location': {'lat': 18.5, 'lng': 73.8}}}]
+        })
+
+        recs = get_specialty_recommendations({'symptoms_current': 'chest pain'})
+        coords = geocode_location('Pune')
+
+        self.assertEqual(recs[0]['specialty'], 'Cardiologist')
+        self.assertEqual(coords, {'lat': 18.5, 'lng': 73.8})
+        mock_http.post.assert_called_once()
+        mock_http.get.assert_called_once()
+
+    @patch('api.recommendations_service._http')
+    def test_unchanged_onboarding_reuses_cached_recommendations(self, mock_http):
+        mock_http.post.return_value = gemini_reply(
+            '[{"specialty": "Neurologist", "priority": 2}, {"specialty": "Cardiologist", "priority": 1}]'
+        )
+
+        first = get_specialty_recommendations({'symptoms_current': 'chest pain'})
+        second = get_specialty_recommendations({'symptoms_current': 'chest pain'})
+        self.assertEqual(first, second)
+        self.assertEqual([r['specialty'] for r in second], ['Cardiologist', 'Neurologist'])
+        self.assertEqual(mock_http.post.call_count, 1)
+
+        get_specialty_recommendations({'symptoms_current': 'headache'})
+        self.assertEqual(mock_http.post.call_count, 2)
+
+    @patch('api.recommendations_service._http')
+    def test_fixed_instructions_sent_as_system_prefix(self, mock_http):
+        mock_http.post.return_value = gemini_reply('[]')
+
+        get_specialty_recommendations({'symptoms_current': 'chest pain'})
+
+        payload = mock_http.post.call_args.kwargs['json']
+        self.assertEqual(payload['systemInstruction']['parts'][0]['text'], RECOMMENDATION_INSTRUCTIONS)
+        user_text = payload['contents'][0]['parts'][0]['text']
+        self.assertIn('Current Symptoms: chest pain', user_text)
+        self.assertNotIn('Return a JSON array', user_text)
+
+    @patch('api.recommendations_service._http')
+    def test_bulk_geocoding_looks_up_each_address_once(self, mock_http):
+        mock_http.get.side_effect = lambda url, params, timeout: json_reply({
+            'results': [{'geometry': {'location': {'lat': len(params['address']), 'lng': 0}}}]
+        })
+
+        coords = geocode_locations_bulk(['Pune', 'Mumbai', ' pune ', 'Pune'])
+
+        self.assertEqual([c['lat'] for c in coords], [4, 6, 4, 4])
+        self.assertEqual(mock_http.get.call_count, 2)
+
+    @patch('api.recommendations_service._http')
+    def test_failed_geocode_is_not_cached(self, mock_http):
+        mock_http.get.return_value = json_reply({'status': 'OVER_QUERY_LIMIT', 'results': []})
+
+        self.assertIsNone(geocode_location('Pune'))
+        self.assertIsNone(geocode_location('Pune'))
+
+        self.assertEqual(mock_http.get.call_count, 2)
+
+    @patch('api.recommendations_service._http')
+    def test_fenced_reply_is_parsed(self, mock_http):
+        mock_http.post.return_value = gemini_reply('```json\n[{"specialty": ', '"Dermatologist", "priority": 1}]\n```\n')
+
+        recs = get_specialty_recommendations({'symptoms_current': 'rash'})
+
+        self.assertEqual(recs, [{'specialty': 'Dermatologist', 'priority': 1}])
+
+    @patch('api.recommendations_service._http')
+    def test_stream_parsed_once_array_closes(self, mock_http):
+        def lines():
+            yield b'data: ' + orjson.dumps({'candidates': [{'content': {'parts': [{'text': '[{"specialty": "ENT", '}]}}]})
+            yield b''
+            yield b'data: ' + orjson.dumps({'candidates': [{'content': {'parts': [{'text': '"tags": [1]}]'}]}}]})
+            raise AssertionError('stream read past the closing bracket')
+
+        reply = MagicMock(ok=True, iter_lines=lines)
+        mock_http.post.return_value = reply
+
+        recs = get_specialty_recommendations({'symptoms_current': 'ear ache'})
+
+        self.assertEqual(recs, [{'specialty': 'ENT', 'tags': [1]}])
+        self.assertIn(':streamGenerateContent?alt=sse', mock_http.post.call_args.args[0])
+        self.assertTrue(mock_http.post.call_args.kwargs['stream'])
+        reply.close.assert_called_once()
+
+    @patch('api.recommendations_service._http')
+    def test_geocodes_shared_through_cache(self, mock_http):
+        mock_http.get.return_value = json_reply({'results': [{'geometry': {'location': {'lat': 18.5, 'lng': 73.8}}}]})
+
+        geocode_location('Pune')
+        _geocode.cache_clear()  # as if another worker process
+        coords = geocode_location('PUNE ')
+
+        self.assertEqual(coords, {'lat': 18.5, 'lng': 73.8})
+        mock_http.get.assert_called_once()
+
+    @patch('api.recommendations_service._http')
+    def test_place_details_cached(self, mock_http):
+        mock_http.get.return_value = json_reply({'result': {'name': 'City Hospital', 'url': 'https://maps'}})
+
+        first = get_place_details('place-1')
+        second = get_place_details('place-1')
+
+        self.assertEqual(first, second)
+        self.assertEqual(second['name'], 'City Hospital')
+        mock_http.get.assert_called_once()
+
+    @patch('api.recommendations_service._http')
+    def test_nearby_places_projected(self, mock_http):
+        places = [
+            {'place_id': f'p{i}', 'name': f'Clinic {i}', 'vicinity': 'MG Road', 'rating': 4.5,
+             'geometry': {'location': {'lat': 18.5, 'lng': 73.8}}, 'opening_hours': {'open_now': True}}
+            for i in range(7)
+        ]
+        mock_http.get.return_value = json_reply({'results': places})
+
+        results = search_nearby_places(18.5, 73.8, 'cardiologist')
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0], {
+            'place_id': 'p0', 'name': 'Clinic 0', 'address': 'MG Road', 'rating': 4.5, 'user_ratings_total': 0,
+            'lat': 18.5, 'lng': 73.8, 'open_now': True, 'types': [],
+        })
+
+    @patch('api.recommendations_service._http')
+    def test_open_breaker_skips_provider(self, mock_http):
+        mock_http.post.return_value = MagicMock(ok=False, status_code=503)
+
+        for i in range(_gemini_breaker.fail_max):
+            get_specialty_recommendations({'symptoms_current': f'cough {i}'})
+        recs = get_specialty_recommendations({'symptoms_current': 'chest pain'})
+
+        self.assertEqual([r['specialty'] for r in recs], ['General Physician', 'Cardiologist'])
+        self.assertEqual(mock_http.post.call_count, _gemini_breaker.fail_max)
+
+    @patch('api.recommendations_service._http')
+    def test_gemini_failure_falls_back(self, mock_http):
+        mock_http.post.return_value = MagicMock(ok=False, status_code=503)
+
+        recs = get_specialty_recommendations({'symptoms_current': 'knee pain'})
+
+        self.assertEqual([r['specialty'] for r in recs], ['General Physician', 'Orthopedic'])
+
+        get_specialty_recommendations({'symptoms_current': 'knee pain'})
+        self.assertEqual(mock_http.post.call_count, 2)
+
+    @override_settings(GEMINI_API_KEY='')
+    def test_fallback_matches_symptom_substrings(self):
+        recs = get_specialty_recommendations({'symptoms_current': 'Shortness of BREATHING, itchy skin'})
+        self.assertEqual([r['specialty'] for r in recs], ['General Physician', 'Cardiologist', 'Dermatologist'])
+
+        recs[0]['reason'] = 'changed'
+        again = get_specialty_recommendations({'conditions': 'Hypertension'})
+        self.assertEqual(again[0]['reason'], 'Primary care for overall health assessment and referrals.')
+        self.assertEqual(again[1]['specialty'], 'Cardiologist')
+
+    @patch('api.recommendations_service.get_specialty_recommendations')
+    @patch('api.recommendations_service.search_nearby_places')
+    def test_place_searches_run_concurrently(self, mock_search, mock_recs):
+        mock_recs.return_value = [
+            {'specialty': 'Cardiologist', 'search_term': 'cardiologist'},
+            {'specialty': 'Neurologist', 'search_term': 'neurologist'},
+            {'specialty': 'Orthopedic', 'search_term': 'orthopedic'},
+        ]
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def fake_search(lat, lng, term):
+            with lock:
+                in_flight.append(term)
+                peak.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.remove(term)
+            return [{'name': term}]
+
+        mock_search.side_effect = fake_search
+
+        result = get_full_recommendations({}, user_lat=18.5, user_lng=73.8)
+
+        self.assertEqual(result['places']['Neurologist'], [{'name': 'neurologist'}])
+        self.assertEqual(list(result['places']), ['Cardiologist', 'Neurologist', 'Orthopedic'])
+        self.assertGreater(max(peak), 1)
@@ -2,9 +2,9 @@ from django.urls import path
 
 from .views import (
     health, me, onboarding, parse_documents, chat_sessions, 
-    chat_session_detail, chat_send, recommendations, place_details, 
+    chat_session_detail, chat_send, chat_send_stream, recommendations, place_details, 
     medical_records, analyze_ecg, appointments, get_appointment, cancel_appointment,
-    call_response_webhook, call_status_webhook, call_retry_webhook,
+    call_response_webhook, call_next_webhook, call_status_webhook, call_retry_webhook,
     doctor_login, doctor_patients, doctor_patient_detail, doctor_generate_summary,
     doctor_update_patient, voice_transcribe, voice_tts, voice_conversation, voice_summary
 )
@@ -19,6 +19,7 @@ urlpatterns = [
     path('chat/sessions/', chat_sessions, name='chat_sessions'),
     path('chat/sessions/<int:session_id>/', chat_session_detail, name='chat_session_detail'),
     path('chat/sessions/<int:session_id>/send/', chat_send, name='chat_send'),
+    path('chat/sessions/<int:session_id>/send/stream/', chat_send_stream, name='chat_send_stream'),
     path('recommendations/', recommendations, name='recommendations'),
     path('place/<str:place_id>/', place_details, name='place_details'),
     
@@ -29,6 +30,7 @@ urlpatterns = [
     
     # Twilio webhooks (for real calls)
     path('appointments/call-response/<int:appointment_id>/', call_response_webhook, name='call_response_webhook'),
+    path('appointments/call-next/<int:appointment_id>/', call_next_webhook, name='call_next_webhook'),
     path('appointments/call-status/<int:appointment_id>/', call_status_webhook, name='call_status_webhook'),
     path('appointments/call-retry/<int:appointment_id>/', call_retry_webhook, name='call_retry_webhook'),
     
@@ -1,8 +1,9 @@
 import json
+import logging
 import uuid
 from typing import Any
 
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from twilio.twiml.voice_response import VoiceResponse, Gather
@@ -10,9 +11,17 @@ from twilio.twiml.voice_response import VoiceResponse, Gather
 from .decorators import supabase_required
 from .models import Profile, ChatSession, ChatMessage, Appointment
 from .supabase_auth import SupabaseUser
-from .ai_service import get_ai_response
+from .ai_service import CONTEXT_RECORD_CANDIDATES, aget_ai_response, stream_ai_response
 from .recommendations_service import get_full_recommendations, get_place_details
 
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB per uploaded file
+
+# Ends a streamed chat reply that failed; advertised in the X-Stream-Error-Marker
+# header so clients can tell an error (even mid-reply) from assistant text
+STREAM_ERROR_MARKER = '\n[[STREAM_ERROR]]\n'
+
 
 def health(_request):
     return JsonResponse({'status': 'ok'})
@@ -200,7 +209,7 @@ def parse_documents(request):
     documents_list = []
     filenames = []
     for f in files:
-        if f.size > 10 * 1024 * 1024:  # 10MB limit
+        if f.size > MAX_UPLOAD_BYTES:
             return JsonResponse({'detail': f'File {f.name} exceeds 10MB limit'}, status=400)
         
         filenames.append(f.name)
@@ -211,13 +220,12 @@ def parse_documents(request):
             except:
                 text = f"[PDF file: {f.name}]"
         elif 'image' in content_type:
-            import base64
-            image_data = base64.b64encode(f.read()).decode('utf-8')
+            # Raw bytes go straight into the Gemini blob; no base64 round-trip
             documents_list.append({
                 'type': 'image',
                 'name': f.name,
                 'mime_type': content_type,
-                'data': image_data
+                'data': f.read()
             })
             continue
         else:
@@ -370,9 +378,8 @@ def chat_session_detail(request, session_id: int):
         return JsonResponse({'detail': 'Invalid user id'}, status=400)
 
     try:
-        profile = Profile.objects.get(supabase_uid=supabase_uid)
-        session = ChatSession.objects.get(id=session_id, profile=profile)
-    except (Profile.DoesNotExist, ChatSession.DoesNotExist):
+        session = ChatSession.objects.get(id=session_id, profile__supabase_uid=supabase_uid)
+    except ChatSession.DoesNotExist:
         return JsonResponse({'detail': 'Not found'}, status=404)
 
     if request.method == 'DELETE':
@@ -398,7 +405,7 @@ def chat_session_detail(request, session_id: int):
 @csrf_exempt
 @require_http_methods(['POST'])
 @supabase_required
-def chat_send(request, session_id: int):
+async def chat_send(request, session_id: int):
     user: SupabaseUser = request.supabase_user  # type: ignore[attr-defined]
 
     try:
@@ -407,10 +414,12 @@ def chat_send(request, session_id: int):
         return JsonResponse({'detail': 'Invalid user id'}, status=400)
 
     try:
-        profile = Profile.objects.get(supabase_uid=supabase_uid)
-        session = ChatSession.objects.get(id=session_id, profile=profile)
-    except (Profile.DoesNotExist, ChatSession.DoesNotExist):
+        session = await ChatSession.objects.select_related('profile').aget(
+            id=session_id, profile__supabase_uid=supabase_uid
+        )
+    except ChatSession.DoesNotExist:
         return JsonResponse({'detail': 'Not found'}, status=404)
+    profile = session.profile
 
     try:
         payload = json.loads((request.body or b'{}').decode('utf-8'))
@@ -421,22 +430,22 @@ def chat_send(request, session_id: int):
     if not message_content:
         return JsonResponse({'detail': 'message is required'}, status=400)
 
-    user_message = ChatMessage.objects.create(
+    user_message = await ChatMessage.objects.acreate(
         session=session,
         role='user',
         content=message_content
     )
 
-    all_messages = list(session.messages.values('role', 'content'))
+    all_messages = [m async for m in session.messages.values('role', 'content')]
 
     # Get medical records for context
     from .models import MedicalRecord
-    medical_records = list(MedicalRecord.objects.filter(profile=profile).values(
+    medical_records = [r async for r in MedicalRecord.objects.filter(profile=profile).values(
         'category', 'title', 'summary', 'details', 'status', 'record_date'
-    )[:20])
+    )[:CONTEXT_RECORD_CANDIDATES]]
 
     try:
-        ai_response_text = get_ai_response(
+        ai_response_text = await aget_ai_response(
             all_messages,
             profile.onboarding_data or {},
             profile.health_summary or '',
@@ -445,7 +454,7 @@ def chat_send(request, session_id: int):
     except Exception as e:
         return JsonResponse({'detail': str(e)}, status=500)
 
-    ai_message = ChatMessage.objects.create(
+    ai_message = await ChatMessage.objects.acreate(
         session=session,
         role='ai',
         content=ai_response_text
@@ -453,9 +462,9 @@ def chat_send(request, session_id: int):
 
     if not session.title and len(all_messages) <= 2:
         session.title = message_content[:50]
-        session.save(update_fields=['title', 'updated_at'])
+        await session.asave(update_fields=['title', 'updated_at'])
     else:
-        session.save(update_fields=['updated_at'])
+        await session.asave(update_fields=['updated_at'])
 
     return JsonResponse({
         'user_message': {
@@ -473,6 +482,82 @@ def chat_send(request, session_id: int):
     })
 
 
+@csrf_exempt
+@require_http_methods(['POST'])
+@supabase_required
+def chat_send_stream(request, session_id: int):
+    """Send a chat message and stream the AI reply as plain text chunks."""
+    user: SupabaseUser = request.supabase_user  # type: ignore[attr-defined]
+
+    try:
+        supabase_uid = uuid.UUID(user.id)
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid user id'}, status=400)
+
+    try:
+        session = ChatSession.objects.select_related('profile').get(
+            id=session_id, profile__supabase_uid=supabase_uid
+        )
+    except ChatSession.DoesNotExist:
+        return JsonResponse({'detail': 'Not found'}, status=404)
+    profile = session.profile
+
+    try:
+        payload = json.loads((request.body or b'{}').decode('utf-8'))
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid JSON'}, status=400)
+
+    message_content = payload.get('message', '').strip()
+    if not message_content:
+        return JsonResponse({'detail': 'message is required'}, status=400)
+
+    ChatMessage.objects.create(
+        session=session,
+        role='user',
+        content=message_content
+    )
+
+    all_messages = list(session.messages.values('role', 'content'))
+
+    from .models import MedicalRecord
+    medical_records = list(MedicalRecord.objects.filter(profile=profile).values(
+        'category', 'title', 'summary', 'details', 'status', 'record_date'
+    )[:CONTEXT_RECORD_CANDIDATES])
+
+    def reply_stream():
+        chunks = []
+        try:
+            for chunk in stream_ai_response(
+                all_messages,
+                profile.onboarding_data or {},
+                profile.health_summary or '',
+                medical_records
+            ):
+                chunks.append(chunk)
+                yield chunk
+        except Exception:
+            logger.exception('Chat stream failed for session %s', session.id)
+            yield STREAM_ERROR_MARKER
+            return
+
+        ChatMessage.objects.create(
+            session=session,
+            role='ai',
+            content=''.join(chunks)
+        )
+        if not session.title and len(all_messages) <= 2:
+            session.title = message_content[:50]
+            session.save(update_fields=['title', 'updated_at'])
+        else:
+            session.save(update_fields=['updated_at'])
+
+    response = StreamingHttpResponse(reply_stream(), content_type='text/plain; charset=utf-8')
+    response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'no-cache'
+    response['X-Stream-Error-Marker'] = STREAM_ERROR_MARKER.strip()
+    return response
+
+
 @csrf_exempt
 @require_http_methods(['GET'])
 @supabase_required
@@ -596,7 +681,7 @@ def analyze_ecg(request):
     if not ecg_file:
         return JsonResponse({'detail': 'No ECG image provided'}, status=400)
     
-    if ecg_file.size > 10 * 1024 * 1024:
+    if ecg_file.size > MAX_UPLOAD_BYTES:
         return JsonResponse({'detail': 'File exceeds 10MB limit'}, status=400)
     
     allowed_types = ['image/jpeg', 'image/png', 'image/jpg']
@@ -810,7 +895,7 @@ def appointments(request):
             'doctor_name': appointment.doctor_name,
             'department': appointment.department,
             'notes': appointment.notes,
-            'transcript': appointment.call_transcript,
+            'transcript': appointment.transcript,
         },
         'message': 'Appointment booking processed'
     })
@@ -844,7 +929,7 @@ def get_appointment(request, appointment_id):
             'department': appointment.department,
             'purpose': appointment.purpose,
             'notes': appointment.notes,
-            'call_transcript': appointment.call_transcript,
+            'call_transcript': appointment.transcript,
             'call_duration': appointment.call_duration,
             'created_at': appointment.created_at.isoformat(),
             'updated_at': appointment.updated_at.isoformat(),
@@ -901,6 +986,24 @@ def call_response_webhook(request, appointment_id):
     return HttpResponse(twiml, content_type='application/xml')
 
 
+@csrf_exempt
+@require_http_methods(['POST', 'GET'])
+def call_next_webhook(request, appointment_id):
+    """Speak an in-call reply that was still generating when call-response returned."""
+    from .appointment_service import process_call_next
+    
+    callback_url = request.build_absolute_uri('/')[:-1]  # Base URL without trailing slash
+    
+    try:
+        attempt = int(request.GET.get('attempt', 0))
+    except ValueError:
+        attempt = 0
+    
+    twiml = process_call_next(appointment_id, callback_url, attempt)
+    
+    return HttpResponse(twiml, content_type='application/xml')
+
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def call_status_webhook(request, appointment_id):
@@ -928,7 +1031,7 @@ def call_retry_webhook(request, appointment_id):
     from .models import Appointment
     
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
+        appointment = Appointment.objects.select_related('profile').get(id=appointment_id)
         patient_info = appointment.profile.onboarding_data or {}
         patient_info['full_name'] = appointment.profile.full_name
         
@@ -1042,7 +1145,7 @@ def doctor_patient_detail(request, patient_id: str):
 @require_http_methods(['POST'])
 def doctor_generate_summary(request, patient_id: str):
     """Generate AI case summary for a patient."""
-    from .doctor_service import generate_ai_case_summary, get_patient_dashboard_data
+    from .doctor_service import get_patient_dashboard_with_summary
     
     auth_header = request.headers.get('Authorization', '')
     if not auth_header.startswith('Doctor '):
@@ -1059,9 +1162,16 @@ def doctor_generate_summary(request, patient_id: str):
     except ValueError:
         payload = {}
     
+    appointment_id = payload.get('appointment_id')
+    if appointment_id:
+        precomputed = Appointment.objects.filter(
+            id=appointment_id, profile=profile
+        ).exclude(ai_case_summary='').values_list('ai_case_summary', flat=True).first()
+        if precomputed:
+            return JsonResponse({'summary': precomputed})
+    
     reason = payload.get('reason', '')
-    patient_data = get_patient_dashboard_data(profile)
-    summary = generate_ai_case_summary(patient_data, reason)
+    _, summary = get_patient_dashboard_with_summary(profile, reason)
     
     return JsonResponse({'summary': summary})
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 import environ
@@ -39,8 +40,10 @@ CSRF_TRUSTED_ORIGINS = env.list('CSRF_TRUSTED_ORIGINS', default=[])
 
 SUPABASE_URL = env('SUPABASE_URL', default='')
 SUPABASE_ANON_KEY = env('SUPABASE_ANON_KEY', default='')
+SUPABASE_JWT_SECRET = env('SUPABASE_JWT_SECRET', default='')  # verifies access tokens locally when set
 
 GEMINI_API_KEY = env('GEMINI_API_KEY', default='')
+GEMINI_MAX_CONCURRENCY = env.int('GEMINI_MAX_CONCURRENCY', default=8)  # in-flight doctor-dashboard calls per process
 SARVAM_API_KEY = env('SARVAM_API_KEY', default='')  # For Indian language TTS
 DECODO_AUTH_TOKEN = env('DECODO_AUTH_TOKEN', default='')
 GOOGLE_MAPS_API_KEY = env('GOOGLE_MAPS_API_KEY', default='')
@@ -103,12 +106,15 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 import sys
 
-# Use SQLite for tests
-if 'test' in sys.argv:
+# Use in-memory SQLite for tests, under both `manage.py test` and pytest
+TESTING = 'test' in sys.argv or 'pytest' in sys.modules
+
+if TESTING:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'test_db.sqlite3',
+            'NAME': ':memory:',
+            'OPTIONS': {'timeout': 20},
         }
     }
 else:
@@ -131,6 +137,51 @@ else:
         }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Document parse results are content-addressed and reused for a week
+PARSE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+    'parse': {
+        **env.cache(
+            'PARSE_CACHE_URL',
+            default=f'filecache://{Path(tempfile.gettempdir()) / "doc-chat-parse-cache"}',
+        ),
+        'TIMEOUT': PARSE_CACHE_TIMEOUT,
+    },
+}
+
+if TESTING:
+    # Tests clear the parse cache freely; keep them off the on-disk cache shared
+    # with local dev servers and with the other xdist workers
+    CACHES['parse'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'parse',
+        'TIMEOUT': PARSE_CACHE_TIMEOUT,
+    }
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': env('API_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 